@@ -0,0 +1,296 @@
+"""Time and peak memory of the image and request hot paths, with regression checks.
+
+Image paths run on synthetic inputs from 512x512 up to 4096x4096 :
+- `normalize_array`, `linear_to_srgb_array`, `reverse_color` : the per pixel
+  functions of `src/functions/utils.py`
+- `convert_to_bytes` : PNG encoding of an RGB image
+- `process_depth_map` : the depth post-processing of `DepthRenderOperator`,
+  also checked against the exact formula (normalize, sRGB, reverse)
+- `workflow.build` : the request built by `SendRequestOperator`, for each
+  template (does not depend on the image size)
+
+Run from the repository root (no blender needed, bpy is stubbed when missing) :
+    python benchmarks/hot_paths.py --json results.json
+    python benchmarks/hot_paths.py --baseline results.json
+
+With `--baseline`, the run fails (exit code 1) when a case is slower or uses
+more memory than in the baseline by more than the tolerances, or when the
+depth map drifts from the exact formula by more than `MAX_DEPTH_ERROR`.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import types
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+if importlib.util.find_spec("bpy") is None:
+    # The fake-bpy-module package only ships type stubs : the functions
+    # benchmarked do not touch bpy, the module only has to import
+    class Stub(types.ModuleType):
+        def __getattr__(self, name):
+            return Stub(name)
+
+    sys.modules["bpy"] = Stub("bpy")
+
+from functions.utils import (  # noqa: E402
+    convert_to_bytes,
+    linear_to_srgb_array,
+    normalize_array,
+    process_depth_map,
+    reverse_color,
+)
+from functions.workflow import WORKFLOWS_DIR, get_workflow  # noqa: E402
+
+SIZES = (512, 1024, 2048, 4096)
+REPEATS = 5
+
+# Allowed increase over the baseline, as a fraction of the baseline value
+TIME_TOLERANCE = 0.25
+MEMORY_TOLERANCE = 0.10
+# Differences under these are noise, never reported as a regression
+MIN_TIME_DIFFERENCE_MS = 0.5
+MIN_MEMORY_DIFFERENCE_MB = 0.1
+
+# 8 bit levels the lookup table may differ from the exact depth formula
+MAX_DEPTH_ERROR = 1
+
+
+def synthetic_depth(size: int) -> np.ndarray:
+    """Depth pass as read from blender : a sphere in front of the far plane,
+    (size, size, 4) float32 with the depth in every color channel"""
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    sphere = 1 - ((x - 0.5) ** 2 + (y - 0.5) ** 2) * 4
+    depth = np.where(sphere > 0, 10 - 2 * np.sqrt(np.clip(sphere, 0, 1)), 1e10)
+    pixels = np.empty((size, size, 4), dtype=np.float32)
+    pixels[..., :3] = depth[..., None]
+    pixels[..., 3] = 1
+    return pixels
+
+
+def synthetic_color(size: int) -> Image.Image:
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    color = np.stack([x, y, (x + y) / 2], -1) * 255
+    color += rng.integers(-8, 8, color.shape)
+    return Image.fromarray(np.clip(color, 0, 255).astype(np.uint8))
+
+
+def reference_depth_map(pixels: np.ndarray) -> np.ndarray:
+    """Depth map with the exact per pixel formulas, as computed before the
+    lookup table"""
+    depth = pixels[::-1, :, 0].astype(np.float64)
+    background = depth.max()
+    farthest = depth[depth < background].max()
+    depth = np.minimum(depth, farthest * 1.05)
+    return reverse_color(linear_to_srgb_array(normalize_array(depth)))
+
+
+def request_parameters(model: str) -> dict:
+    """Parameters of a text to image request, as sent by `SendRequestOperator`"""
+    return {
+        "prompt": "an oak chair, carved wood",
+        "model": model,
+        "seed": 42,
+        "n_steps": 20,
+        "cfg_scale": 6.5,
+        "sampler_name": "euler",
+        "scheduler": "normal",
+        "controlnet_scale": 0.7,
+        "clip_skip": 1,
+        "batch_size": 1,
+        "depth_image": "depth.png",
+        "output_prefix": "texture_diffusion/1",
+        "use_lora": False,
+        "lora": "None",
+        "lora_scale": 1.0,
+        "toggle_inpainting": False,
+        "inpainting_image": "inpainting.png",
+        "mask_image": "mask.png",
+        "denoising_strength": 1.0,
+        "toggle_ipadapter": False,
+        "scale_ipadapter": 0.5,
+        "ipadapter_weight_type": "standard",
+        "ip_adapter_image": "",
+    }
+
+
+def measure(function: Callable[[], object], repeats: int) -> Dict[str, float]:
+    """Best time of `repeats` runs, and peak memory of a separate traced run
+    (numpy reports its buffers to tracemalloc)"""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"ms": round(best * 1000, 3), "peak_mb": round(peak / 2**20, 3)}
+
+
+def image_cases(size: int) -> Dict[str, Callable[[], object]]:
+    pixels = synthetic_depth(size)
+    depth = pixels[:, :, 0].copy()
+    linear = normalize_array(depth)
+    srgb = linear_to_srgb_array(linear)
+    color = synthetic_color(size)
+
+    return {
+        "normalize_array": lambda: normalize_array(depth),
+        "linear_to_srgb_array": lambda: linear_to_srgb_array(linear),
+        "reverse_color": lambda: reverse_color(srgb),
+        "convert_to_bytes": lambda: convert_to_bytes(color),
+        "process_depth_map": lambda: process_depth_map(pixels),
+    }
+
+
+def depth_error(size: int) -> int:
+    """Largest difference in 8 bit levels between the depth map and the exact
+    formula"""
+    pixels = synthetic_depth(size)
+    depth_map = process_depth_map(pixels)
+    assert depth_map is not None
+    reference = reference_depth_map(pixels)
+    return int(np.abs(depth_map.astype(np.int16) - reference.astype(np.int16)).max())
+
+
+def run(sizes: List[int], repeats: int) -> List[dict]:
+    results = []
+
+    for size in sizes:
+        for name, function in image_cases(size).items():
+            result = {"case": name, "size": size, **measure(function, repeats)}
+            if name == "process_depth_map":
+                result["max_error"] = depth_error(size)
+            results.append(result)
+            print_result(result)
+
+    for template in sorted(os.listdir(WORKFLOWS_DIR)):
+        path = str(WORKFLOWS_DIR / template)
+        parameters = request_parameters(f"{template.split('_')[0]}_model.safetensors")
+        # Same call as the operator : stat of the template, then the build
+        build = lambda: get_workflow(path).build(parameters)  # noqa: E731
+        result = {"case": f"workflow.build {template}", "size": None}
+        result.update(measure(build, repeats * 20))
+        results.append(result)
+        print_result(result)
+
+    return results
+
+
+def print_result(result: dict):
+    size = f"{result['size']}²" if result["size"] else "-"
+    line = f"{result['case']:<36} {size:>6} {result['ms']:>10.3f}"
+    line += f" {result['peak_mb']:>10.2f}"
+    if "max_error" in result:
+        line += f"  max error {result['max_error']}"
+    print(line)
+
+
+def regressions(
+    results: List[dict], baseline: List[dict], time_tolerance, memory_tolerance
+) -> List[str]:
+    """Cases worse than the baseline (same case and size) over the tolerances"""
+    reference = {(result["case"], result["size"]): result for result in baseline}
+    found = []
+
+    for result in results:
+        label = f"{result['case']} {result['size'] or ''}".strip()
+        if result.get("max_error", 0) > MAX_DEPTH_ERROR:
+            found.append(f"{label}: depth error {result['max_error']} levels")
+
+        before: Optional[dict] = reference.get((result["case"], result["size"]))
+        if before is None:
+            continue
+        if (
+            result["ms"] > before["ms"] * (1 + time_tolerance)
+            and result["ms"] - before["ms"] > MIN_TIME_DIFFERENCE_MS
+        ):
+            found.append(f"{label}: {before['ms']:.3f} ms -> {result['ms']:.3f} ms")
+        if (
+            result["peak_mb"] > before["peak_mb"] * (1 + memory_tolerance)
+            and result["peak_mb"] - before["peak_mb"] > MIN_MEMORY_DIFFERENCE_MB
+        ):
+            found.append(
+                f"{label}: {before['peak_mb']:.2f} MB -> {result['peak_mb']:.2f} MB"
+            )
+
+    return found
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(size) for size in SIZES),
+        help="Comma separated image sizes",
+    )
+    parser.add_argument("--repeats", type=int, default=REPEATS, help="Timed runs")
+    parser.add_argument("--json", default="", help="Write the results to this file")
+    parser.add_argument("--baseline", default="", help="Results to compare with")
+    parser.add_argument(
+        "--time-tolerance",
+        type=float,
+        default=TIME_TOLERANCE,
+        help="Allowed slowdown over the baseline, as a fraction",
+    )
+    parser.add_argument(
+        "--memory-tolerance",
+        type=float,
+        default=MEMORY_TOLERANCE,
+        help="Allowed peak memory increase over the baseline, as a fraction",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    print(f"{'case':<36} {'size':>6} {'ms':>10} {'peak MB':>10}")
+    results = run(sizes, args.repeats)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "numpy": np.__version__,
+                    "machine": platform.machine(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        found = regressions(
+            results, baseline, args.time_tolerance, args.memory_tolerance
+        )
+    else:
+        found = regressions(results, [], 0, 0)
+
+    for regression in found:
+        print(f"Regression {regression}")
+    sys.exit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Bytes on the wire and encode time of each transport encoding.
+
+Synthetic 1024x1024 conditioning images (a smooth depth map, a binary mask and
+a noisy color render) are encoded as the original RGB PNG and with the compact
+encodings of `src/functions/transport.py`.
+
+Run from the repository root (no blender needed) :
+    python benchmarks/transport_encodings.py
+"""
+
+import os
+import sys
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "functions"),
+)
+
+from transport import encode_for_transport  # noqa: E402
+
+SIZE = 1024
+REPEATS = 5
+
+
+def synthetic_images():
+    y, x = np.mgrid[0:SIZE, 0:SIZE].astype(np.float32) / SIZE
+    sphere = np.clip(1 - ((x - 0.5) ** 2 + (y - 0.5) ** 2) * 4, 0, 1)
+    depth = (np.sqrt(sphere) * 255).astype(np.uint8)
+    mask = np.where(sphere > 0.3, 255, 0).astype(np.uint8)
+
+    rng = np.random.default_rng(0)
+    color = np.stack(
+        [depth, (x * 255).astype(np.uint8), (y * 255).astype(np.uint8)], -1
+    )
+    color = np.clip(color + rng.integers(-8, 8, color.shape), 0, 255).astype(np.uint8)
+
+    return {
+        "depth": Image.fromarray(depth).convert("RGB"),
+        "mask": Image.fromarray(mask).convert("RGB"),
+        "color": Image.fromarray(color),
+    }
+
+
+def timed(encode):
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        data = encode()
+        best = min(best, time.perf_counter() - start)
+    return len(data), best * 1000
+
+
+def baseline(image):
+    # Previous encoding : RGB PNG with the default settings
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def main():
+    print(f"{'kind':<6} {'encoding':<22} {'bytes':>10} {'ratio':>6} {'ms':>8}")
+    for kind, image in synthetic_images().items():
+        reference, ms = timed(lambda: baseline(image))
+        print(
+            f"{kind:<6} {'RGB PNG (before)':<22} {reference:>10} {1:>6.2f} {ms:>8.1f}"
+        )
+
+        encodings = [(f"PNG zlib {level}", level, False) for level in (1, 6, 9)] + [
+            ("lossless WebP", 6, True)
+        ]
+        for label, level, allow_webp in encodings:
+            _, transport = encode_for_transport(image, kind, level, allow_webp)
+            if allow_webp and transport.format != "WEBP":
+                # Masks always travel as 1 bit PNG
+                continue
+            size, ms = timed(
+                lambda: encode_for_transport(image, kind, level, allow_webp)[0]
+            )
+            label = f"{transport.mode} {label}"
+            print(
+                f"{kind:<6} {label:<22} {size:>10} {size / reference:>6.2f} {ms:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+"""Spread a batch texturing manifest over several headless blender processes.
+
+    python scripts/batch_coordinator.py --blender blender --blend scene.blend \
+        --manifest assets.json --workers 4 \
+        --backends http://gpu1:8188,http://gpu2:8188 --output-dir batch/
+
+bpy work (renders, projections, textures) runs on a single thread per
+blender process, so one process cannot keep several ComfyUI GPUs busy. The
+coordinator starts `--workers` blender processes running `batch_texture.py`,
+each one bound to a backend (round robin over `--backends`), and hands them
+the assets one at a time through their standard input : a worker gets its
+next asset as soon as it is done with the previous one, so slow backends or
+heavy assets do not hold back the others. Workers report their progress on
+their standard output.
+
+- a failed asset is sent again (to the next free worker) up to `--retries`
+  times
+- a worker that exits is restarted from its last saved blend file, its asset
+  counts as a failed attempt
+- each worker saves its own blend file in the output folder, and writes its
+  textures to `worker_{index}/textures` : workers opening the same blend file
+  would otherwise number their generations alike and overwrite each other
+- each worker keeps its job queue, completion times and result cache in
+  `worker_{index}/config` (`CONFIG_DIR_VARIABLE`), not in the blender user
+  configuration shared by every process
+- `coordinator.jsonl` records the assets textured : running the same command
+  again only sends the others
+- throughput statistics (overall, per worker and per backend) are printed as
+  assets complete and written to `summary.json`
+
+This script does not use bpy, it runs with any python 3.
+"""
+
+import argparse
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+# Must match `EVENT_PREFIX` of `batch_texture.py`
+EVENT_PREFIX = "TD_EVENT "
+
+DRIVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "batch_texture.py")
+
+# Restarts of a worker process before it is given up
+MAX_RESTARTS = 3
+
+# Must match `CONFIG_DIR_VARIABLE` of `src/operators/job_operators.py`
+CONFIG_DIR_VARIABLE = "TEXTURE_DIFFUSION_CONFIG_DIR"
+
+
+class Worker:
+    """A blender process texturing the assets it is sent, one at a time"""
+
+    def __init__(self, index: int, backend: str, args):
+        self.index = index
+        self.backend = backend
+        self.args = args
+        self.output = os.path.join(args.output_dir, f"worker_{index}.blend")
+        self.log = os.path.join(args.output_dir, f"worker_{index}.jsonl")
+        # Files written by this worker only
+        self.folder = os.path.join(args.output_dir, f"worker_{index}")
+        self.render_dir = os.path.join(self.folder, "textures")
+        self.config_dir = os.path.join(self.folder, "config")
+
+        self.process: Optional[subprocess.Popen] = None
+        self.current: Optional[dict] = None
+        self.sent_at = 0.0
+        self.restarts = 0
+        self.closed = False
+
+        self.done = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+
+    @property
+    def name(self) -> str:
+        return f"worker {self.index}"
+
+    def command(self) -> List[str]:
+        # Restarted workers keep the textures of their previous assets
+        blend = self.output if os.path.exists(self.output) else self.args.blend
+        command = [
+            self.args.blender,
+            "-b",
+            blend,
+            "--python",
+            DRIVER,
+            "--",
+            "--manifest",
+            "-",
+            "--events",
+            "--log",
+            self.log,
+            "--output",
+            self.output,
+            "--timeout",
+            str(self.args.timeout),
+            "--render-dir",
+            self.render_dir,
+        ]
+        if self.backend:
+            command += ["--backend", self.backend]
+        return command
+
+    def environment(self) -> Dict[str, str]:
+        return {**os.environ, CONFIG_DIR_VARIABLE: os.path.abspath(self.config_dir)}
+
+    def start(self, events: "queue.Queue"):
+        self.process = subprocess.Popen(
+            self.command(),
+            env=self.environment(),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+        )
+        self.closed = False
+        threading.Thread(
+            target=read_events, args=(self, self.process, events), daemon=True
+        ).start()
+
+    def send(self, asset: dict) -> bool:
+        """False when the process is gone, its exit is handled separately"""
+        assert self.process is not None and self.process.stdin is not None
+        try:
+            self.process.stdin.write(json.dumps(asset) + "\n")
+            self.process.stdin.flush()
+        except OSError:
+            return False
+        self.current = asset
+        self.sent_at = time.monotonic()
+        return True
+
+    def finish_asset(self, success: bool):
+        self.busy_seconds += time.monotonic() - self.sent_at
+        if success:
+            self.done += 1
+        else:
+            self.failed += 1
+        self.current = None
+
+    def close(self):
+        """No more assets : the worker exits once its current asset is done"""
+        if self.process is not None and not self.closed:
+            self.closed = True
+            try:
+                assert self.process.stdin is not None
+                self.process.stdin.close()
+            except OSError:
+                pass
+
+
+def read_events(worker: Worker, process: subprocess.Popen, events: "queue.Queue"):
+    """Reader thread : forward the event lines of a worker, then its exit"""
+    assert process.stdout is not None
+    for line in process.stdout:
+        if line.startswith(EVENT_PREFIX):
+            try:
+                events.put((worker, json.loads(line[len(EVENT_PREFIX) :])))
+            except ValueError:
+                pass
+        elif worker.args.verbose:
+            print(f"[{worker.name}] {line}", end="")
+    process.wait()
+    events.put((worker, {"event": "exited", "code": process.returncode}))
+
+
+def asset_name(asset: dict) -> str:
+    return asset.get("name", asset["mesh"])
+
+
+class Coordinator:
+    def __init__(self, args, assets: List[dict]):
+        self.args = args
+        self.events: "queue.Queue" = queue.Queue()
+        self.journal = os.path.join(args.output_dir, "coordinator.jsonl")
+
+        done = self.done_assets()
+        self.pending: Deque[dict] = deque(
+            asset for asset in assets if asset_name(asset) not in done
+        )
+        self.total = len(self.pending)
+        self.attempts: Dict[str, int] = {}
+        self.failures: Dict[str, str] = {}
+        self.textured = 0
+
+        backends = [url for url in args.backends.split(",") if url] or [""]
+        self.workers = [
+            Worker(index, backends[index % len(backends)], args)
+            for index in range(args.workers)
+        ]
+        self.started_at = time.monotonic()
+
+    def done_assets(self) -> set:
+        done = set()
+        if os.path.exists(self.journal):
+            with open(self.journal) as f:
+                for line in f:
+                    try:
+                        done.add(json.loads(line)["asset"])
+                    except (ValueError, KeyError):
+                        continue
+        return done
+
+    def record(self, asset: str, worker: Worker, event: dict):
+        with open(self.journal, "a") as f:
+            record = {
+                "asset": asset,
+                "worker": worker.index,
+                "backend": worker.backend,
+                "id": event.get("id"),
+            }
+            f.write(json.dumps(record) + "\n")
+
+    def run(self) -> int:
+        if not self.pending:
+            print("Every asset of the manifest is already textured")
+            return 0
+
+        print(f"{self.total} assets on {len(self.workers)} workers")
+        for worker in self.workers:
+            worker.start(self.events)
+        self.dispatch()
+
+        while any(worker.process is not None for worker in self.workers):
+            worker, event = self.events.get()
+            self.handle(worker, event)
+            self.dispatch()
+
+        for asset in self.pending:
+            self.failures[asset_name(asset)] = "No worker left"
+        self.write_summary()
+        return 1 if self.failures else 0
+
+    def dispatch(self):
+        """Send the pending assets to the idle workers. Once every asset is
+        done, the workers are closed : an idle worker waits meanwhile, as a
+        failed asset may be sent again"""
+        for worker in self.workers:
+            if not self.pending:
+                break
+            idle = worker.process is not None and worker.current is None
+            if idle and not worker.closed and worker.send(self.pending[0]):
+                self.pending.popleft()
+
+        if not self.pending and all(worker.current is None for worker in self.workers):
+            for worker in self.workers:
+                worker.close()
+
+    def retry(self, asset: dict, error: str):
+        name = asset_name(asset)
+        self.attempts[name] = self.attempts.get(name, 0) + 1
+        if self.attempts[name] <= self.args.retries:
+            print(f"{name} failed ({error}), attempt {self.attempts[name] + 1}")
+            self.pending.append(asset)
+        else:
+            print(f"{name} failed after {self.attempts[name]} attempts: {error}")
+            self.failures[name] = error
+
+    def handle(self, worker: Worker, event: dict):
+        kind = event.get("event")
+
+        if kind in ("applied", "skipped") and worker.current is not None:
+            self.record(asset_name(worker.current), worker, event)
+            worker.finish_asset(True)
+            self.textured += 1
+            self.print_progress()
+
+        elif kind == "failed" and worker.current is not None:
+            asset = worker.current
+            worker.finish_asset(False)
+            self.retry(asset, event.get("error", ""))
+
+        elif kind == "exited":
+            worker.process = None
+            if worker.current is not None:
+                asset = worker.current
+                worker.finish_asset(False)
+                self.retry(asset, f"{worker.name} exited ({event.get('code')})")
+            if self.pending and worker.restarts < MAX_RESTARTS:
+                worker.restarts += 1
+                print(f"Restarting {worker.name}")
+                try:
+                    worker.start(self.events)
+                except OSError as e:
+                    print(f"Could not restart {worker.name}. Error: {e}")
+
+    def statistics(self) -> dict:
+        elapsed = time.monotonic() - self.started_at
+        per_backend: Dict[str, dict] = {}
+        for worker in self.workers:
+            stats = per_backend.setdefault(
+                worker.backend or "default", {"done": 0, "failed": 0}
+            )
+            stats["done"] += worker.done
+            stats["failed"] += worker.failed
+        return {
+            "assets": self.total,
+            "textured": self.textured,
+            "failed": len(self.failures),
+            "elapsed_seconds": round(elapsed, 1),
+            "assets_per_hour": round(3600 * self.textured / elapsed, 1),
+            "workers": [
+                {
+                    "index": worker.index,
+                    "backend": worker.backend,
+                    "done": worker.done,
+                    "failed": worker.failed,
+                    "restarts": worker.restarts,
+                    "seconds_per_asset": (
+                        round(worker.busy_seconds / worker.done, 1)
+                        if worker.done
+                        else None
+                    ),
+                    "utilization": round(worker.busy_seconds / elapsed, 2),
+                }
+                for worker in self.workers
+            ],
+            "backends": per_backend,
+            "failures": self.failures,
+        }
+
+    def print_progress(self):
+        stats = self.statistics()
+        print(
+            f"{stats['textured']}/{stats['assets']} textured, "
+            f"{stats['assets_per_hour']} assets/hour"
+        )
+
+    def write_summary(self):
+        stats = self.statistics()
+        with open(os.path.join(self.args.output_dir, "summary.json"), "w") as f:
+            json.dump(stats, f, indent=2)
+        print(json.dumps(stats, indent=2))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--manifest", required=True, help="Json manifest of assets")
+    parser.add_argument("--blend", required=True, help="Blend file of the assets")
+    parser.add_argument("--blender", default="blender", help="Blender executable")
+    parser.add_argument("--workers", type=int, default=2, help="Blender processes")
+    parser.add_argument(
+        "--backends",
+        default="",
+        help="Comma separated backend urls, assigned to the workers in turn "
+        "(default : the add-on settings saved in the blend file)",
+    )
+    parser.add_argument("--output-dir", default="batch", help="Blend files and logs")
+    parser.add_argument(
+        "--retries", type=int, default=1, help="Times a failed asset is sent again"
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=600,
+        help="Seconds to wait for a generation once submitted",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Show the output of blender"
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # Workers receive complete assets
+    defaults = manifest.get("defaults", {})
+    assets = [
+        {**asset, "parameters": {**defaults, **asset.get("parameters", {})}}
+        for asset in manifest["assets"]
+    ]
+
+    sys.exit(Coordinator(args, assets).run())
+
+
+if __name__ == "__main__":
+    main()
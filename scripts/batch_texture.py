@@ -0,0 +1,395 @@
+"""Headless batch texturing : generate the texture of many assets without the UI.
+
+    blender -b scene.blend --python scripts/batch_texture.py -- \
+        --manifest assets.json --log progress.jsonl --output textured.blend
+
+Each asset of the manifest goes through the same steps as the GENERATE
+button (camera, projection, depth render, upload, submission, fetch, texture)
+one after the other. Progress is appended to the log as json lines, and the
+blend file is saved after every asset : a crash loses at most the asset being
+generated. Running the command again on the saved file with the same log
+skips the assets already textured. Textures are written to the render output
+folder, as from the UI, or to `--render-dir`.
+
+Manifest :
+
+    {
+        "defaults": {"n_steps": 20, "models_available": "sdxl_base.safetensors"},
+        "assets": [
+            {
+                "name": "chair",
+                "mesh": "Chair",
+                "camera": {"location": [3, -3, 2], "look_at": [0, 0, 0.5]},
+                "prompt": "an oak chair, carved wood",
+                "parameters": {"seed": 42, "cfg_scale": 6.5}
+            }
+        ]
+    }
+
+- `camera` : `location`, and either `look_at` (a point) or `rotation` (euler
+  angles in degrees)
+- `parameters` (over `defaults`) : any diffusion setting of the add-on panel.
+  Inpainting is not available, it needs a mesh selection in edit mode
+
+The add-on is used as installed in blender when enabled, otherwise it is
+loaded from this checkout.
+
+With `--manifest -`, assets are read one json object per line from the
+standard input as they come, and with `--events` every log event is also
+written to the standard output as an `EVENT_PREFIX` line : this is how
+`batch_coordinator.py` drives several blender processes. Each of them gets its
+own `--render-dir`, and its own configuration folder (job queue, completion
+times, result cache) through the `TEXTURE_DIFFUSION_CONFIG_DIR` environment
+variable, read when the add-on registers.
+"""
+
+import argparse
+import importlib
+import importlib.util
+import json
+import math
+import os
+import sys
+import time
+import traceback
+import uuid
+from typing import Iterable, Iterator
+
+import bpy
+from mathutils import Euler, Vector
+
+# Seconds between two checks of the generation being waited for
+WAIT_INTERVAL = 0.05
+
+# Start of the event lines read by `batch_coordinator.py` in the blender output
+EVENT_PREFIX = "TD_EVENT "
+
+
+class ProgressLog:
+    """Json lines log, every event is flushed to disk as it happens.
+    With `events`, events are also reported on the standard output
+    """
+
+    def __init__(self, path: str, events: bool = False):
+        self.path = path
+        self.events = events
+
+    def done_assets(self) -> set:
+        """Names of the assets textured by a previous run"""
+        done = set()
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # Last line of a crashed run
+                    continue
+                if event.get("event") == "applied":
+                    done.add(event["asset"])
+        return done
+
+    def write(self, asset: str, event: str, **fields):
+        record = {"time": time.time(), "asset": asset, "event": event, **fields}
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        if self.events:
+            print(EVENT_PREFIX + json.dumps(record), flush=True)
+        else:
+            print(f"[{asset}] {event} {fields if fields else ''}")
+
+
+def load_addon():
+    """Package of the add-on : the enabled one, or this checkout registered"""
+    if hasattr(bpy.types.Scene, "diffusion_properties"):
+        for name in list(sys.modules):
+            if name.endswith(".src.operators.job_operators"):
+                return importlib.import_module(
+                    name[: -len(".src.operators.job_operators")]
+                )
+
+    # The checkout folder name may not be a valid module name
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    spec = importlib.util.spec_from_file_location(
+        "texture_diffusion",
+        os.path.join(root, "__init__.py"),
+        submodule_search_locations=[root],
+    )
+    assert spec is not None and spec.loader is not None
+    addon = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = addon
+    spec.loader.exec_module(addon)
+    addon.register()
+    return addon
+
+
+class Driver:
+    def __init__(
+        self,
+        addon,
+        log: ProgressLog,
+        output: str,
+        timeout: float,
+        render_dir: str = "",
+    ):
+        self.log = log
+        self.output = output
+        self.timeout = timeout
+        self.render_dir = render_dir
+
+        package = addon.__name__
+        self.worker = importlib.import_module(f"{package}.src.functions.worker")
+        self.jobs = importlib.import_module(f"{package}.src.functions.jobs")
+        self.latency = importlib.import_module(f"{package}.src.functions.latency")
+        self.client = importlib.import_module(f"{package}.src.functions.backend_client")
+        self.history = importlib.import_module(
+            f"{package}.src.operators.history_collection_operators"
+        )
+        self.job_operators = importlib.import_module(
+            f"{package}.src.operators.job_operators"
+        )
+        self.grid = importlib.import_module(f"{package}.src.operators.grid_operators")
+
+    def run(self, assets: Iterable[dict], defaults: dict, backend: str = ""):
+        scene = bpy.context.scene
+        backend_props = scene.backend_properties
+        # Nothing listens to the event stream without the UI timers
+        backend_props.fetch_mode = "polling"
+        if backend:
+            backend_props.use_backend_pool = False
+            backend_props.url = backend
+        if self.render_dir:
+            # `generation_save_path` appends the file name to the render output
+            os.makedirs(self.render_dir, exist_ok=True)
+            scene.render.filepath = os.path.join(os.path.abspath(self.render_dir), "")
+
+        done = self.log.done_assets()
+        failed = 0
+
+        for asset in assets:
+            name = asset.get("name", asset["mesh"])
+            if name in done:
+                self.log.write(name, "skipped", reason="already textured")
+                continue
+
+            started_at = time.time()
+            self.log.write(name, "started")
+            try:
+                generation_id = self.texture_asset(scene, name, asset, defaults)
+            except Exception as e:
+                traceback.print_exc()
+                failed += 1
+                self.log.write(name, "failed", error=str(e))
+                continue
+
+            self.save()
+            self.log.write(
+                name,
+                "applied",
+                id=generation_id,
+                seconds=round(time.time() - started_at, 2),
+            )
+
+        return failed
+
+    def texture_asset(self, scene, name: str, asset: dict, defaults: dict) -> int:
+        diffusion_props = scene.diffusion_properties
+        history_props = scene.history_properties
+
+        mesh = bpy.data.objects.get(asset["mesh"])
+        if mesh is None or mesh.type != "MESH":
+            raise ValueError(f"No mesh object named {asset['mesh']}")
+
+        parameters = {**defaults, **asset.get("parameters", {})}
+        if "prompt" in asset:
+            parameters["prompt"] = asset["prompt"]
+        for key, value in parameters.items():
+            if not hasattr(diffusion_props, key):
+                raise ValueError(f"Unknown diffusion setting {key}")
+            setattr(diffusion_props, key, value)
+        if diffusion_props.toggle_inpainting:
+            raise ValueError("Inpainting is not available in batch mode")
+
+        diffusion_props.mesh_objects.clear()
+        diffusion_props.mesh_objects.add().name = mesh.name
+
+        # Only render the mesh of the asset, it is the object of the projection
+        for obj in scene.objects:
+            obj.hide_render = obj != mesh
+        bpy.context.view_layer.objects.active = mesh
+
+        # Camera of the generation, as created by the GENERATE button
+        history_props.history_counter += 1
+        generation_id = history_props.history_counter
+        camera_data = bpy.data.cameras.new(name="Camera")
+        camera = bpy.data.objects.new(f"Camera {generation_id}", camera_data)
+        self.grid.camera_history_collection(scene).objects.link(camera)
+        place_camera(camera, asset["camera"])
+        scene.camera = camera
+        bpy.context.view_layer.update()
+
+        generation_uuid = str(uuid.uuid4())
+        bpy.ops.diffusion.update_history(
+            uuid=generation_uuid, batch_count=diffusion_props.batch_count
+        )
+        bpy.ops.diffusion.projection_from_view(uuid=generation_uuid)
+        if "CANCELLED" in bpy.ops.diffusion.render_depth(uuid=generation_uuid):
+            raise RuntimeError("Depth render failed")
+        if diffusion_props.toggle_ipadapter:
+            bpy.ops.diffusion.render_ipadapter_image(uuid=generation_uuid)
+
+        bpy.ops.diffusion.send_request(uuid=generation_uuid, priority="batch")
+        self.log.write(name, "queued", id=generation_id, uuid=generation_uuid)
+
+        self.wait_for_generation(name, generation_uuid)
+        return generation_id
+
+    def wait_for_generation(self, name: str, generation_uuid: str):
+        """Run the worker callbacks and poll the result on the main thread,
+        until the texture is applied"""
+
+        job_queue = self.jobs.get_job_queue()
+        client = self.client.get_client()
+        poll_at = 0.0
+        submitted = False
+
+        while True:
+            # The timers running these in the UI do not run in background mode
+            self.worker.drain_results()
+            self.job_operators.schedule_jobs()
+
+            job = job_queue.get(generation_uuid)
+            if job is None:
+                raise RuntimeError("The generation left the job queue")
+            if job.state == self.jobs.APPLIED:
+                return
+            if job.state == self.jobs.FAILED:
+                raise RuntimeError(job.error or "Generation failed")
+
+            history_item = self.history.find_history_item(generation_uuid)
+            if history_item is None:
+                raise RuntimeError("The history item was removed")
+
+            if job.state in (self.jobs.QUEUED, self.jobs.RUNNING) and job.prompt_id:
+                if not submitted:
+                    submitted = True
+                    self.log.write(name, "submitted", prompt_id=job.prompt_id)
+
+                elapsed = time.time() - job.submitted_at
+                if elapsed >= self.timeout:
+                    job_queue.set_state(generation_uuid, self.jobs.FAILED, "Timeout")
+                    continue
+                if elapsed >= poll_at:
+                    entry = client.history(history_item.url, job.prompt_id)
+                    if entry is None:
+                        poll_at = self.latency.next_poll_time(
+                            elapsed, self.history.expected_duration(history_item)
+                        )
+                    else:
+                        self.download(history_item, entry)
+
+            time.sleep(WAIT_INTERVAL)
+
+    def download(self, history_item, entry: dict):
+        """Fetch and apply the outputs listed by the backend history entry"""
+        images = self.client.history_outputs(entry)
+        items = self.history.batch_items(history_item)
+        if len(images) < len(items):
+            raise RuntimeError(
+                f"Expected {len(items)} images, the backend saved {len(images)}"
+            )
+
+        status_code = self.history.download_outputs(
+            history_item.url,
+            self.history.output_downloads(items, images),
+            self.history.stored_result_key(history_item.uuid),
+        )
+        if status_code != 200:
+            raise RuntimeError(f"Download failed, response code {status_code}")
+        self.history.load_fetched_images(history_item)
+
+    def save(self):
+        bpy.ops.wm.save_as_mainfile(filepath=self.output, copy=False)
+
+
+def place_camera(camera, transform: dict):
+    camera.location = Vector(transform["location"])
+    if "look_at" in transform:
+        direction = Vector(transform["look_at"]) - camera.location
+        camera.rotation_euler = direction.to_track_quat("-Z", "Y").to_euler()
+    else:
+        camera.rotation_euler = Euler(
+            [math.radians(angle) for angle in transform["rotation"]]
+        )
+
+
+def parse_args():
+    argv = sys.argv[sys.argv.index("--") + 1 :] if "--" in sys.argv else []
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--manifest",
+        required=True,
+        help="Json manifest of assets, '-' for json lines on the standard input",
+    )
+    parser.add_argument(
+        "--log", default="batch_texture.jsonl", help="Json lines progress log"
+    )
+    parser.add_argument(
+        "--output",
+        default="",
+        help="Blend file saved after every asset (default : the opened file)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=600,
+        help="Seconds to wait for a generation once submitted",
+    )
+    parser.add_argument(
+        "--backend", default="", help="Backend url, instead of the add-on settings"
+    )
+    parser.add_argument(
+        "--render-dir",
+        default="",
+        help="Folder of the textures, instead of the render output of the scene",
+    )
+    parser.add_argument(
+        "--events",
+        action="store_true",
+        help="Report the log events on the standard output",
+    )
+    return parser.parse_args(argv)
+
+
+def read_assets(stream) -> Iterator[dict]:
+    """Assets sent one json object per line, until the end of the stream"""
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def main():
+    args = parse_args()
+    if args.manifest == "-":
+        # Defaults are merged in the assets by the sender
+        assets, defaults = read_assets(sys.stdin), {}
+    else:
+        with open(args.manifest) as f:
+            manifest = json.load(f)
+        assets, defaults = manifest["assets"], manifest.get("defaults", {})
+
+    output = args.output or bpy.data.filepath
+    if not output:
+        raise SystemExit("--output is required for an unsaved blend file")
+
+    log = ProgressLog(args.log, args.events)
+    driver = Driver(load_addon(), log, output, args.timeout, args.render_dir)
+    failed = driver.run(assets, defaults, args.backend)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+"""Load test of the generation pipeline, against a backend without a GPU.
+
+    python scripts/mock_comfyui.py --latency 2 --slots 2 &
+    blender -b --python scripts/load_test.py -- --generations 50 --max-jobs 4
+
+Fires `--generations` generations at once through the same code as the
+GENERATE button, after the depth render :
+- the depth image (random, so no cache skips it) is sent from the upload
+  pool with `queue_image_upload`, which replaced the blocking
+  `send_image_function`
+- `SendRequestOperator` builds the request and adds it to the job queue,
+  which submits at most `--max-jobs` generations to the backend at a time
+- the result is looked up in `/history` as the `fetch_image` timer does, then
+  downloaded and applied as a texture of a plane
+
+bpy timers do not run in background mode : the worker callbacks, the job
+scheduler and the polling are run by the loop of this script.
+
+Reports the throughput and the p50/p95/p99 time to texture (from firing the
+generation until its texture is applied), split into the time to submission
+(uploads and job queue) and from submission to texture (backend queue,
+execution, polling and download). Failures are counted by error.
+"""
+
+import argparse
+import importlib
+import json
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional
+
+import bpy
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from batch_texture import load_addon  # noqa: E402
+
+# Seconds between two passes of the loop
+WAIT_INTERVAL = 0.02
+
+PERCENTILES = (50, 95, 99)
+
+
+class Generation:
+    def __init__(self, uuid: str, fired_at: float):
+        self.uuid = uuid
+        self.fired_at = fired_at
+        self.submitted_at = 0.0
+        self.applied_at = 0.0
+        self.error = ""
+
+        # Absolute time of the next `/history` lookup
+        self.poll_at = 0.0
+        self.polling = False
+        self.downloading = False
+
+    @property
+    def finished(self) -> bool:
+        return bool(self.applied_at or self.error)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest rank percentile"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def distribution(values: List[float]) -> Optional[Dict[str, float]]:
+    if not values:
+        return None
+    result = {f"p{q}": round(percentile(values, q), 3) for q in PERCENTILES}
+    result["mean"] = round(statistics.mean(values), 3)
+    result["max"] = round(max(values), 3)
+    return result
+
+
+class LoadTest:
+    def __init__(self, addon, args):
+        self.args = args
+
+        package = addon.__name__
+        self.worker = importlib.import_module(f"{package}.src.functions.worker")
+        self.jobs = importlib.import_module(f"{package}.src.functions.jobs")
+        self.latency = importlib.import_module(f"{package}.src.functions.latency")
+        self.client = importlib.import_module(f"{package}.src.functions.backend_client")
+        self.catalog = importlib.import_module(f"{package}.src.functions.catalog")
+        self.utils = importlib.import_module(f"{package}.src.functions.utils")
+        self.history = importlib.import_module(
+            f"{package}.src.operators.history_collection_operators"
+        )
+        self.job_operators = importlib.import_module(
+            f"{package}.src.operators.job_operators"
+        )
+
+        self.generations: List[Generation] = []
+
+    def setup(self, scene):
+        args = self.args
+        backend_props = scene.backend_properties
+        diffusion_props = scene.diffusion_properties
+
+        backend_props.url = args.url
+        backend_props.use_backend_pool = False
+        # Nothing listens to the event stream without the UI timers
+        backend_props.fetch_mode = "polling"
+        backend_props.max_concurrent_jobs = args.max_jobs
+        backend_props.timeout_retry = int(args.timeout)
+        # Every generation goes to the backend
+        backend_props.use_result_cache = False
+
+        # The model enum lists the checkpoints of the backend
+        model = args.model or self.wait_for_catalog(args.url)
+        diffusion_props.models_available = model
+        diffusion_props.batch_count = args.batch_size
+        diffusion_props.random_seed = True
+        diffusion_props.toggle_inpainting = False
+        diffusion_props.toggle_ipadapter = False
+
+        mesh = bpy.data.objects.get(args.mesh)
+        if mesh is None:
+            data = bpy.data.meshes.new(args.mesh)
+            data.from_pydata(
+                [(-1, -1, 0), (1, -1, 0), (1, 1, 0), (-1, 1, 0)], [], [(0, 1, 2, 3)]
+            )
+            mesh = bpy.data.objects.new(args.mesh, data)
+            scene.collection.objects.link(mesh)
+        diffusion_props.mesh_objects.clear()
+        diffusion_props.mesh_objects.add().name = mesh.name
+
+        scene.render.filepath = os.path.join(args.output_dir, "")
+
+    def wait_for_catalog(self, url: str) -> str:
+        """First checkpoint of the backend"""
+        catalog = self.catalog.get_catalog()
+        catalog.refresh(url, "models", force=True)
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            self.worker.drain_results()
+            names = catalog.names(url, "models")
+            if names:
+                return names[0]
+            time.sleep(WAIT_INTERVAL)
+        raise SystemExit(f"No checkpoint listed by {url}")
+
+    def fire(self, scene, rng: np.random.Generator):
+        """Start a generation, as the GENERATE button does after the render"""
+        history_props = scene.history_properties
+        history_props.history_counter += 1
+
+        generation = Generation(str(uuid.uuid4()), time.monotonic())
+        bpy.ops.diffusion.update_history(
+            uuid=generation.uuid, batch_count=self.args.batch_size
+        )
+        history_item = self.history.find_history_item(generation.uuid)
+
+        size = self.args.size
+        depth = Image.fromarray(rng.integers(0, 256, (size, size), dtype=np.uint8))
+        self.utils.queue_image_upload(
+            scene=scene,
+            image_name=f"{generation.uuid}_depth.png",
+            image=depth.convert("RGB"),
+            uuid=generation.uuid,
+            kind="depth",
+            url=history_item.url,
+        )
+        bpy.ops.diffusion.send_request(uuid=generation.uuid)
+        self.generations.append(generation)
+
+    def run(self, scene) -> dict:
+        rng = np.random.default_rng(0)
+        started_at = time.monotonic()
+        for _ in range(self.args.generations):
+            self.fire(scene, rng)
+        print(f"{self.args.generations} generations fired")
+
+        remaining = list(self.generations)
+        while remaining:
+            # The timers running these in the UI do not run in background mode
+            self.worker.drain_results()
+            self.job_operators.schedule_jobs()
+
+            for generation in remaining:
+                self.update(generation)
+            finished = [generation for generation in remaining if generation.finished]
+            for generation in finished:
+                remaining.remove(generation)
+                status = generation.error or "applied"
+                print(
+                    f"{len(self.generations) - len(remaining)}/"
+                    f"{len(self.generations)} {status}"
+                )
+
+            time.sleep(WAIT_INTERVAL)
+
+        return self.report(time.monotonic() - started_at)
+
+    def update(self, generation: Generation):
+        job = self.jobs.get_job_queue().get(generation.uuid)
+        now = time.monotonic()
+        if job is None:
+            generation.error = "Left the job queue"
+            return
+        if job.state == self.jobs.APPLIED:
+            generation.applied_at = now
+            return
+        if job.state == self.jobs.FAILED:
+            generation.error = job.error or "Failed"
+            return
+        if not job.prompt_id or job.state not in (self.jobs.QUEUED, self.jobs.RUNNING):
+            return
+
+        if not generation.submitted_at:
+            # The job records the wall clock time of its submission
+            generation.submitted_at = now - (time.time() - job.submitted_at)
+            generation.poll_at = now
+
+        if now - generation.submitted_at >= self.args.timeout:
+            self.jobs.get_job_queue().set_state(
+                generation.uuid, self.jobs.FAILED, "Timeout"
+            )
+            return
+        if generation.polling or generation.downloading or now < generation.poll_at:
+            return
+
+        history_item = self.history.find_history_item(generation.uuid)
+        generation.polling = True
+        self.worker.submit(
+            self.client.get_client().history,
+            history_item.url,
+            job.prompt_id,
+            callback=lambda future: self.on_polled(generation, future),
+        )
+
+    def on_polled(self, generation: Generation, future):
+        """Main thread callback of a `/history` lookup, see `fetch_image`"""
+        generation.polling = False
+        if future.exception() is None and future.result() is not None:
+            # Download and texture, or the failure of the prompt
+            generation.downloading = True
+            self.history.on_history_polled(generation.uuid, future)
+            return
+
+        history_item = self.history.find_history_item(generation.uuid)
+        elapsed = time.monotonic() - generation.submitted_at
+        generation.poll_at = generation.submitted_at + self.latency.next_poll_time(
+            elapsed, self.history.expected_duration(history_item)
+        )
+
+    def report(self, elapsed: float) -> dict:
+        applied = [
+            generation for generation in self.generations if generation.applied_at
+        ]
+        return {
+            "url": self.args.url,
+            "generations": len(self.generations),
+            "applied": len(applied),
+            "failed": len(self.generations) - len(applied),
+            "max_jobs": self.args.max_jobs,
+            "elapsed_seconds": round(elapsed, 2),
+            "textures_per_minute": round(60 * len(applied) / elapsed, 2),
+            "time_to_texture": distribution(
+                [generation.applied_at - generation.fired_at for generation in applied]
+            ),
+            "time_to_submission": distribution(
+                [
+                    generation.submitted_at - generation.fired_at
+                    for generation in applied
+                ]
+            ),
+            "submission_to_texture": distribution(
+                [
+                    generation.applied_at - generation.submitted_at
+                    for generation in applied
+                ]
+            ),
+            "failures": dict(
+                Counter(
+                    generation.error
+                    for generation in self.generations
+                    if generation.error
+                )
+            ),
+        }
+
+
+def parse_args():
+    argv = sys.argv[sys.argv.index("--") + 1 :] if "--" in sys.argv else []
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8188", help="Backend url")
+    parser.add_argument(
+        "--generations", type=int, default=20, help="Generations fired at once"
+    )
+    parser.add_argument(
+        "--max-jobs",
+        type=int,
+        default=2,
+        help="Generations submitted to the backend at the same time (1 to 16)",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=1, help="Images of each generation"
+    )
+    parser.add_argument(
+        "--size", type=int, default=1024, help="Size of the depth images uploaded"
+    )
+    parser.add_argument(
+        "--model", default="", help="Checkpoint (default : the first of the backend)"
+    )
+    parser.add_argument("--mesh", default="Load Test", help="Mesh textured")
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=600,
+        help="Seconds to wait for a generation once submitted",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default="",
+        help="Folder of the downloaded textures (default : a temporary folder)",
+    )
+    parser.add_argument("--json", default="", help="Write the report to this file")
+    return parser.parse_args(argv)
+
+
+def main():
+    if not bpy.app.background:
+        raise SystemExit("Run in background mode : blender -b --python ...")
+
+    args = parse_args()
+    args.output_dir = args.output_dir or tempfile.mkdtemp(prefix="load_test_")
+
+    scene = bpy.context.scene
+    load_test = LoadTest(load_addon(), args)
+    load_test.setup(scene)
+    report = load_test.run(scene)
+
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if report["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
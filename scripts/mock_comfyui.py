@@ -0,0 +1,656 @@
+"""Stand-in ComfyUI server, to run the add-on end to end without a GPU.
+
+    python scripts/mock_comfyui.py --port 8188 --latency 4 --jitter 0.25 \
+        --failure-rate 0.05 --bandwidth 10
+
+Serves the routes used by the add-on, with the same payloads as ComfyUI :
+`/upload/image`, `/prompt`, `/view` (GET and HEAD), `/history`, `/queue`,
+`/models/checkpoints`, `/models/loras` and the `/ws` event stream.
+
+- prompts are validated like ComfyUI does for the add-on workflows : input
+  images must have been uploaded, checkpoints and LoRAs must be listed
+- `--slots` prompts execute at once (one per GPU), each one takes `--latency`
+  seconds, give or take `--jitter` (a fraction of the latency). Waiting in
+  the queue comes on top, `front` prompts skip it
+- `--failure-rate` of the prompts end with an execution error, and
+  `--http-error-rate` of the requests are answered with a 503
+- `--bandwidth` (MB/s, each way) is shared by every connection, as a
+  network link would be
+- outputs are flat color PNG of the size of the latent image, kept in memory
+
+A summary of the requests served is printed on exit (Ctrl+C).
+This script does not use bpy, it runs with any python 3.
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import random
+import socket
+import struct
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter, deque
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Deque, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OPCODE_TEXT = 0x1
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+# Bytes written or read between two checks of the bandwidth limit
+CHUNK_SIZE = 64 * 1024
+
+# Nodes reading an uploaded image, and inputs checked against the model lists
+IMAGE_LOADERS = ("LoadImage", "LoadImageMask")
+LATENT_NODES = ("EmptyLatentImage", "EmptySD3LatentImage")
+
+DEFAULT_CHECKPOINTS = (
+    "sd_xl_base_1.0_0.9vae.safetensors",
+    "flux1-dev-fp8.safetensors",
+)
+
+
+def png_bytes(width: int, height: int, color: Tuple[int, int, int]) -> bytes:
+    """Flat color RGB PNG, encoded without any imaging library"""
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        body = kind + data
+        return struct.pack("!I", len(data)) + body + struct.pack("!I", zlib.crc32(body))
+
+    row = b"\x00" + bytes(color) * width
+    header = struct.pack("!IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(row * height, 1))
+        + chunk(b"IEND", b"")
+    )
+
+
+class Link:
+    """Bandwidth shared by the transfers of one direction : each chunk waits
+    for the link to be free (0 bytes per second : unlimited)"""
+
+    def __init__(self, bytes_per_second: float):
+        self.bytes_per_second = bytes_per_second
+        self._free_at = 0.0
+        self._lock = threading.Lock()
+
+    def consume(self, size: int):
+        if self.bytes_per_second <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._free_at = max(now, self._free_at) + size / self.bytes_per_second
+            wait = self._free_at - now
+        time.sleep(wait)
+
+
+class WebSocket:
+    """Server side of an accepted `/ws` connection"""
+
+    def __init__(self, connection: socket.socket, rfile):
+        self.connection = connection
+        self.rfile = rfile
+        self._lock = threading.Lock()
+
+    def send_json(self, message: dict) -> bool:
+        """Text frame (servers do not mask), False once the client is gone"""
+        payload = json.dumps(message).encode()
+        header = bytes([0x80 | OPCODE_TEXT])
+        if len(payload) < 126:
+            header += bytes([len(payload)])
+        elif len(payload) < 1 << 16:
+            header += bytes([126]) + struct.pack("!H", len(payload))
+        else:
+            header += bytes([127]) + struct.pack("!Q", len(payload))
+        try:
+            with self._lock:
+                self.connection.sendall(header + payload)
+        except OSError:
+            return False
+        return True
+
+    def serve(self):
+        """Read the client frames until it closes, answering pings"""
+        while True:
+            header = self.rfile.read(2)
+            if len(header) < 2:
+                return
+            opcode = header[0] & 0x0F
+            length = header[1] & 0x7F
+            if length == 126:
+                (length,) = struct.unpack("!H", self.rfile.read(2))
+            elif length == 127:
+                (length,) = struct.unpack("!Q", self.rfile.read(8))
+            mask = self.rfile.read(4) if header[1] & 0x80 else b"\x00" * 4
+            payload = bytes(
+                b ^ mask[i % 4] for i, b in enumerate(self.rfile.read(length))
+            )
+
+            if opcode == OPCODE_CLOSE:
+                with self._lock:
+                    self.connection.sendall(bytes([0x80 | OPCODE_CLOSE, 0]))
+                return
+            if opcode == OPCODE_PING:
+                with self._lock:
+                    self.connection.sendall(
+                        bytes([0x80 | OPCODE_PONG, len(payload)]) + payload
+                    )
+
+
+class Backend:
+    """Queue, history, files and event streams of the mock server"""
+
+    def __init__(self, args):
+        self.args = args
+        self.checkpoints = [name for name in args.checkpoints.split(",") if name]
+        self.loras = [name for name in args.loras.split(",") if name]
+        self.uplink = Link(args.bandwidth * 1024 * 1024)
+        self.downlink = Link(args.bandwidth * 1024 * 1024)
+
+        self.lock = threading.Condition()
+        self.number = 0
+        self.pending: Deque[dict] = deque()
+        self.running: Dict[str, dict] = {}
+        self.history: Dict[str, dict] = {}
+        # (type, subfolder, filename) -> content
+        self.files: Dict[Tuple[str, str, str], bytes] = {}
+        self.sockets: Dict[str, List[WebSocket]] = {}
+
+        self.stats: Counter = Counter()
+        self._stats_lock = threading.Lock()
+        self.started_at = time.monotonic()
+
+        for slot in range(args.slots):
+            threading.Thread(
+                target=self.execute_loop, name=f"slot-{slot}", daemon=True
+            ).start()
+
+    def count(self, name: str, amount: int = 1):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    # Event stream
+
+    def connect(self, client_id: str, websocket: WebSocket):
+        with self.lock:
+            self.sockets.setdefault(client_id, []).append(websocket)
+            remaining = len(self.pending) + len(self.running)
+        websocket.send_json(
+            {
+                "type": "status",
+                "data": {
+                    "status": {"exec_info": {"queue_remaining": remaining}},
+                    "sid": client_id,
+                },
+            }
+        )
+
+    def disconnect(self, client_id: str, websocket: WebSocket):
+        with self.lock:
+            sockets = self.sockets.get(client_id, [])
+            if websocket in sockets:
+                sockets.remove(websocket)
+            if not sockets:
+                self.sockets.pop(client_id, None)
+
+    def send(self, event: str, data: dict, client_id: Optional[str]):
+        """Event to the client of a prompt, or to everyone without a client id"""
+        with self.lock:
+            if client_id:
+                sockets = list(self.sockets.get(client_id, []))
+            else:
+                sockets = [ws for group in self.sockets.values() for ws in group]
+        for websocket in sockets:
+            websocket.send_json({"type": event, "data": data})
+
+    def broadcast_status(self):
+        with self.lock:
+            remaining = len(self.pending) + len(self.running)
+        self.send(
+            "status", {"status": {"exec_info": {"queue_remaining": remaining}}}, None
+        )
+
+    # Prompts
+
+    def validate(self, prompt: dict) -> Dict[str, dict]:
+        """Node errors of a prompt, in the ComfyUI format"""
+        node_errors = {}
+        for node_id, node in prompt.items():
+            errors = []
+            inputs = node.get("inputs", {})
+            if node.get("class_type") in IMAGE_LOADERS:
+                image = inputs.get("image")
+                if ("input", "", image) not in self.files:
+                    errors.append(("image", image))
+            if "ckpt_name" in inputs and inputs["ckpt_name"] not in self.checkpoints:
+                errors.append(("ckpt_name", inputs["ckpt_name"]))
+            if "lora_name" in inputs and inputs["lora_name"] not in self.loras:
+                errors.append(("lora_name", inputs["lora_name"]))
+
+            if errors:
+                node_errors[node_id] = {
+                    "errors": [
+                        {
+                            "type": "value_not_in_list",
+                            "message": "Value not in list",
+                            "details": f"{name}: '{value}' not in list",
+                            "extra_info": {"input_name": name},
+                        }
+                        for name, value in errors
+                    ],
+                    "dependent_outputs": [],
+                    "class_type": node.get("class_type"),
+                }
+        return node_errors
+
+    def queue_prompt(self, payload: dict) -> Tuple[int, dict]:
+        prompt = payload.get("prompt")
+        if not isinstance(prompt, dict) or not prompt:
+            return 400, {
+                "error": {"type": "invalid_prompt", "message": "No prompt provided"},
+                "node_errors": {},
+            }
+
+        node_errors = self.validate(prompt)
+        if node_errors:
+            self.count("rejected")
+            return 400, {
+                "error": {
+                    "type": "prompt_outputs_failed_validation",
+                    "message": "Prompt outputs failed validation",
+                    "details": "",
+                    "extra_info": {},
+                },
+                "node_errors": node_errors,
+            }
+
+        with self.lock:
+            self.number += 1
+            item = {
+                "prompt_id": str(uuid.uuid4()),
+                "number": -self.number if payload.get("front") else self.number,
+                "prompt": prompt,
+                "client_id": payload.get("client_id"),
+                "queued_at": time.time(),
+            }
+            if payload.get("front"):
+                self.pending.appendleft(item)
+            else:
+                self.pending.append(item)
+            self.count("prompts")
+            self.lock.notify()
+
+        self.broadcast_status()
+        return 200, {
+            "prompt_id": item["prompt_id"],
+            "number": item["number"],
+            "node_errors": {},
+        }
+
+    def queue_state(self) -> dict:
+        def entry(item: dict) -> list:
+            extra = {"client_id": item["client_id"]}
+            return [item["number"], item["prompt_id"], item["prompt"], extra, []]
+
+        with self.lock:
+            return {
+                "queue_running": [entry(item) for item in self.running.values()],
+                "queue_pending": [entry(item) for item in self.pending],
+            }
+
+    def execute_loop(self):
+        while True:
+            with self.lock:
+                while not self.pending:
+                    self.lock.wait()
+                item = self.pending.popleft()
+                self.running[item["prompt_id"]] = item
+            try:
+                self.execute(item)
+            finally:
+                with self.lock:
+                    self.running.pop(item["prompt_id"], None)
+                self.broadcast_status()
+
+    def execute(self, item: dict):
+        prompt_id = item["prompt_id"]
+        client_id = item["client_id"]
+        started = {"prompt_id": prompt_id, "timestamp": int(time.time() * 1000)}
+        messages: List[list] = [["execution_start", started]]
+        self.send("execution_start", started, client_id)
+
+        jitter = self.args.jitter * random.uniform(-1, 1)
+        time.sleep(max(0.0, self.args.latency * (1 + jitter)))
+
+        if random.random() < self.args.failure_rate:
+            self.count("failed")
+            node_id = next(iter(item["prompt"]))
+            error = {
+                "prompt_id": prompt_id,
+                "node_id": node_id,
+                "node_type": item["prompt"][node_id]["class_type"],
+                "executed": [],
+                "exception_message": "Injected failure of the mock server",
+                "exception_type": "RuntimeError",
+                "traceback": [],
+                "current_inputs": {},
+                "current_outputs": {},
+            }
+            messages.append(["execution_error", error])
+            self.store_history(item, {}, "error", messages)
+            self.send("execution_error", error, client_id)
+            return
+
+        outputs = self.save_outputs(item)
+        for node_id, output in outputs.items():
+            self.send(
+                "executed",
+                {
+                    "node": node_id,
+                    "display_node": node_id,
+                    "output": output,
+                    "prompt_id": prompt_id,
+                },
+                client_id,
+            )
+
+        success = {"prompt_id": prompt_id, "timestamp": int(time.time() * 1000)}
+        messages.append(["execution_success", success])
+        self.store_history(item, outputs, "success", messages)
+        self.count("completed")
+        self.send("execution_success", success, client_id)
+        self.send("executing", {"node": None, "prompt_id": prompt_id}, client_id)
+
+    def save_outputs(self, item: dict) -> Dict[str, dict]:
+        """Images of the SaveImage nodes, at the size of the latent image"""
+        prompt = item["prompt"]
+        width, height, batch_size = 1024, 1024, 1
+        for node in prompt.values():
+            if node["class_type"] in LATENT_NODES:
+                inputs = node["inputs"]
+                width = inputs.get("width", width)
+                height = inputs.get("height", height)
+                batch_size = inputs.get("batch_size", batch_size)
+
+        # Flat color of the prompt, to tell the outputs apart
+        digest = hashlib.md5(item["prompt_id"].encode()).digest()
+        image = png_bytes(width, height, (digest[0], digest[1], digest[2]))
+
+        outputs = {}
+        for node_id, node in prompt.items():
+            if node["class_type"] != "SaveImage":
+                continue
+            prefix = node["inputs"].get("filename_prefix", "ComfyUI")
+            subfolder, _, name = prefix.rpartition("/")
+            images = []
+            with self.lock:
+                for index in range(batch_size):
+                    filename = f"{name}_{index + 1:05d}_.png"
+                    self.files[("output", subfolder, filename)] = image
+                    images.append(
+                        {"filename": filename, "subfolder": subfolder, "type": "output"}
+                    )
+            outputs[node_id] = {"images": images}
+        return outputs
+
+    def store_history(self, item: dict, outputs: dict, status: str, messages: list):
+        with self.lock:
+            self.history[item["prompt_id"]] = {
+                "prompt": [
+                    item["number"],
+                    item["prompt_id"],
+                    item["prompt"],
+                    {"client_id": item["client_id"]},
+                    list(outputs),
+                ],
+                "outputs": outputs,
+                "status": {
+                    "status_str": status,
+                    "completed": status == "success",
+                    "messages": messages,
+                },
+                "meta": {},
+            }
+
+    def summary(self) -> dict:
+        elapsed = time.monotonic() - self.started_at
+        with self._stats_lock:
+            stats = dict(self.stats)
+        return {
+            "elapsed_seconds": round(elapsed, 1),
+            **stats,
+            "prompts_per_minute": round(60 * stats["completed"] / elapsed, 2),
+        }
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Keep-alive, as the add-on pools its connections
+    protocol_version = "HTTP/1.1"
+    backend: Backend
+
+    def log_message(self, format, *args):
+        if self.backend.args.verbose:
+            super().log_message(format, *args)
+
+    def read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length", 0))
+        data = bytearray()
+        while len(data) < length:
+            chunk = self.rfile.read(min(CHUNK_SIZE, length - len(data)))
+            if not chunk:
+                break
+            self.backend.uplink.consume(len(chunk))
+            data += chunk
+        self.backend.count("bytes_received", len(data))
+        return bytes(data)
+
+    def reply(self, status: int, body: bytes = b"", content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        for start in range(0, len(body), CHUNK_SIZE):
+            chunk = body[start : start + CHUNK_SIZE]
+            self.backend.downlink.consume(len(chunk))
+            self.wfile.write(chunk)
+        self.backend.count("bytes_sent", len(body))
+
+    def reply_json(self, status: int, payload):
+        self.reply(status, json.dumps(payload).encode())
+
+    def injected_error(self) -> bool:
+        if random.random() < self.backend.args.http_error_rate:
+            self.backend.count("injected_http_errors")
+            self.reply_json(503, {"error": "Injected error of the mock server"})
+            return True
+        return False
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        backend = self.backend
+
+        if url.path == "/ws":
+            return self.upgrade(query.get("clientId") or uuid.uuid4().hex)
+        if self.injected_error():
+            return
+
+        if url.path == "/view":
+            key = (
+                query.get("type", "output"),
+                query.get("subfolder", ""),
+                query.get("filename", ""),
+            )
+            content = backend.files.get(key)
+            if content is None:
+                return self.reply_json(404, {"error": "File not found"})
+            backend.count("views")
+            return self.reply(200, content, "image/png")
+
+        if url.path == "/history":
+            with backend.lock:
+                return self.reply_json(200, dict(backend.history))
+        if url.path.startswith("/history/"):
+            prompt_id = url.path[len("/history/") :]
+            backend.count("history_polls")
+            with backend.lock:
+                entry = backend.history.get(prompt_id)
+            return self.reply_json(200, {prompt_id: entry} if entry else {})
+
+        if url.path == "/queue":
+            return self.reply_json(200, backend.queue_state())
+        if url.path == "/models/checkpoints":
+            return self.reply_json(200, backend.checkpoints)
+        if url.path == "/models/loras":
+            return self.reply_json(200, backend.loras)
+
+        self.reply_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        body = self.read_body()
+        if self.injected_error():
+            return
+
+        if url.path == "/prompt":
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                return self.reply_json(400, {"error": "Invalid json"})
+            return self.reply_json(*self.backend.queue_prompt(payload))
+
+        if url.path == "/upload/image":
+            return self.upload(body)
+
+        self.reply_json(404, {"error": "Not found"})
+
+    def upload(self, body: bytes):
+        """Multipart form of `/upload/image` : the `image` file, `type`,
+        `subfolder` and `overwrite` fields"""
+        header = f"Content-Type: {self.headers.get('Content-Type', '')}\r\n\r\n"
+        message = BytesParser(policy=HTTP).parsebytes(header.encode() + body)
+        fields = {}
+        image: Optional[Tuple[str, bytes]] = None
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            content = part.get_payload(decode=True) or b""
+            if name == "image":
+                image = (part.get_filename() or "image.png", content)
+            else:
+                fields[name] = content.decode()
+
+        if image is None:
+            return self.reply(400, b"No image", "text/plain")
+
+        folder_type = fields.get("type", "input")
+        subfolder = fields.get("subfolder", "")
+        with self.backend.lock:
+            self.backend.files[(folder_type, subfolder, image[0])] = image[1]
+        self.backend.count("uploads")
+        self.reply_json(
+            200, {"name": image[0], "subfolder": subfolder, "type": folder_type}
+        )
+
+    def upgrade(self, client_id: str):
+        key = self.headers.get("Sec-WebSocket-Key", "")
+        accept = base64.b64encode(
+            hashlib.sha1((key + WS_GUID).encode("ascii")).digest()
+        ).decode("ascii")
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+
+        websocket = WebSocket(self.connection, self.rfile)
+        self.backend.connect(client_id, websocket)
+        try:
+            websocket.serve()
+        except OSError:
+            pass
+        finally:
+            self.backend.disconnect(client_id, websocket)
+            self.close_connection = True
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument(
+        "--slots", type=int, default=1, help="Prompts executed at the same time"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=2.0, help="Seconds to execute a prompt"
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.0,
+        help="Random variation of the latency, as a fraction of it",
+    )
+    parser.add_argument(
+        "--failure-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of the prompts ending with an execution error",
+    )
+    parser.add_argument(
+        "--http-error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of the requests answered with a 503",
+    )
+    parser.add_argument(
+        "--bandwidth",
+        type=float,
+        default=0.0,
+        help="MB/s each way, shared by every connection (0 : unlimited)",
+    )
+    parser.add_argument(
+        "--checkpoints",
+        default=",".join(DEFAULT_CHECKPOINTS),
+        help="Comma separated checkpoint names",
+    )
+    parser.add_argument("--loras", default="", help="Comma separated LoRA names")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    backend = Backend(args)
+    Handler.backend = backend
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    print(f"Mock ComfyUI listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(backend.summary(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+from typing import List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Timeouts are (connect, read) tuples in seconds, one per kind of call
+CONNECT_TIMEOUT = 3.05
+CATALOG_TIMEOUT = (CONNECT_TIMEOUT, 5)
+UPLOAD_TIMEOUT = (CONNECT_TIMEOUT, 30)
+PROMPT_TIMEOUT = (CONNECT_TIMEOUT, 10)
+VIEW_TIMEOUT = (CONNECT_TIMEOUT, 30)
+
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 8
+
+
+class BackendClient:
+    """Keep-alive HTTP client shared by every call to the comfyUI backend.
+
+    The sessions keep a pool of open connections per host so uploads, prompt
+    submissions and fetches reuse TCP (and TLS) connections instead of paying
+    the setup cost on every call.
+
+    Retry policy:
+    - connection errors are retried for every method (nothing reached the server)
+    - 502/503/504 answers are retried for idempotent calls only (GET, upload
+      with overwrite), never for the `/prompt` POST which would queue twice.
+      Retries are configured per adapter, hence the dedicated `submit_session`
+    """
+
+    def __init__(
+        self,
+        retries: int = 3,
+        backoff_factor: float = 0.25,
+        pool_connections: int = POOL_CONNECTIONS,
+        pool_maxsize: int = POOL_MAXSIZE,
+    ):
+        self.session = requests.Session()
+
+        idempotent_retry = Retry(
+            total=retries,
+            connect=retries,
+            read=1,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET", "HEAD", "POST"}),
+            raise_on_status=False,
+        )
+        self._idempotent_adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=idempotent_retry,
+        )
+        self.session.mount("http://", self._idempotent_adapter)
+        self.session.mount("https://", self._idempotent_adapter)
+
+        # Separate session for non-idempotent calls : only connection errors are retried
+        self.submit_session = requests.Session()
+        submit_retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=0,
+            backoff_factor=backoff_factor,
+            raise_on_status=False,
+        )
+        self._submit_adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=submit_retry,
+        )
+        self.submit_session.mount("http://", self._submit_adapter)
+        self.submit_session.mount("https://", self._submit_adapter)
+
+    def get_json(
+        self, base_url: str, route: str, timeout=CATALOG_TIMEOUT, quiet: bool = False
+    ):
+        """GET a json route, return the decoded payload or None on failure.
+        `quiet` silences connection errors (periodic health checks)
+        """
+        try:
+            response = self.session.get(f"{base_url}{route}", timeout=timeout)
+        except requests.RequestException as e:
+            if not quiet:
+                print(f"Request to {base_url}{route} failed. Error: {e}")
+            return None
+
+        if response.status_code != 200:
+            return None
+        try:
+            return response.json()
+        except ValueError:
+            return None
+
+    def upload_image(
+        self, base_url: str, image_name: str, buffer, mimetype: str = "image/png"
+    ) -> int:
+        """Upload an encoded image to the comfyUI input folder, return the status code.
+        A status code of 0 means the backend could not be reached
+        """
+        files = {"image": (image_name, buffer, mimetype)}
+        data = {
+            "type": "input",
+            "overwrite": "true",
+        }
+        try:
+            response = self.session.post(
+                f"{base_url}/upload/image",
+                files=files,
+                data=data,
+                timeout=UPLOAD_TIMEOUT,
+            )
+        except requests.RequestException as e:
+            print(f"Failed to upload {image_name}. Error: {e}")
+            return 0
+        return response.status_code
+
+    def queue_prompt(self, base_url: str, payload: dict) -> requests.Response:
+        """Submit a workflow to the comfyUI queue"""
+        return self.submit_session.post(
+            f"{base_url}/prompt", json=payload, timeout=PROMPT_TIMEOUT
+        )
+
+    def exists(self, base_url: str, filename: str, folder_type: str = "input") -> bool:
+        """Cheap check (HEAD, no body) that the backend holds a file"""
+        params = {"filename": filename, "type": folder_type}
+        try:
+            response = self.session.head(
+                f"{base_url}/view", params=params, timeout=CATALOG_TIMEOUT
+            )
+        except requests.RequestException:
+            return False
+        return response.status_code == 200
+
+    def history(self, base_url: str, prompt_id: str) -> Optional[dict]:
+        """`/history/{prompt_id}` entry of a prompt, None until it has finished
+        (or when the backend cannot be reached)
+        """
+        history = self.get_json(base_url, f"/history/{prompt_id}")
+        if not isinstance(history, dict):
+            return None
+        return history.get(prompt_id)
+
+    def view(self, base_url: str, params: dict) -> requests.Response:
+        """Fetch an output file from the comfyUI `/view` route"""
+        return self.session.get(f"{base_url}/view", params=params, timeout=VIEW_TIMEOUT)
+
+    def close(self):
+        self.session.close()
+        self.submit_session.close()
+
+
+def history_outputs(entry: dict) -> List[dict]:
+    """Saved output images of a `/history` entry, in node then batch order.
+    Previews (temp folder) are left out. Raises RuntimeError when the prompt
+    failed on the backend
+    """
+    status = entry.get("status") or {}
+    if status.get("status_str") == "error":
+        message = "Execution error"
+        for event, data in status.get("messages", []):
+            if event == "execution_error":
+                message = data.get("exception_message", message)
+        raise RuntimeError(message)
+
+    images = []
+    outputs = entry.get("outputs") or {}
+    for node_id in sorted(outputs, key=lambda key: (len(key), key)):
+        for image in outputs[node_id].get("images", []):
+            if image.get("type", "output") == "output":
+                images.append(image)
+    return images
+
+
+_client: Optional[BackendClient] = None
+
+
+def get_client() -> BackendClient:
+    """Return the add-on wide backend client, created on first use"""
+    global _client
+    if _client is None:
+        _client = BackendClient()
+    return _client
+
+
+def close_client():
+    """Close pooled connections, called when the add-on is unregistered"""
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
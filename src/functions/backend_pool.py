@@ -0,0 +1,147 @@
+import threading
+import time
+from typing import Dict, FrozenSet, List, Mapping, NamedTuple, Optional
+
+from .backend_client import get_client
+
+# Several comfyUI servers used as a pool : a monitor thread checks the health,
+# queue depth (`/queue`) and checkpoints (`/models/checkpoints`) of every
+# server, and each generation is sent to the least busy server holding its
+# model. A generation then sticks to its server : uploads, prompt and `/view`
+# fetches all use the url recorded on its history item.
+
+HEALTH_INTERVAL = 5.0
+# Health checks are short : a busy server is still a healthy one
+HEALTH_TIMEOUT = (1.0, 2.0)
+
+
+class BackendStatus(NamedTuple):
+    url: str
+    healthy: bool
+    # Prompts running or pending on the server
+    queue_depth: int
+    # None when the server did not list its checkpoints
+    models: Optional[FrozenSet[str]]
+    checked_at: float
+
+
+def parse_urls(primary: str, pool_urls: str) -> List[str]:
+    """Primary url first, then the comma separated pool urls, without duplicates"""
+    urls = []
+    for url in [primary, *pool_urls.split(",")]:
+        url = url.strip().rstrip("/")
+        if url and url not in urls:
+            urls.append(url)
+    return urls
+
+
+def probe_backend(url: str) -> BackendStatus:
+    """Health, queue depth and checkpoints of a server (blocking)"""
+    client = get_client()
+    queue = client.get_json(url, "/queue", timeout=HEALTH_TIMEOUT, quiet=True)
+    if not isinstance(queue, dict):
+        return BackendStatus(url, False, 0, None, time.monotonic())
+
+    depth = len(queue.get("queue_running", [])) + len(queue.get("queue_pending", []))
+    models = client.get_json(
+        url, "/models/checkpoints", timeout=HEALTH_TIMEOUT, quiet=True
+    )
+    return BackendStatus(
+        url,
+        True,
+        depth,
+        frozenset(models) if isinstance(models, list) else None,
+        time.monotonic(),
+    )
+
+
+def choose_backend(
+    statuses: List[BackendStatus], model: str, local_load: Mapping[str, int]
+) -> Optional[str]:
+    """Least loaded healthy server holding `model`, None when there is none.
+    The load is the server queue depth plus the jobs we have not submitted yet
+    (`local_load`), the queue depth being up to one health check late.
+    Ties go to the first server (primary url first)
+    """
+    candidates = [
+        status
+        for status in statuses
+        if status.healthy and (status.models is None or model in status.models)
+    ]
+    if not candidates:
+        return None
+    best = min(
+        candidates,
+        key=lambda status: status.queue_depth + local_load.get(status.url, 0),
+    )
+    return best.url
+
+
+class BackendPool(threading.Thread):
+    """Monitor thread keeping the status of every server of the pool"""
+
+    def __init__(self, interval: float = HEALTH_INTERVAL):
+        super().__init__(name="comfyui-backend-pool", daemon=True)
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._urls: List[str] = []
+        self._statuses: Dict[str, BackendStatus] = {}
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+
+    def set_urls(self, urls: List[str]):
+        """Servers of the pool, probed right away when the list changes"""
+        with self._lock:
+            if urls == self._urls:
+                return
+            self._urls = list(urls)
+        self._wake_event.set()
+
+    def statuses(self) -> List[BackendStatus]:
+        """Last known status of every server, in pool order (never blocks)"""
+        with self._lock:
+            return [
+                self._statuses.get(url, BackendStatus(url, False, 0, None, 0.0))
+                for url in self._urls
+            ]
+
+    def choose(self, model: str, local_load: Mapping[str, int]) -> Optional[str]:
+        return choose_backend(self.statuses(), model, local_load)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            with self._lock:
+                urls = list(self._urls)
+
+            for url in urls:
+                if self._stop_event.is_set():
+                    return
+                status = probe_backend(url)
+                with self._lock:
+                    self._statuses[url] = status
+
+            self._wake_event.wait(self.interval)
+            self._wake_event.clear()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+
+
+_pool: Optional[BackendPool] = None
+
+
+def get_backend_pool() -> BackendPool:
+    """Return the backend pool, its monitor thread is started on first use"""
+    global _pool
+    if _pool is None or not _pool.is_alive():
+        _pool = BackendPool()
+        _pool.start()
+    return _pool
+
+
+def stop_backend_pool():
+    global _pool
+    if _pool is not None:
+        _pool.stop()
+        _pool = None
@@ -0,0 +1,152 @@
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+import bpy
+
+from . import worker
+from .backend_client import get_client
+
+# Model and LoRA lists of the backend, for the enum properties of the panels.
+# Blender asks for enum items on every redraw or hover : the items are served
+# from this cache and never wait on the network. Stale lists are refreshed in
+# the background, and the panels are redrawn when the new list arrives.
+
+CATALOG_TTL = 300.0
+# Delay before asking again a backend that did not answer
+FAILURE_TTL = 15.0
+
+CATALOG_ROUTES = {
+    "models": "/models/checkpoints",
+    "loras": "/models/loras",
+}
+
+
+class CatalogEntry:
+    def __init__(self):
+        # Same tuple object until the content changes, see `ModelCatalog.names`
+        self.names: Tuple[str, ...] = ()
+        self.expires_at = 0.0
+        self.pending = False
+
+
+class ModelCatalog:
+    """TTL cache of the `/models/*` lists, by (backend url, kind).
+    Main thread only : fetches run on the worker and their results are applied
+    by the main thread callback
+    """
+
+    def __init__(self, ttl: float = CATALOG_TTL, failure_ttl: float = FAILURE_TTL):
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self._entries: Dict[Tuple[str, str], CatalogEntry] = {}
+
+    def names(self, base_url: str, kind: str) -> Tuple[str, ...]:
+        """Cached names, never blocks. Schedules a refresh when the list is stale.
+        The returned tuple is the same object as long as the list is unchanged,
+        callers can rebuild derived data only when the identity changes
+        """
+        entry = self._entries.get((base_url, kind))
+        if entry is None or time.monotonic() >= entry.expires_at:
+            self.refresh(base_url, kind)
+            entry = self._entries[(base_url, kind)]
+        return entry.names
+
+    def refresh(self, base_url: str, kind: Optional[str] = None, force: bool = False):
+        """Fetch the lists again in the background (every kind by default).
+        Without `force`, fresh lists and lists already being fetched are left alone
+        """
+        kinds = CATALOG_ROUTES if kind is None else (kind,)
+        now = time.monotonic()
+        for kind in kinds:
+            key = (base_url, kind)
+            entry = self._entries.setdefault(key, CatalogEntry())
+            if entry.pending or (not force and now < entry.expires_at):
+                continue
+
+            entry.pending = True
+            worker.submit(
+                get_client().get_json,
+                base_url,
+                CATALOG_ROUTES[kind],
+                callback=lambda future, key=key: self._on_fetched(key, future),
+            )
+
+    def _on_fetched(self, key: Tuple[str, str], future: Future):
+        entry = self._entries.get(key)
+        if entry is None:
+            # Cleared in the meantime
+            return
+        entry.pending = False
+
+        names = None if future.exception() is not None else future.result()
+        if not isinstance(names, list):
+            print(f"Could not list the {key[1]} of {key[0]}, keeping the cached list")
+            entry.expires_at = time.monotonic() + self.failure_ttl
+            return
+
+        entry.expires_at = time.monotonic() + self.ttl
+        names = tuple(names)
+        if names != entry.names:
+            entry.names = names
+            redraw_panels()
+
+    def clear(self):
+        self._entries.clear()
+
+
+def redraw_panels():
+    """Redraw the 3D view sidebars, where the catalog enums are displayed"""
+    window_manager = bpy.context.window_manager
+    if window_manager is None:
+        return
+    for window in window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == "VIEW_3D":
+                area.tag_redraw()
+
+
+_catalog = ModelCatalog()
+
+# Enum items built from the catalog, by kind : (names they were built from, items).
+# Blender requires python to keep a reference to the strings of dynamic enum items
+_enum_items: Dict[str, Tuple[Tuple[str, ...], List[Tuple[str, str, str]]]] = {}
+
+
+def get_catalog() -> ModelCatalog:
+    return _catalog
+
+
+def catalog_enum_items(
+    base_url: str, kind: str, first_items: Tuple[Tuple[str, str, str], ...] = ()
+) -> List[Tuple[str, str, str]]:
+    """Items of a catalog enum property, rebuilt only when the list changed"""
+    names = _catalog.names(base_url, kind)
+
+    cached = _enum_items.get(kind)
+    if cached is None or cached[0] is not names:
+        items = list(first_items)
+        items += [(name, name.replace(".safetensors", ""), "") for name in names]
+        cached = (names, items)
+        _enum_items[kind] = cached
+    return cached[1]
+
+
+def prefetch_catalogs():
+    """One shot timer : fetch the lists before the panels are first drawn"""
+    scene = bpy.context.scene
+    if scene is not None:
+        _catalog.refresh(scene.backend_properties.url)
+    return None
+
+
+def register():
+    # The scene is not available while the add-on registers
+    bpy.app.timers.register(prefetch_catalogs, first_interval=0.1)
+
+
+def unregister():
+    if bpy.app.timers.is_registered(prefetch_catalogs):
+        bpy.app.timers.unregister(prefetch_catalogs)
+    _catalog.clear()
+    _enum_items.clear()
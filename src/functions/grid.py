@@ -0,0 +1,89 @@
+import math
+from typing import List, Tuple
+
+import numpy as np
+from PIL import Image
+
+# Multi-view "grid trick" : the depth maps of several cameras are tiled in a
+# single conditioning image, so one diffusion pass textures every view with a
+# consistent style. Tiles are square, like the cameras rendering them.
+
+# Exponent of the facing ratio weighting the views of a grid on the mesh : the
+# most frontal view of a vertex dominates, the others only show near the seams
+BLEND_SHARPNESS = 4.0
+
+
+def grid_shape(count: int) -> Tuple[int, int]:
+    """(rows, columns) of the smallest near square grid holding `count` tiles"""
+    columns = math.ceil(math.sqrt(count))
+    rows = math.ceil(count / columns)
+    return rows, columns
+
+
+def tile_size(count: int, size: int) -> int:
+    """Side of the square tiles of a grid fitting in a `size` x `size` image"""
+    rows, columns = grid_shape(count)
+    return size // max(rows, columns)
+
+
+def tile_box(index: int, count: int, size: int) -> Tuple[int, int, int, int]:
+    """(left, top, right, bottom) pixel box of a tile, tiles are in row order"""
+    _, columns = grid_shape(count)
+    side = tile_size(count, size)
+    left = (index % columns) * side
+    top = (index // columns) * side
+    return left, top, left + side, top + side
+
+
+def make_grid(tiles: List[np.ndarray], size: int) -> np.ndarray:
+    """Tile (height, width) uint8 maps, rows top to bottom, in a `size` x `size`
+    image. Each map is resized to the tile size, unused cells stay black
+    (background of the depth maps)
+    """
+    grid = np.zeros((size, size), dtype=np.uint8)
+    side = tile_size(len(tiles), size)
+
+    for index, tile in enumerate(tiles):
+        left, top, right, bottom = tile_box(index, len(tiles), size)
+        if tile.shape != (side, side):
+            tile = np.asarray(
+                Image.fromarray(tile).resize((side, side), Image.Resampling.BILINEAR)
+            )
+        grid[top:bottom, left:right] = tile
+
+    return grid
+
+
+def split_grid(image: Image.Image, count: int) -> List[Image.Image]:
+    """Cut a generated grid back into its `count` tiles, in row order.
+    The grid is expected square, as generated from a `make_grid` conditioning
+    """
+    size = min(image.size)
+    return [image.crop(tile_box(index, count, size)) for index in range(count)]
+
+
+def view_weights(
+    positions: np.ndarray,
+    normals: np.ndarray,
+    camera_locations: np.ndarray,
+    sharpness: float = BLEND_SHARPNESS,
+) -> np.ndarray:
+    """(views, vertices) weight of each view at each vertex, from (vertices, 3)
+    world positions and unit normals and (views, 3) camera locations : the facing
+    ratio of the vertex to the camera raised to `sharpness`, 0 when it faces
+    away. Occlusion is not taken into account
+    """
+    directions = camera_locations[:, None, :] - positions[None, :, :]
+    lengths = np.linalg.norm(directions, axis=-1)
+    facing = np.einsum("vnk,nk->vn", directions, normals)
+    facing = np.divide(facing, lengths, out=np.zeros_like(facing), where=lengths > 0)
+    return np.clip(facing, 0, None) ** sharpness
+
+
+def blend_factors(weights: np.ndarray) -> np.ndarray:
+    """Factor of each view mixed over the views before it, so that a chain of
+    mixes gives the average of the views weighted by `weights` (views, vertices).
+    The factor of the first view is 1 where it is seen, it is the base of the chain
+    """
+    totals = np.cumsum(weights, axis=0)
+    return np.divide(weights, totals, out=np.zeros_like(weights), where=totals > 0)
@@ -0,0 +1,149 @@
+from typing import Dict, List, Optional
+
+# Positions of the history items by uuid and by id, and of the items of each
+# batch and grid, so looking a generation up does not scan the whole history
+# collection. The collection is the source of truth : every hit is checked
+# against the item found at the position, and a stale index (file loaded, undo,
+# item changed outside of the operators) is rebuilt on the next lookup. Works on
+# any sequence of items with `uuid`, `id` and `GROUP_ATTRIBUTES` attributes,
+# nothing in here touches bpy directly.
+
+# Attributes grouping the items : the batch (id of its first item) and the
+# multi-view grid (id of its first view) of a generation
+GROUP_ATTRIBUTES = ("camera_id", "grid_id")
+
+
+class HistoryIndex:
+    def __init__(self):
+        # Address of the indexed collection, changes when blender reallocates it
+        self._owner = 0
+        self._by_uuid: Dict[str, int] = {}
+        self._by_id: Dict[int, int] = {}
+        # Positions of the items by group attribute and value, in collection order
+        self._groups: Dict[str, Dict[int, List[int]]] = {}
+        self._valid = False
+
+    def invalidate(self):
+        self._valid = False
+
+    def rebuild(self, owner: int, collection):
+        self._owner = owner
+        self._by_uuid = {item.uuid: index for index, item in enumerate(collection)}
+        self._by_id = {item.id: index for index, item in enumerate(collection)}
+        self._groups = {attribute: {} for attribute in GROUP_ATTRIBUTES}
+        for index, item in enumerate(collection):
+            self._group(item, index)
+        self._valid = True
+
+    def _group(self, item, index: int):
+        for attribute, groups in self._groups.items():
+            groups.setdefault(getattr(item, attribute), []).append(index)
+
+    def added(self, owner: int, collection, index: int):
+        """Index the item just added at `index` (after its uuid and id are set)"""
+        if not self._valid or owner != self._owner:
+            return
+        item = collection[index]
+        self._by_uuid[item.uuid] = index
+        self._by_id[item.id] = index
+        self._group(item, index)
+
+    def regrouped(self, owner: int, collection, uuid: str):
+        """Move the item of `uuid` to its groups after one of its
+        `GROUP_ATTRIBUTES` changed"""
+        if not self._valid or owner != self._owner:
+            return
+        index = self._by_uuid.get(uuid)
+        if self._check(collection, "uuid", uuid, index) is None:
+            self.invalidate()
+            return
+        for groups in self._groups.values():
+            for key, positions in list(groups.items()):
+                if index in positions:
+                    positions.remove(index)
+                    if not positions:
+                        del groups[key]
+        self._group(collection[index], index)
+
+    def removed(self, index: int):
+        """Forget the item removed at `index`, the following ones move back"""
+        if not self._valid:
+            return
+        self._by_uuid = self._shift(self._by_uuid, index)
+        self._by_id = self._shift(self._by_id, index)
+        self._groups = {
+            attribute: self._shift_groups(groups, index)
+            for attribute, groups in self._groups.items()
+        }
+
+    @staticmethod
+    def _shift(positions: dict, removed: int) -> dict:
+        return {
+            key: index - 1 if index > removed else index
+            for key, index in positions.items()
+            if index != removed
+        }
+
+    @staticmethod
+    def _shift_groups(groups: dict, removed: int) -> dict:
+        shifted = {}
+        for key, positions in groups.items():
+            positions = [
+                index - 1 if index > removed else index
+                for index in positions
+                if index != removed
+            ]
+            if positions:
+                shifted[key] = positions
+        return shifted
+
+    def find(self, owner: int, collection, uuid: str):
+        """Item of a generation uuid, None when it is not in the collection"""
+        return self._find(owner, collection, "uuid", uuid, lambda: self._by_uuid)
+
+    def find_by_id(self, owner: int, collection, id: int):
+        """Item of a history id, None when it is not in the collection"""
+        return self._find(owner, collection, "id", id, lambda: self._by_id)
+
+    def _find(self, owner: int, collection, attribute: str, key, positions):
+        if self._valid and owner == self._owner:
+            item = self._check(collection, attribute, key, positions().get(key))
+            if item is not None:
+                return item
+
+        # Missing or stale : the items may have changed outside of the operators
+        self.rebuild(owner, collection)
+        return self._check(collection, attribute, key, positions().get(key))
+
+    def group(self, owner: int, collection, attribute: str, key) -> Optional[list]:
+        """Items whose group `attribute` is `key`, in collection order. None
+        when there is none : the add and remove hooks keep the groups current,
+        a missing group is not looked for in the collection"""
+        if not self._valid or owner != self._owner:
+            self.rebuild(owner, collection)
+
+        positions = self._groups[attribute].get(key)
+        if positions is None:
+            return None
+        items = [self._check(collection, attribute, key, index) for index in positions]
+        if all(item is not None for item in items):
+            return items
+
+        # Stale : the items have changed outside of the operators
+        self.rebuild(owner, collection)
+        positions = self._groups[attribute].get(key, [])
+        return [collection[index] for index in positions] or None
+
+    @staticmethod
+    def _check(collection, attribute: str, key, index: Optional[int]):
+        if index is None or index >= len(collection):
+            return None
+        item = collection[index]
+        return item if getattr(item, attribute) == key else None
+
+
+_index = HistoryIndex()
+
+
+def get_history_index() -> HistoryIndex:
+    return _index
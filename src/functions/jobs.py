@@ -0,0 +1,259 @@
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+# Generation jobs, from the GENERATE click to the texture applied on the mesh.
+#
+#   pending -> uploading -> queued -> running -> fetching -> applied
+#                                                         \-> failed (any step)
+#
+# - pending : waiting for a free slot on its backend
+# - uploading : dispatched, waiting for its input uploads then submitted
+# - queued / running : on the backend queue / being sampled
+# - fetching : output available, being downloaded and applied
+#
+# Jobs are dispatched by priority (interactive before batch), then in order of
+# creation, with a limit of active jobs (uploading, queued, running) per
+# backend. The queue is saved to disk on every change so outstanding results
+# can be fetched again after a restart. Nothing in here touches bpy data.
+
+PENDING = "pending"
+UPLOADING = "uploading"
+QUEUED = "queued"
+RUNNING = "running"
+FETCHING = "fetching"
+APPLIED = "applied"
+FAILED = "failed"
+
+# States holding a slot of the backend
+ACTIVE_STATES = (UPLOADING, QUEUED, RUNNING)
+# States whose result can still be fetched after a restart
+RESUMABLE_STATES = (QUEUED, RUNNING, FETCHING)
+FINISHED_STATES = (APPLIED, FAILED)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+# Finished jobs kept in the saved queue
+MAX_FINISHED_JOBS = 100
+
+# Seconds after their submission past which queued or running jobs are not
+# resumed when the queue is loaded : their backend has most likely forgotten
+# them, and they would hold a slot of the backend forever
+RESUME_MAX_AGE = 6 * 3600.0
+
+
+class Job:
+    """A generation request. `payload` and `uploads` only live in memory : a
+    job interrupted before its submission cannot be resumed"""
+
+    _sequence = itertools.count()
+
+    def __init__(
+        self,
+        uuid: str,
+        url: str,
+        priority: int = PRIORITY_INTERACTIVE,
+        state: str = PENDING,
+        prompt_id: str = "",
+        error: str = "",
+        created_at: Optional[float] = None,
+        submitted_at: float = 0.0,
+        latency_key: str = "",
+        result_key: str = "",
+    ):
+        self.uuid = uuid
+        self.url = url
+        self.priority = priority
+        self.state = state
+        self.prompt_id = prompt_id
+        self.error = error
+        self.created_at = time.time() if created_at is None else created_at
+        # Time the prompt entered the backend queue, 0 until then
+        self.submitted_at = submitted_at
+        # Completion times are learned under this key, see `functions/latency.py`
+        self.latency_key = latency_key
+        # Outputs are stored in the result cache under this key, when enabled
+        self.result_key = result_key
+        self.order = next(Job._sequence)
+
+        self.payload: Optional[dict] = None
+        self.uploads: list = []
+        self.use_websocket = False
+        self.use_result_cache = False
+        # Where the outputs are written, in batch order
+        self.output_paths: List[str] = []
+
+    def to_dict(self) -> dict:
+        return {
+            "uuid": self.uuid,
+            "url": self.url,
+            "priority": self.priority,
+            "state": self.state,
+            "prompt_id": self.prompt_id,
+            "error": self.error,
+            "created_at": self.created_at,
+            "submitted_at": self.submitted_at,
+            "latency_key": self.latency_key,
+            "result_key": self.result_key,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Job":
+        return cls(
+            data["uuid"],
+            data["url"],
+            priority=data.get("priority", PRIORITY_INTERACTIVE),
+            state=data.get("state", PENDING),
+            prompt_id=data.get("prompt_id", ""),
+            error=data.get("error", ""),
+            created_at=data.get("created_at"),
+            submitted_at=data.get("submitted_at", 0.0),
+            latency_key=data.get("latency_key", ""),
+            result_key=data.get("result_key", ""),
+        )
+
+
+class JobQueue:
+    """Jobs by uuid, saved as json to `path` (not saved when empty)"""
+
+    def __init__(self, path: str = ""):
+        self.path = path
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Job] = {}
+
+    def add(self, job: Job) -> Job:
+        with self._lock:
+            self._jobs[job.uuid] = job
+        self.save()
+        return job
+
+    def get(self, uuid: str) -> Optional[Job]:
+        return self._jobs.get(uuid)
+
+    def jobs(self, states: Optional[Iterable[str]] = None) -> List[Job]:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        if states is not None:
+            jobs = [job for job in jobs if job.state in states]
+        return sorted(jobs, key=lambda job: job.order)
+
+    def set_state(self, uuid: str, state: str, error: str = "", **fields) -> bool:
+        """Move a job to `state`, other fields (e.g. prompt_id) can be set along.
+        Returns False for unknown jobs (e.g. generations older than the queue)
+        """
+        job = self._jobs.get(uuid)
+        if job is None:
+            return False
+        job.state = state
+        job.error = error
+        for name, value in fields.items():
+            setattr(job, name, value)
+        if state in FINISHED_STATES:
+            job.payload = None
+            job.uploads = []
+        self.save()
+        return True
+
+    def fail_unfinished(self, uuid: str, error: str) -> bool:
+        """Fail a job unless it already finished, e.g. when its generation is
+        gone : an active job would hold a slot of its backend forever"""
+        job = self._jobs.get(uuid)
+        if job is None or job.state in FINISHED_STATES:
+            return False
+        return self.set_state(uuid, FAILED, error)
+
+    def active_count(self, url: str) -> int:
+        return sum(1 for job in self.jobs(ACTIVE_STATES) if job.url == url)
+
+    def has_active(self, url: str, priority: int) -> bool:
+        return any(
+            job.url == url and job.priority == priority
+            for job in self.jobs(ACTIVE_STATES)
+        )
+
+    def unsubmitted_counts(self) -> Dict[str, int]:
+        """Jobs not on their backend queue yet (pending, uploading), by url"""
+        counts: Dict[str, int] = {}
+        for job in self.jobs((PENDING, UPLOADING)):
+            counts[job.url] = counts.get(job.url, 0) + 1
+        return counts
+
+    def next_pending(self, url: str) -> Optional[Job]:
+        """Highest priority pending job of a backend, oldest first"""
+        pending = [job for job in self.jobs((PENDING,)) if job.url == url]
+        if not pending:
+            return None
+        return min(pending, key=lambda job: (job.priority, job.order))
+
+    def pending_urls(self) -> List[str]:
+        return sorted({job.url for job in self.jobs((PENDING,))})
+
+    def counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for job in self.jobs():
+            counts[job.state] = counts.get(job.state, 0) + 1
+        return counts
+
+    def prune(self, max_finished: int = MAX_FINISHED_JOBS):
+        """Forget the oldest finished jobs"""
+        finished = self.jobs(FINISHED_STATES)
+        with self._lock:
+            for job in finished[: max(0, len(finished) - max_finished)]:
+                del self._jobs[job.uuid]
+
+    def save(self):
+        """Write the queue atomically, a crash never leaves a truncated file"""
+        if not self.path:
+            return
+        self.prune()
+        data = {"jobs": [job.to_dict() for job in self.jobs()]}
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Could not save the job queue to {self.path}. Error: {e}")
+
+    def load(self, max_age: float = RESUME_MAX_AGE):
+        """Read the saved queue. Jobs interrupted before their submission lost
+        their inputs, and jobs submitted more than `max_age` seconds ago are
+        not resumed : both are marked as failed
+        """
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Could not read the job queue {self.path}. Error: {e}")
+            return
+
+        now = time.time()
+        with self._lock:
+            for item in data.get("jobs", []):
+                job = Job.from_dict(item)
+                if job.state in (PENDING, UPLOADING):
+                    job.state = FAILED
+                    job.error = "Interrupted before submission"
+                elif (
+                    job.state in (QUEUED, RUNNING) and now - job.submitted_at > max_age
+                ):
+                    job.state = FAILED
+                    job.error = "Expired before its result was fetched"
+                self._jobs.setdefault(job.uuid, job)
+
+    def clear(self):
+        with self._lock:
+            self._jobs.clear()
+
+
+_queue = JobQueue()
+
+
+def get_job_queue() -> JobQueue:
+    return _queue
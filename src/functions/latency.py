@@ -0,0 +1,107 @@
+import json
+import os
+import threading
+from typing import Dict
+
+# Completion time of the generations, from the submission of the prompt to its
+# outputs being available, learned per (backend, model, steps, resolution,
+# batch size). The estimate drives the polling schedule of the result :
+#
+#   submitted ... quiet ... | dense polls | backoff polls ...
+#                        0.8 x estimate  estimate
+#
+# - nothing is requested before most of the expected time has passed
+# - polls are dense around the expected completion, results show up quickly
+# - past the estimate, the interval grows with the delay (exponential backoff)
+#
+# Nothing in here touches bpy data.
+
+# Weight of a new observation in the moving estimate
+SMOOTHING = 0.3
+
+# Fraction of the estimate spent without polling
+QUIET_FRACTION = 0.8
+# Seconds between two polls around the expected completion
+DENSE_INTERVAL = 0.5
+# Past the estimate, the next poll waits this fraction of the delay so far
+BACKOFF = 0.5
+MAX_INTERVAL = 8.0
+
+
+def latency_key(
+    url: str, model: str, steps: int, width: int, height: int, batch_size: int
+) -> str:
+    """Key of the estimates, a string to be saved as json"""
+    return f"{url}|{model}|{steps}|{width}x{height}|{batch_size}"
+
+
+def next_poll_time(elapsed: float, estimate: float) -> float:
+    """Time since the submission of the next poll, after a poll at `elapsed`
+    seconds found no result"""
+    quiet_until = estimate * QUIET_FRACTION
+    if elapsed < quiet_until:
+        return quiet_until
+    if elapsed < estimate:
+        return elapsed + DENSE_INTERVAL
+    delay = (elapsed - estimate) * BACKOFF
+    return elapsed + min(MAX_INTERVAL, max(DENSE_INTERVAL, delay))
+
+
+class LatencyModel:
+    """Exponential moving average of the completion times by key, saved as json
+    to `path` (not saved when empty)"""
+
+    def __init__(self, path: str = "", smoothing: float = SMOOTHING):
+        self.path = path
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._estimates: Dict[str, float] = {}
+
+    def estimate(self, key: str, default: float) -> float:
+        """Expected completion time in seconds, `default` for unseen keys"""
+        return self._estimates.get(key, default)
+
+    def observe(self, key: str, seconds: float):
+        with self._lock:
+            previous = self._estimates.get(key)
+            if previous is None:
+                self._estimates[key] = seconds
+            else:
+                self._estimates[key] = previous + self.smoothing * (seconds - previous)
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {"estimates": dict(self._estimates)}
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Could not save the completion times to {self.path}. Error: {e}")
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Could not read the completion times {self.path}. Error: {e}")
+            return
+        with self._lock:
+            self._estimates.update(data.get("estimates", {}))
+
+    def clear(self):
+        with self._lock:
+            self._estimates.clear()
+
+
+_model = LatencyModel()
+
+
+def get_latency_model() -> LatencyModel:
+    return _model
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from typing import Dict, List, Optional
+
+# Outputs of past generations on local disk, so a generation with exactly the
+# same inputs is applied without a diffusion pass. The key is a hash of the
+# compiled workflow (prompt, seed, sampler, model, LoRA, scales ...) where the
+# uploaded conditioning images are replaced by the digest of their content.
+#
+# Entries are the output files `{key}_{index}.png` of a folder. The file
+# modification time is the last use : the least recently used entries are
+# removed when the folder grows over its size limit. Nothing in here touches
+# bpy data.
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# Inputs which do not change the generated pixels
+IGNORED_INPUTS = ("filename_prefix",)
+
+
+def result_key(prompt: dict, digests: Dict[str, str]) -> str:
+    """Canonical hash of a compiled workflow. `digests` maps the names of the
+    uploaded images (as in the workflow) to the digest of their content"""
+    canonical = {}
+    for node_id, node in prompt.items():
+        inputs = {}
+        for name, value in node["inputs"].items():
+            if name in IGNORED_INPUTS:
+                continue
+            if name == "image" and isinstance(value, str) and value in digests:
+                value = {"digest": digests[value]}
+            inputs[name] = value
+        canonical[node_id] = {"class_type": node["class_type"], "inputs": inputs}
+
+    data = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(data.encode(), digest_size=16).hexdigest()
+
+
+class ResultCache:
+    """Output files by result key, in `folder` (disabled when empty), bounded
+    to `max_bytes` on disk"""
+
+    def __init__(self, folder: str = "", max_bytes: int = DEFAULT_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def entry_paths(self, key: str, count: int) -> List[str]:
+        return [os.path.join(self.folder, f"{key}_{i}.png") for i in range(count)]
+
+    def lookup(self, key: str, count: int) -> Optional[List[str]]:
+        """Paths of the `count` outputs of an entry, None when not cached.
+        A hit marks the entry as recently used
+        """
+        if not self.folder:
+            return None
+        paths = self.entry_paths(key, count)
+        with self._lock:
+            if not all(os.path.isfile(path) for path in paths):
+                return None
+            for path in paths:
+                os.utime(path)
+        return paths
+
+    def restore(self, key: str, save_paths: List[str]) -> bool:
+        """Copy the outputs of an entry to `save_paths`, False on a miss"""
+        paths = self.lookup(key, len(save_paths))
+        if paths is None:
+            return False
+        for path, save_path in zip(paths, save_paths):
+            shutil.copyfile(path, save_path)
+        return True
+
+    def store(self, key: str, output_paths: List[str]):
+        """Keep a copy of the output files of a generation, in batch order"""
+        if not self.folder:
+            return
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            with self._lock:
+                for path, entry_path in zip(
+                    output_paths, self.entry_paths(key, len(output_paths))
+                ):
+                    # Atomic, a partial entry is never read
+                    shutil.copyfile(path, f"{entry_path}.tmp")
+                    os.replace(f"{entry_path}.tmp", entry_path)
+            self.evict()
+        except OSError as e:
+            print(f"Could not cache the result {key}. Error: {e}")
+
+    def evict(self):
+        """Remove the least recently used files until the folder fits its limit"""
+        with self._lock:
+            files = []
+            for entry in os.scandir(self.folder):
+                if entry.is_file() and entry.name.endswith(".png"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                os.remove(path)
+                total -= size
+
+
+_cache = ResultCache()
+
+
+def get_result_cache() -> ResultCache:
+    return _cache
@@ -0,0 +1,72 @@
+from io import BytesIO
+from typing import Dict, NamedTuple, Tuple
+
+from PIL import Image
+
+# How each kind of conditioning image travels to the backend.
+# comfyUI reads uploads with PIL and converts them to what each node needs
+# (RGB for LoadImage, a single channel for LoadImageMask) so compact modes are
+# as good as RGB for the generation, and much smaller on the wire.
+
+DEFAULT_COMPRESS_LEVEL = 6
+WEBP_METHOD = 2
+
+
+class TransportFormat(NamedTuple):
+    mode: str
+    format: str
+    extension: str
+    mimetype: str
+
+
+PNG_RGB = TransportFormat("RGB", "PNG", ".png", "image/png")
+PNG_GRAY = TransportFormat("L", "PNG", ".png", "image/png")
+PNG_BINARY = TransportFormat("1", "PNG", ".png", "image/png")
+WEBP_RGB = TransportFormat("RGB", "WEBP", ".webp", "image/webp")
+WEBP_GRAY = TransportFormat("L", "WEBP", ".webp", "image/webp")
+
+# kind -> (PNG format, format when lossless WebP is accepted by the backend)
+TRANSPORT_FORMATS: Dict[str, Tuple[TransportFormat, TransportFormat]] = {
+    # All channels of the depth map hold the same value
+    "depth": (PNG_GRAY, WEBP_GRAY),
+    # Binary image, 1 bit PNG is far smaller than any WebP
+    "mask": (PNG_BINARY, PNG_BINARY),
+    # Inpainting render, IP-Adapter reference
+    "color": (PNG_RGB, WEBP_RGB),
+}
+
+
+def transport_format(kind: str, allow_webp: bool = False) -> TransportFormat:
+    png_format, webp_format = TRANSPORT_FORMATS[kind]
+    return webp_format if allow_webp else png_format
+
+
+def to_transport_mode(image: Image.Image, mode: str) -> Image.Image:
+    if image.mode == mode:
+        return image
+    if mode == "1":
+        # Threshold instead of the default dithering
+        return image.convert("L").point(lambda value: 255 if value >= 128 else 0, "1")
+    return image.convert(mode)
+
+
+def encode_for_transport(
+    image: Image.Image,
+    kind: str,
+    compress_level: int = DEFAULT_COMPRESS_LEVEL,
+    allow_webp: bool = False,
+) -> Tuple[bytes, TransportFormat]:
+    """Encode an image with the lossless format chosen for its kind.
+    `compress_level` is the zlib level (0-9) of PNG encodings
+    """
+
+    transport = transport_format(kind, allow_webp)
+    image = to_transport_mode(image, transport.mode)
+
+    buffer = BytesIO()
+    if transport.format == "WEBP":
+        image.save(buffer, format="WEBP", lossless=True, method=WEBP_METHOD)
+    else:
+        image.save(buffer, format="PNG", compress_level=compress_level)
+
+    return buffer.getvalue(), transport
@@ -0,0 +1,92 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+MAX_ENTRIES = 512
+
+
+def content_digest(data: bytes) -> str:
+    """Hash of encoded image bytes, used as the content address"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def pixels_source_key(raw: bytes, mode: str, size: tuple) -> tuple:
+    """Pre-encoding key of an in-memory image, hashing raw pixels is much
+    cheaper than the PNG encoding it lets us skip"""
+    return ("pixels", mode, tuple(size), content_digest(raw))
+
+
+def file_source_key(path: str) -> Optional[tuple]:
+    """Pre-encoding key of an image file, no pixel is read"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return ("file", os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def remote_name(digest: str, extension: str = ".png") -> str:
+    """Content addressed file name on the backend : different images never
+    overwrite each other, identical images share a single upload"""
+    return f"td_{digest}{extension}"
+
+
+class UploadCache:
+    """Remembers which encoded images each backend already holds.
+
+    - `sources` maps a pre-encoding key (raw pixels or file stat) to the digest
+      of its encoded bytes, so a hit skips the encoding as well as the upload
+    - `uploads` maps (backend url, digest) to the name of the file on the backend
+
+    Both are bounded LRU maps, shared by the upload threads.
+    """
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._sources: "OrderedDict[Hashable, str]" = OrderedDict()
+        self._uploads: "OrderedDict[tuple, str]" = OrderedDict()
+
+    def _get(self, entries: OrderedDict, key):
+        with self._lock:
+            value = entries.get(key)
+            if value is not None:
+                entries.move_to_end(key)
+            return value
+
+    def _set(self, entries: OrderedDict, key, value):
+        with self._lock:
+            entries[key] = value
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def digest_for(self, source_key: Hashable) -> Optional[str]:
+        return self._get(self._sources, source_key)
+
+    def remember_source(self, source_key: Hashable, digest: str):
+        self._set(self._sources, source_key, digest)
+
+    def uploaded_name(self, url: str, digest: str) -> Optional[str]:
+        return self._get(self._uploads, (url, digest))
+
+    def remember_upload(self, url: str, digest: str, name: str):
+        self._set(self._uploads, (url, digest), name)
+
+    def forget_upload(self, url: str, digest: str):
+        with self._lock:
+            self._uploads.pop((url, digest), None)
+
+    def clear(self):
+        with self._lock:
+            self._sources.clear()
+            self._uploads.clear()
+
+
+_cache = UploadCache()
+
+
+def get_upload_cache() -> UploadCache:
+    return _cache
@@ -1,10 +1,27 @@
+import functools
 from io import BytesIO
+from typing import Callable, Dict, Optional, Tuple, Union
 
 import bpy
 import numpy as np
-import requests
 from PIL import Image
 
+from . import worker
+from .backend_client import get_client
+from .transport import (
+    DEFAULT_COMPRESS_LEVEL,
+    TransportFormat,
+    encode_for_transport,
+    transport_format,
+)
+from .upload_cache import (
+    content_digest,
+    file_source_key,
+    get_upload_cache,
+    pixels_source_key,
+    remote_name,
+)
+
 
 def normalize_array(array: np.ndarray):
     return (array - np.min(array)) / np.max(array - np.min(array))
@@ -29,6 +46,89 @@ def reverse_color(color_array: np.ndarray):
     return 255 - color_array
 
 
+# Number of entries of the lookup tables : 16 bit quantization of [0, 1] keeps
+# the steep start of the sRGB curve within one 8 bit level of the exact formula
+LUT_SIZE = 1 << 16
+
+
+def srgb_transfer(values: np.ndarray) -> np.ndarray:
+    """Exact linear to sRGB curve, [0, 1] -> [0, 255.99]"""
+    return (
+        np.where(
+            values <= 0.0031308,
+            12.92 * values,
+            1.055 * np.power(values, 1 / 2.4) - 0.055,
+        )
+        * 255.99
+    )
+
+
+# Transfer functions served by `get_lut`, from [0, 1] floats to [0, 256) values
+TRANSFER_FUNCTIONS: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "linear": lambda values: values * 255,
+    "srgb": srgb_transfer,
+    "srgb_inverted": lambda values: 255 - np.floor(srgb_transfer(values)),
+}
+
+
+class LookupTable:
+    """Transfer function precomputed once for `size` evenly spaced inputs in [0, 1].
+    Applying it is a single quantization of the input and an indexed gather,
+    instead of evaluating the function (and its branches) per pixel
+    """
+
+    def __init__(self, function: Callable[[np.ndarray], np.ndarray], size=LUT_SIZE):
+        samples = np.linspace(0.0, 1.0, size, dtype=np.float64)
+        self.table = np.clip(function(samples), 0, 255).astype(np.uint8)
+        self.scale = size - 1
+
+    def apply(self, values: np.ndarray) -> np.ndarray:
+        """Map float values in [0, 1] (clipped) to uint8, keeping the array shape"""
+        index = np.multiply(values, self.scale, dtype=np.float32)
+        np.clip(index, 0, self.scale, out=index)
+        index += 0.5
+        return self.table[index.astype(np.uint16)]
+
+
+@functools.lru_cache(maxsize=None)
+def get_lut(name: str) -> LookupTable:
+    """Lookup table of one of the `TRANSFER_FUNCTIONS`, built on first use"""
+    return LookupTable(TRANSFER_FUNCTIONS[name])
+
+
+def process_depth_map(pixels: np.ndarray) -> Optional[np.ndarray]:
+    """Turn the raw depth pass into the 8 bit depth map used for conditioning.
+
+    Input : (height, width, channels) float array as read from blender (rows
+    bottom to top, every color channel holding the same depth).
+    Output : (height, width) uint8 array, rows top to bottom, near is bright.
+    Returns None when there is no depth to use (less than 3 distinct depths).
+
+    Works on a single float32 channel, in place and in linear time :
+    - the background is the largest depth, everything else is clamped 5% past
+      the second largest depth (farthest point of the mesh)
+    - normalize, then apply the sRGB transfer curve and invert with a lookup table
+    """
+
+    # Flip the rows, keep a single channel
+    depth = np.array(pixels[::-1, :, 0], dtype=np.float32)
+
+    background = depth.max()
+    farthest = depth.max(where=depth < background, initial=-np.inf)
+    nearest = depth.min()
+    if farthest == -np.inf or nearest == farthest:
+        return None
+
+    np.minimum(depth, farthest * 1.05, out=depth)
+
+    # Normalize
+    depth -= nearest
+    depth *= 1 / depth.max()
+
+    # Linear to sRGB and reverse colors in a single lookup
+    return get_lut("srgb_inverted").apply(depth)
+
+
 def convert_to_bytes(image: Image.Image):
 
     buffer = BytesIO()
@@ -38,23 +138,227 @@ def convert_to_bytes(image: Image.Image):
     return buffer
 
 
-# pyright: reportAttributeAccessIssue=false
+# Reused float32 buffers for pixel readouts, by number of values. Only reads use
+# them : a write never overwrites the result of a read still in use
+_pixel_buffers: Dict[int, np.ndarray] = {}
+MAX_PIXEL_BUFFERS = 4
+
+
+def get_pixel_buffer(size: int) -> np.ndarray:
+    buffer = _pixel_buffers.pop(size, None)
+    if buffer is None:
+        if len(_pixel_buffers) >= MAX_PIXEL_BUFFERS:
+            # Forget the least recently used size only
+            del _pixel_buffers[next(iter(_pixel_buffers))]
+        buffer = np.empty(size, dtype=np.float32)
+    _pixel_buffers[size] = buffer
+    return buffer
+
+
+def read_image_pixels(image: bpy.types.Image) -> np.ndarray:
+    """Read the pixels of a blender image as a (height, width, channels) float32 array.
+
+    `foreach_get` copies straight into a preallocated buffer instead of building
+    a python tuple with `pixels[:]`. The buffer is reused : the returned array is
+    only valid until the next read of an image of the same size, copy it to keep it.
+    Rows are bottom to top, as stored by blender
+    """
+    width, height = image.size
+    channels = image.channels
+
+    buffer = get_pixel_buffer(width * height * channels)
+    image.pixels.foreach_get(buffer)  # pyright: ignore
+
+    return buffer.reshape((height, width, channels))
+
+
+def write_image_pixels(image: bpy.types.Image, array: np.ndarray):
+    """Write a (height, width, channels) array to the pixels of a blender image"""
+    values = np.ascontiguousarray(array, dtype=np.float32).ravel()
+    image.pixels.foreach_set(values)  # pyright: ignore
+
+
+def set_image_pixels(name: str, image_array: np.ndarray) -> bpy.types.Image:
+    """Create (or update) the blender image `name` from a uint8 array with rows top
+    to bottom, (height, width) grayscale or (height, width, 3 | 4) color.
+    Pixels are written directly, without going through an image file
+    """
+
+    height, width = image_array.shape[:2]
+
+    image = bpy.data.images.get(name)
+    if image is None:
+        image = bpy.data.images.new(name, width, height)
+    elif tuple(image.size) != (width, height):
+        image.scale(width, height)
+
+    pixels = np.empty((height, width, 4), dtype=np.float32)
+    if image_array.ndim == 2:
+        pixels[:, :, :3] = image_array[::-1, :, None]
+        pixels[:, :, 3] = 255
+    else:
+        channels = image_array.shape[2]
+        pixels[:, :, :channels] = image_array[::-1]
+        if channels == 3:
+            pixels[:, :, 3] = 255
+    pixels *= 1 / 255
+
+    write_image_pixels(image, pixels)
+    return image
+
+
+def upload_image(url: str, image_name: str, image: Image.Image) -> int:
+    """Encode and send the image to the comfyUI backend at `url`.
+    Does not touch bpy data, safe to run on the worker thread
+    """
+
+    buffer = convert_to_bytes(image)
+
+    return get_client().upload_image(url, image_name, buffer)
 
 
 def send_image_function(scene: bpy.types.Scene, image_name: str, image: Image.Image):
     """Send the image to the comfyUI backend"""
 
-    backend_props = scene.backend_properties
+    backend_props = scene.backend_properties  # pyright: ignore
     url = backend_props.url
 
-    # Send Image
-    buffer = convert_to_bytes(image)
-    files = {"image": (image_name, buffer, "image/png")}
+    return upload_image(url, image_name, image)
+
+
+def upload_input(
+    url: str,
+    image_name: str,
+    source: Union[Image.Image, str],
+    kind: str = "color",
+    use_cache: bool = True,
+    verify: bool = True,
+    save_path: str = "",
+    compress_level: int = DEFAULT_COMPRESS_LEVEL,
+    allow_webp: bool = False,
+) -> Tuple[str, str, str]:
+    """Upload job of a generation input, run on the upload pool.
+    `source` is either a PIL image or the path of an image file.
+
+    The image is encoded with the transport format of its `kind` (depth, mask
+    or color), see `transport.py`.
+
+    With the cache, the image is uploaded under a content addressed name and
+    both the encoding and the upload are skipped when the backend already holds
+    the same content (optionally confirmed with a HEAD request).
+
+    The image is encoded once : the same bytes are uploaded and, when
+    `save_path` is given, written to disk for debugging.
+
+    Returns (image_name, name of the file on the backend, digest of the encoded
+    bytes), raises on failure
+    """
+
+    client = get_client()
+
+    def encode() -> Tuple[bytes, TransportFormat]:
+        image = Image.open(source) if isinstance(source, str) else source
+        data, transport = encode_for_transport(image, kind, compress_level, allow_webp)
+        if save_path:
+            with open(save_path, "wb") as f:
+                f.write(data)
+        return data, transport
+
+    if not use_cache:
+        data, transport = encode()
+        status_code = client.upload_image(
+            url, image_name, BytesIO(data), transport.mimetype
+        )
+        if status_code != 200:
+            raise RuntimeError(f"{image_name}: response code {status_code}")
+        return image_name, image_name, content_digest(data)
+
+    cache = get_upload_cache()
+
+    def held_by_backend(digest: Optional[str]) -> Optional[str]:
+        if digest is None:
+            return None
+        name = cache.uploaded_name(url, digest)
+        if name is None:
+            return None
+        if verify and not client.exists(url, name):
+            cache.forget_upload(url, digest)
+            return None
+        return name
+
+    if isinstance(source, str):
+        source_key = file_source_key(source)
+    else:
+        source_key = pixels_source_key(source.tobytes(), source.mode, source.size)
+
+    # The encoded bytes also depend on the transport settings
+    if source_key is not None:
+        source_key = (source_key, transport_format(kind, allow_webp), compress_level)
+
+        digest = cache.digest_for(source_key)
+        name = held_by_backend(digest)
+        if name is not None:
+            print(f"{image_name} already on the backend as {name}, upload skipped")
+            if save_path:
+                encode()
+            return image_name, name, digest
+
+    data, transport = encode()
+    digest = content_digest(data)
+    if source_key is not None:
+        cache.remember_source(source_key, digest)
+
+    # Same content from a different source
+    name = held_by_backend(digest)
+    if name is not None:
+        print(f"{image_name} already on the backend as {name}, upload skipped")
+        return image_name, name, digest
+
+    name = remote_name(digest, transport.extension)
+    status_code = client.upload_image(url, name, BytesIO(data), transport.mimetype)
+    if status_code != 200:
+        raise RuntimeError(f"{image_name}: response code {status_code}")
+
+    cache.remember_upload(url, digest, name)
+    return image_name, name, digest
+
+
+def queue_image_upload(
+    scene: bpy.types.Scene,
+    image_name: str,
+    image: Union[Image.Image, str],
+    uuid: str = "",
+    kind: str = "color",
+    save_path: str = "",
+    url: str = "",
+):
+    """Send the image (or image file) to the comfyUI backend from the upload pool.
+    Inputs of a generation upload in parallel, and when a generation uuid is
+    given the prompt submission waits for all of them.
+    `kind` (depth, mask or color) picks the transport encoding.
+    The encoded image is also written to `save_path` when given.
+    `url` is the backend of the generation, the backend setting by default
+    """
+
+    backend_props = scene.backend_properties  # pyright: ignore
 
-    data = {
-        "type": "input",
-        "overwrite": "true",
-    }
-    response = requests.post(f"{url}/upload/image", files=files, data=data)
+    def report(future):
+        if future.exception() is not None:
+            print(f"Failed to send {image_name}. Error: {future.exception()}")
+        else:
+            print(f"{image_name} is available on the server")
 
-    return response.status_code
+    return worker.submit_upload(
+        uuid,
+        upload_input,
+        url or backend_props.url,
+        image_name,
+        image,
+        kind=kind,
+        use_cache=backend_props.use_upload_cache,
+        verify=backend_props.verify_upload_cache,
+        save_path=save_path,
+        compress_level=backend_props.png_compress_level,
+        allow_webp=backend_props.allow_webp,
+        callback=report,
+    )
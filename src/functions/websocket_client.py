@@ -0,0 +1,306 @@
+import base64
+import hashlib
+import json
+import os
+import socket
+import struct
+import threading
+import uuid
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+# Minimal RFC 6455 client : Blender does not bundle a websocket library, and
+# we only need to read the comfyUI `/ws` event stream.
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+CONNECT_TIMEOUT = 3.0
+RECONNECT_DELAY = 1.0
+RECONNECT_DELAY_MAX = 30.0
+
+
+class WebSocketError(OSError):
+    pass
+
+
+class WebSocketConnection:
+    """Blocking client side websocket connection over a plain socket"""
+
+    def __init__(self, url: str, timeout: float = CONNECT_TIMEOUT):
+        parts = urlsplit(url)
+        if parts.scheme not in ("ws", "wss"):
+            raise WebSocketError(f"Unsupported websocket scheme: {parts.scheme}")
+
+        host = parts.hostname or "127.0.0.1"
+        port = parts.port or (443 if parts.scheme == "wss" else 80)
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+
+        sock = socket.create_connection((host, port), timeout=timeout)
+        if parts.scheme == "wss":
+            import ssl
+
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=host)
+
+        self.sock = sock
+        self._buffer = b""
+        self._handshake(host, port, path)
+        # Events can be minutes apart during a long generation
+        self.sock.settimeout(None)
+
+    def _handshake(self, host: str, port: int, path: str):
+        key = base64.b64encode(os.urandom(16)).decode("ascii")
+        request = (
+            f"GET {path} HTTP/1.1\r\n"
+            f"Host: {host}:{port}\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\n"
+            "Sec-WebSocket-Version: 13\r\n"
+            "\r\n"
+        )
+        self.sock.sendall(request.encode("ascii"))
+
+        while b"\r\n\r\n" not in self._buffer:
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                raise WebSocketError("Connection closed during handshake")
+            self._buffer += chunk
+
+        header, self._buffer = self._buffer.split(b"\r\n\r\n", 1)
+        lines = header.decode("latin-1").split("\r\n")
+        if " 101 " not in f"{lines[0]} ":
+            raise WebSocketError(f"Handshake refused: {lines[0]}")
+
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        expected = base64.b64encode(
+            hashlib.sha1((key + WS_GUID).encode("ascii")).digest()
+        ).decode("ascii")
+        if headers.get("sec-websocket-accept") != expected:
+            raise WebSocketError("Invalid Sec-WebSocket-Accept header")
+
+    def _recv_exact(self, n: int) -> bytes:
+        while len(self._buffer) < n:
+            chunk = self.sock.recv(max(4096, n - len(self._buffer)))
+            if not chunk:
+                raise WebSocketError("Connection closed by the server")
+            self._buffer += chunk
+        data, self._buffer = self._buffer[:n], self._buffer[n:]
+        return data
+
+    def _recv_frame(self) -> Tuple[bool, int, bytes]:
+        b1, b2 = self._recv_exact(2)
+        fin = bool(b1 & 0x80)
+        opcode = b1 & 0x0F
+        masked = bool(b2 & 0x80)
+        length = b2 & 0x7F
+        if length == 126:
+            (length,) = struct.unpack("!H", self._recv_exact(2))
+        elif length == 127:
+            (length,) = struct.unpack("!Q", self._recv_exact(8))
+
+        mask = self._recv_exact(4) if masked else None
+        payload = self._recv_exact(length)
+        if mask is not None:
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        return fin, opcode, payload
+
+    def send_frame(self, opcode: int, payload: bytes = b""):
+        """Send a single masked frame (clients must mask every frame)"""
+        header = bytes([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header += bytes([0x80 | length])
+        elif length < 1 << 16:
+            header += bytes([0x80 | 126]) + struct.pack("!H", length)
+        else:
+            header += bytes([0x80 | 127]) + struct.pack("!Q", length)
+
+        mask = os.urandom(4)
+        masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        self.sock.sendall(header + mask + masked)
+
+    def recv(self) -> Tuple[int, bytes]:
+        """Return the next complete data message as (opcode, payload).
+        Control frames are handled internally, a close frame raises WebSocketError
+        """
+        message_opcode = None
+        fragments: List[bytes] = []
+
+        while True:
+            fin, opcode, payload = self._recv_frame()
+
+            if opcode == OPCODE_PING:
+                self.send_frame(OPCODE_PONG, payload)
+                continue
+            if opcode == OPCODE_PONG:
+                continue
+            if opcode == OPCODE_CLOSE:
+                try:
+                    self.send_frame(OPCODE_CLOSE, payload[:2])
+                except OSError:
+                    pass
+                raise WebSocketError("Connection closed by the server")
+
+            if opcode != OPCODE_CONTINUATION:
+                message_opcode = opcode
+            fragments.append(payload)
+
+            if fin and message_opcode is not None:
+                return message_opcode, b"".join(fragments)
+
+    def close(self):
+        try:
+            self.send_frame(OPCODE_CLOSE, struct.pack("!H", 1000))
+        except OSError:
+            pass
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class ComfyEventListener(threading.Thread):
+    """Background thread following the comfyUI `/ws` event stream of one backend.
+
+    Prompts submitted with this listener's `client_id` report their progress on
+    the stream. The `executed` event of the SaveImage node carries the exact
+    output filenames, which are stored until the main thread collects them with
+    `pop_result`. Nothing in here touches bpy data.
+    """
+
+    def __init__(self, base_url: str):
+        super().__init__(name=f"comfyui-events-{base_url}", daemon=True)
+        self.base_url = base_url
+        self.client_id = uuid.uuid4().hex
+
+        self._lock = threading.Lock()
+        self._results: Dict[str, List[dict]] = {}
+        self._errors: Dict[str, str] = {}
+        self._executing: Set[str] = set()
+        self._connected = threading.Event()
+        self._stop_event = threading.Event()
+        self._connection: Optional[WebSocketConnection] = None
+
+    @property
+    def ws_url(self) -> str:
+        parts = urlsplit(self.base_url)
+        scheme = "wss" if parts.scheme == "https" else "ws"
+        return f"{scheme}://{parts.netloc}{parts.path.rstrip('/')}/ws?clientId={self.client_id}"
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def wait_connected(self, timeout: float) -> bool:
+        return self._connected.wait(timeout)
+
+    def pop_result(self, prompt_id: str) -> Optional[List[dict]]:
+        """Return the output images of a finished prompt, None while it is running"""
+        with self._lock:
+            images = self._results.pop(prompt_id, None)
+            if images is not None:
+                self._executing.discard(prompt_id)
+            return images
+
+    def pop_error(self, prompt_id: str) -> Optional[str]:
+        with self._lock:
+            error = self._errors.pop(prompt_id, None)
+            if error is not None:
+                self._executing.discard(prompt_id)
+            return error
+
+    def has_started(self, prompt_id: str) -> bool:
+        """True once the backend started executing the prompt"""
+        with self._lock:
+            return prompt_id in self._executing
+
+    def handle_message(self, message: dict):
+        msg_type = message.get("type")
+        data = message.get("data") or {}
+        prompt_id = data.get("prompt_id")
+        if prompt_id is None:
+            return
+
+        if msg_type == "execution_start":
+            with self._lock:
+                self._executing.add(prompt_id)
+        elif msg_type == "executed":
+            images = (data.get("output") or {}).get("images")
+            if images:
+                with self._lock:
+                    self._results.setdefault(prompt_id, []).extend(images)
+        elif msg_type == "execution_error":
+            with self._lock:
+                self._errors[prompt_id] = data.get("exception_message", "error")
+
+    def run(self):
+        delay = RECONNECT_DELAY
+        while not self._stop_event.is_set():
+            try:
+                self._connection = WebSocketConnection(self.ws_url)
+            except OSError as e:
+                print(f"Websocket connection to {self.base_url} failed. Error: {e}")
+                self._stop_event.wait(delay)
+                delay = min(delay * 2, RECONNECT_DELAY_MAX)
+                continue
+
+            delay = RECONNECT_DELAY
+            self._connected.set()
+            try:
+                while not self._stop_event.is_set():
+                    opcode, payload = self._connection.recv()
+                    # Binary messages are latent previews, not needed here
+                    if opcode != OPCODE_TEXT:
+                        continue
+                    try:
+                        self.handle_message(json.loads(payload))
+                    except ValueError:
+                        continue
+            except OSError as e:
+                if not self._stop_event.is_set():
+                    print(f"Websocket connection to {self.base_url} lost. Error: {e}")
+            finally:
+                self._connected.clear()
+                self._connection.close()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._connection is not None:
+            self._connection.close()
+
+
+_listeners: Dict[str, ComfyEventListener] = {}
+_listeners_lock = threading.Lock()
+
+
+def get_listener(base_url: str) -> ComfyEventListener:
+    """Return the event listener of a backend, started on first use"""
+    with _listeners_lock:
+        listener = _listeners.get(base_url)
+        if listener is None or not listener.is_alive():
+            listener = ComfyEventListener(base_url)
+            listener.start()
+            _listeners[base_url] = listener
+        return listener
+
+
+def stop_listeners():
+    """Stop every listener thread, called when the add-on is unregistered"""
+    with _listeners_lock:
+        for listener in _listeners.values():
+            listener.stop()
+        _listeners.clear()
@@ -0,0 +1,137 @@
+import queue
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple
+
+import bpy
+
+# Backend I/O and image encoding / decoding run on a worker thread so the UI
+# never waits on the network. bpy data is NOT thread safe : jobs only receive
+# plain python values, and their callbacks are executed on the main thread by
+# a single timer draining the result queue.
+
+DRAIN_INTERVAL = 0.05
+
+# Depth, inpainting, mask and IP-Adapter images of a generation upload together
+UPLOAD_WORKERS = 4
+
+_executor: Optional[ThreadPoolExecutor] = None
+_upload_executor: Optional[ThreadPoolExecutor] = None
+_results: "queue.Queue[Tuple[Callable[[Future], None], Future]]" = queue.Queue()
+
+# Upload jobs of each generation (by uuid), awaited before the prompt submission
+_pending_uploads: Dict[str, List[Future]] = {}
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        # A single worker keeps submissions and downloads in order
+        _executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="texture-diffusion"
+        )
+    return _executor
+
+
+def submit(
+    fn: Callable, *args, callback: Optional[Callable[[Future], None]] = None, **kwargs
+) -> Future:
+    """Run `fn(*args, **kwargs)` on the worker thread.
+    `callback(future)` is then called on the main thread, where bpy data can be used
+    """
+    future = get_executor().submit(fn, *args, **kwargs)
+    if callback is not None:
+        future.add_done_callback(lambda f: _results.put((callback, f)))
+    return future
+
+
+def get_upload_executor() -> ThreadPoolExecutor:
+    global _upload_executor
+    if _upload_executor is None:
+        _upload_executor = ThreadPoolExecutor(
+            max_workers=UPLOAD_WORKERS, thread_name_prefix="texture-diffusion-upload"
+        )
+    return _upload_executor
+
+
+def submit_upload(
+    uuid: str,
+    fn: Callable,
+    *args,
+    callback: Optional[Callable[[Future], None]] = None,
+    **kwargs,
+) -> Future:
+    """Run an upload job in parallel with the other inputs of the generation.
+    When a generation uuid is given, the job is tracked so the prompt
+    submission can wait for it with `wait_for_uploads`
+    """
+    future = get_upload_executor().submit(fn, *args, **kwargs)
+    if callback is not None:
+        future.add_done_callback(lambda f: _results.put((callback, f)))
+    if uuid:
+        _pending_uploads.setdefault(uuid, []).append(future)
+    return future
+
+
+def wait_for_uploads(
+    uploads: List[Future],
+) -> Tuple[Dict[str, str], Dict[str, str], List[str]]:
+    """Block until every upload of a generation is done (worker thread only).
+    Returns the names of the inputs on the backend and the digests of their
+    content (both by requested name), and the error messages of the failed
+    uploads
+    """
+    wait(uploads)
+
+    names = {}
+    digests = {}
+    errors = []
+    for upload in uploads:
+        if upload.exception() is not None:
+            errors.append(str(upload.exception()))
+        else:
+            requested_name, uploaded_name, digest = upload.result()
+            names[requested_name] = uploaded_name
+            digests[requested_name] = digest
+    return names, digests, errors
+
+
+def pop_uploads(uuid: str) -> List[Future]:
+    """Return (and forget) the upload jobs of a generation"""
+    return _pending_uploads.pop(uuid, [])
+
+
+def drain_results() -> float:
+    """Main thread timer : run the callbacks of every finished job"""
+    while True:
+        try:
+            callback, future = _results.get_nowait()
+        except queue.Empty:
+            break
+
+        try:
+            callback(future)
+        except Exception:
+            traceback.print_exc()
+
+    return DRAIN_INTERVAL
+
+
+def register():
+    if not bpy.app.timers.is_registered(drain_results):
+        bpy.app.timers.register(drain_results, persistent=True)
+
+
+def unregister():
+    global _executor, _upload_executor
+
+    if bpy.app.timers.is_registered(drain_results):
+        bpy.app.timers.unregister(drain_results)
+
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+    if _upload_executor is not None:
+        _upload_executor.shutdown(wait=False, cancel_futures=True)
+        _upload_executor = None
+    _pending_uploads.clear()
@@ -0,0 +1,287 @@
+import functools
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+# comfyUI workflows (API format) are compiled once per template file : nodes
+# are found by what they are (class_type, title, placeholder input) instead of
+# hard coded ids, and the parameters of a request are bound to their inputs by
+# the declarative `BINDINGS` table. Building a request is then a shallow copy
+# of the template and a few dict assignments.
+
+WORKFLOWS_DIR = Path(__file__).parent.parent.parent / "workflows"
+
+# (substring of the model name, template file), first match wins
+WORKFLOW_TEMPLATES = (("flux", "flux_workflow.json"),)
+DEFAULT_TEMPLATE = "sdxl_workflow.json"
+
+
+class NodeSelector(NamedTuple):
+    """Finds the node of a role in a template.
+    `placeholder` is an (input, value) pair the node holds in the template, to
+    tell apart nodes of the same class (the LoadImage nodes)
+    """
+
+    class_types: Tuple[str, ...]
+    title: Optional[str] = None
+    placeholder: Optional[Tuple[str, Any]] = None
+
+    def matches(self, node: dict) -> bool:
+        if node["class_type"] not in self.class_types:
+            return False
+        if self.title is not None and node.get("_meta", {}).get("title") != self.title:
+            return False
+        if self.placeholder is not None:
+            name, value = self.placeholder
+            return node["inputs"].get(name) == value
+        return True
+
+
+ROLES: Dict[str, NodeSelector] = {
+    "checkpoint": NodeSelector(("CheckpointLoaderSimple",)),
+    "lora": NodeSelector(("LoraLoader",)),
+    "clip_skip": NodeSelector(("CLIPSetLastLayer",)),
+    "positive": NodeSelector(("CLIPTextEncode",), title="POSITIVE PROMPT"),
+    "negative": NodeSelector(("CLIPTextEncode",), title="NEGATIVE PROMPT"),
+    "guidance": NodeSelector(("FluxGuidance",)),
+    "controlnet": NodeSelector(("ControlNetApply", "ControlNetApplyAdvanced")),
+    "depth_image": NodeSelector(
+        ("LoadImage",), placeholder=("image", "DEPTH MAP IMAGE")
+    ),
+    "inpainting_image": NodeSelector(
+        ("LoadImage",), placeholder=("image", "INPAINTING IMAGE")
+    ),
+    "mask_image": NodeSelector(("LoadImageMask",)),
+    "noise_mask": NodeSelector(("SetLatentNoiseMask",)),
+    "style_image": NodeSelector(
+        ("LoadImage",), placeholder=("image", "STYLE REF IMAGE")
+    ),
+    "ipadapter_loader": NodeSelector(("IPAdapterUnifiedLoader",)),
+    "ipadapter": NodeSelector(("IPAdapter",)),
+    "latent": NodeSelector(("EmptyLatentImage", "EmptySD3LatentImage")),
+    "sampler": NodeSelector(("KSampler",)),
+    "output": NodeSelector(("SaveImage",)),
+}
+
+
+class Param(NamedTuple):
+    """Value of a request parameter"""
+
+    name: str
+
+
+class Link(NamedTuple):
+    """Output `output` of the node of `role`"""
+
+    role: str
+    output: int
+
+
+class Binding(NamedTuple):
+    """Set input `input` of the node of `role`. Skipped when the template has no
+    such node (e.g. clip skip in the flux workflow)"""
+
+    role: str
+    input: str
+    value: Any
+
+
+class BindingGroup(NamedTuple):
+    """Bindings applied when the `when` parameter is true (always when None).
+    The group is dropped for templates missing a `requires` role or holding an
+    `excludes` role
+    """
+
+    bindings: Tuple[Binding, ...]
+    when: Optional[str] = None
+    requires: Tuple[str, ...] = ()
+    excludes: Tuple[str, ...] = ()
+
+
+# Applied in order : later groups override the links set by earlier ones
+BINDINGS: Tuple[BindingGroup, ...] = (
+    BindingGroup(
+        (
+            Binding("positive", "text", Param("prompt")),
+            Binding("checkpoint", "ckpt_name", Param("model")),
+            Binding("sampler", "seed", Param("seed")),
+            Binding("sampler", "steps", Param("n_steps")),
+            Binding("sampler", "sampler_name", Param("sampler_name")),
+            Binding("sampler", "scheduler", Param("scheduler")),
+            Binding("controlnet", "strength", Param("controlnet_scale")),
+            Binding("depth_image", "image", Param("depth_image")),
+            Binding("output", "filename_prefix", Param("output_prefix")),
+            Binding("clip_skip", "stop_at_clip_layer", Param("clip_skip")),
+            Binding("latent", "batch_size", Param("batch_size")),
+        )
+    ),
+    # Flux is guidance distilled : the CFG scale drives the guidance node
+    BindingGroup(
+        (Binding("guidance", "guidance", Param("cfg_scale")),),
+        requires=("guidance",),
+    ),
+    BindingGroup(
+        (Binding("sampler", "cfg", Param("cfg_scale")),),
+        excludes=("guidance",),
+    ),
+    BindingGroup(
+        (
+            Binding("lora", "lora_name", Param("lora")),
+            Binding("lora", "strength_model", Param("lora_scale")),
+            Binding("sampler", "model", Link("lora", 0)),
+            Binding("positive", "clip", Link("lora", 1)),
+            Binding("negative", "clip", Link("lora", 1)),
+            Binding("ipadapter_loader", "model", Link("lora", 0)),
+        ),
+        when="use_lora",
+    ),
+    BindingGroup(
+        (
+            Binding("inpainting_image", "image", Param("inpainting_image")),
+            Binding("mask_image", "image", Param("mask_image")),
+            Binding("sampler", "latent_image", Link("noise_mask", 0)),
+            Binding("sampler", "denoise", Param("denoising_strength")),
+        ),
+        when="toggle_inpainting",
+    ),
+    BindingGroup(
+        (
+            Binding("sampler", "model", Link("ipadapter", 0)),
+            Binding("ipadapter", "weight", Param("scale_ipadapter")),
+            Binding("ipadapter", "weight_type", Param("ipadapter_weight_type")),
+            Binding("style_image", "image", Param("ip_adapter_image")),
+        ),
+        when="toggle_ipadapter",
+        requires=("ipadapter",),
+    ),
+)
+
+
+def find_roles(
+    template: dict, roles: Dict[str, NodeSelector] = ROLES
+) -> Dict[str, str]:
+    """Node id of every role present in the template"""
+    node_ids = {}
+    for role, selector in roles.items():
+        matches = [
+            node_id for node_id, node in template.items() if selector.matches(node)
+        ]
+        if len(matches) > 1:
+            raise ValueError(f"Several nodes match the {role} role: {matches}")
+        if matches:
+            node_ids[role] = matches[0]
+    return node_ids
+
+
+class CompiledWorkflow:
+    """A template with its bindings resolved to node ids.
+    Groups are reduced to (condition, [(node id, input, Param or literal value)])
+    """
+
+    def __init__(
+        self,
+        template: dict,
+        roles: Dict[str, NodeSelector] = ROLES,
+        groups: Tuple[BindingGroup, ...] = BINDINGS,
+    ):
+        self.template = template
+        self.node_ids = find_roles(template, roles)
+
+        self.groups: List[Tuple[Optional[str], List[Tuple[str, str, Any]]]] = []
+        for group in groups:
+            if any(role not in self.node_ids for role in group.requires):
+                continue
+            if any(role in self.node_ids for role in group.excludes):
+                continue
+
+            assignments = []
+            for binding in group.bindings:
+                node_id = self.node_ids.get(binding.role)
+                if node_id is None:
+                    continue
+                value = binding.value
+                if isinstance(value, Link):
+                    if value.role not in self.node_ids:
+                        continue
+                    value = [self.node_ids[value.role], value.output]
+                assignments.append((node_id, binding.input, value))
+            self.groups.append((group.when, assignments))
+
+    def build(self, params: Dict[str, Any], prune: bool = True) -> dict:
+        """Request graph for `params`. Nodes and their inputs are copied, input
+        values are shared with the template : replace them, never mutate them.
+        With `prune`, nodes the output does not depend on are removed
+        """
+        prompt = {}
+        for node_id, node in self.template.items():
+            node = dict(node)
+            node["inputs"] = dict(node["inputs"])
+            prompt[node_id] = node
+
+        for when, assignments in self.groups:
+            if when is not None and not params[when]:
+                continue
+            for node_id, name, value in assignments:
+                if isinstance(value, Param):
+                    value = params[value.name]
+                prompt[node_id]["inputs"][name] = value
+
+        output_id = self.node_ids.get("output")
+        if prune and output_id is not None:
+            prompt = prune_unreachable(prompt, (output_id,))
+
+        return prompt
+
+
+def is_link(value: Any) -> bool:
+    """Inputs linked to another node are [node id, output index] pairs"""
+    return (
+        isinstance(value, list)
+        and len(value) == 2
+        and isinstance(value[0], str)
+        and isinstance(value[1], int)
+    )
+
+
+def prune_unreachable(prompt: dict, outputs: Tuple[str, ...]) -> dict:
+    """Dead node elimination : keep only the nodes the outputs depend on.
+
+    Features toggled off are unlinked by the bindings (LoRA, inpainting,
+    IP-Adapter nodes), so their nodes are dropped from the request : the
+    backend neither validates their inputs (e.g. images that were never
+    uploaded) nor loads their models
+    """
+    live = set()
+    stack = [node_id for node_id in outputs if node_id in prompt]
+    while stack:
+        node_id = stack.pop()
+        if node_id in live:
+            continue
+        live.add(node_id)
+        for value in prompt[node_id]["inputs"].values():
+            if is_link(value) and value[0] not in live:
+                stack.append(value[0])
+
+    return {node_id: node for node_id, node in prompt.items() if node_id in live}
+
+
+@functools.lru_cache(maxsize=None)
+def _compile(path: str, mtime_ns: int) -> CompiledWorkflow:
+    with open(path) as f:
+        template = json.load(f)
+    return CompiledWorkflow(template)
+
+
+def get_workflow(path: str) -> CompiledWorkflow:
+    """Compiled workflow of a template file, parsed again only when the file changes"""
+    return _compile(path, os.stat(path).st_mtime_ns)
+
+
+def workflow_path(model_name: str) -> str:
+    """Template file used for a checkpoint"""
+    name = model_name.lower()
+    for key, file_name in WORKFLOW_TEMPLATES:
+        if key in name:
+            return str(WORKFLOWS_DIR / file_name)
+    return str(WORKFLOWS_DIR / DEFAULT_TEMPLATE)
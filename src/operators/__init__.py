@@ -1,9 +1,16 @@
+from ..functions import catalog, worker
+from ..functions.backend_client import close_client
+from ..functions.backend_pool import stop_backend_pool
+from ..functions.websocket_client import stop_listeners
+from .catalog_operators import catalog_register, catalog_unregister
 from .generation_operators import generation_register, generation_unregister
+from .grid_operators import grid_register, grid_unregister
 from .history_collection_operators import (
     history_collection_register,
     history_collection_unregister,
 )
 from .image_render_operators import image_render_register, image_render_unregister
+from .job_operators import jobs_register, jobs_unregister
 from .mesh_collection_operators import (
     mesh_collection_register,
     mesh_collection_unregister,
@@ -15,6 +22,12 @@ def register():
     generation_register()
     history_collection_register()
     image_render_register()
+    catalog_register()
+    grid_register()
+
+    worker.register()
+    catalog.register()
+    jobs_register()
 
 
 def unregister():
@@ -22,3 +35,12 @@ def unregister():
     generation_unregister()
     history_collection_unregister()
     image_render_unregister()
+    catalog_unregister()
+    grid_unregister()
+
+    jobs_unregister()
+    catalog.unregister()
+    worker.unregister()
+    stop_listeners()
+    stop_backend_pool()
+    close_client()
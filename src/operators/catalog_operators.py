@@ -0,0 +1,24 @@
+import bpy
+
+from ..functions.catalog import get_catalog
+
+
+class RefreshModelsOperator(bpy.types.Operator):
+    """Fetch the model and lora lists from the backend again"""
+
+    bl_idname = "diffusion.refresh_models"
+    bl_label = "Refresh Models"
+
+    def execute(self, context):
+        base_url = context.scene.backend_properties.url
+        get_catalog().refresh(base_url, force=True)
+        self.report({"INFO"}, "Refreshing the models and loras")
+        return {"FINISHED"}
+
+
+def catalog_register():
+    bpy.utils.register_class(RefreshModelsOperator)
+
+
+def catalog_unregister():
+    bpy.utils.unregister_class(RefreshModelsOperator)
@@ -1,13 +1,21 @@
-import json
 import random
 import uuid
-from pathlib import Path
 from typing import Literal, Optional, Set
-from urllib import request
 
 import bmesh
 import bpy
 
+from ..functions import worker
+from ..functions.jobs import PRIORITY_BATCH, PRIORITY_INTERACTIVE
+from ..functions.latency import latency_key
+from ..functions.workflow import get_workflow, workflow_path
+from .history_collection_operators import (
+    batch_items,
+    find_history_item,
+    find_history_item_by_id,
+)
+from .job_operators import enqueue_job
+
 # pyright: reportAttributeAccessIssue=false
 
 
@@ -18,12 +26,6 @@ class ApplyTextureOperator(bpy.types.Operator):
 
     id: bpy.props.IntProperty(name="ID")
 
-    def find_history_item(self, collection):
-        for history_item in collection:
-            if history_item.id == self.id:
-                return history_item
-        return None
-
     def find_camera_object(self, context, collections):
 
         backend_props = context.scene.backend_properties
@@ -40,11 +42,9 @@ class ApplyTextureOperator(bpy.types.Operator):
         assert bpy.context is not None
 
         scene = context.scene
-        history_props = scene.history_properties
         diffusion_props = scene.diffusion_properties
 
-        # Loop through the history collection and find the item with the right id
-        history_item = self.find_history_item(history_props.history_collection)
+        history_item = find_history_item_by_id(self.id)
 
         if history_item is None:
             self.report({"ERROR"}, "No mesh found with the given ID")
@@ -53,6 +53,9 @@ class ApplyTextureOperator(bpy.types.Operator):
         mesh_name = history_item.mesh
         mesh = bpy.data.objects[mesh_name]
 
+        # The UVs and mask were projected for the first image of the batch
+        camera_id = history_item.camera_id or self.id
+
         ### Materials and Textures
 
         if diffusion_props.toggle_inpainting:
@@ -83,8 +86,8 @@ class ApplyTextureOperator(bpy.types.Operator):
 
             # Set values
             color_mix.data_type = "RGBA"
-            color_attribute.layer_name = f"mask {self.id}"
-            uv_node_new.uv_map = f"Texture {self.id}"
+            color_attribute.layer_name = f"mask {camera_id}"
+            uv_node_new.uv_map = f"Texture {camera_id}"
             image_node_new.image = bpy.data.images[f"Generation_{self.id}.png"]
 
             # Links the nodes
@@ -129,7 +132,7 @@ class ApplyTextureOperator(bpy.types.Operator):
             image_node.location = (-800, 100)
 
             # Set values
-            uv_node.uv_map = f"Texture {self.id}"
+            uv_node.uv_map = f"Texture {camera_id}"
             image_node.image = bpy.data.images[f"Generation_{self.id}.png"]
 
             # Links the nodes
@@ -150,14 +153,14 @@ class SendRequestOperator(bpy.types.Operator):
     bl_description = "Send a request to the comfyUI backend to generate the image"
 
     uuid: bpy.props.StringProperty(name="UUID")
-
-    # TODO: change from diffusion props to history item props
-    def get_history_item(self, context: bpy.types.Context) -> Optional[dict]:
-        history_props = context.scene.history_properties
-        for item in history_props.history_collection:
-            if item.uuid == self.uuid:
-                return item
-        return None
+    priority: bpy.props.EnumProperty(
+        name="Priority",
+        items=[
+            ("interactive", "Interactive", "Submitted ahead of batch jobs"),
+            ("batch", "Batch", "Submitted when no interactive job waits"),
+        ],
+        default="interactive",
+    )
 
     def execute(self, context: Optional[bpy.types.Context]) -> Set[str]:
         assert context is not None
@@ -168,120 +171,96 @@ class SendRequestOperator(bpy.types.Operator):
         backend_props = scene.backend_properties
 
         output_prefix = f"blender-texture/{self.uuid}_output"
-        url = backend_props.url
 
         input_depth_name = f"{self.uuid}_depth.png"
         input_inpainting_name = f"{self.uuid}_inpainting.png"
         input_mask_name = f"{self.uuid}_mask.png"
 
         # Get History Item to save properties
-        history_item = self.get_history_item(context)
+        history_item = find_history_item(self.uuid)
         if history_item is None:
             self.report({"ERROR"}, "History item not found")
             return {"CANCELLED"}
 
-        # Prepare Request
-
-        model_name = diffusion_props.models_available
-
-        is_flux = "flux" in model_name.lower()
+        # Backend chosen when the generation was created, where its inputs are
+        url = history_item.url
 
-        if is_flux:
-            json_path = (
-                Path(__file__).parent.parent.parent / "workflows" / "flux_workflow.json"
-            )
-        else:
-            json_path = (
-                Path(__file__).parent.parent.parent / "workflows" / "sdxl_workflow.json"
-            )
-
-        with open(json_path) as f:
-            prompt_workflow_json = f.read()
-        prompt_request = json.loads(prompt_workflow_json)
+        # Prepare Request
+        workflow = get_workflow(workflow_path(diffusion_props.models_available))
 
         # Seed Logic
         seed = diffusion_props.seed
 
+        # Variants of a batch come out of a single sampler pass
+        items = batch_items(history_item)
+
         if diffusion_props.random_seed:
             seed = random.randint(1, 1000000)
             diffusion_props.seed = seed
-            history_item.seed = seed
-
-        prompt_request["6"]["inputs"]["text"] = diffusion_props.prompt
-        prompt_request["3"]["inputs"]["seed"] = seed
-        prompt_request["4"]["inputs"]["ckpt_name"] = diffusion_props.models_available
+            for item in items:
+                item.seed = seed
 
-        if is_flux:
-            prompt_request["5"]["inputs"]["guidance"] = diffusion_props.cfg_scale
+        if diffusion_props.toggle_instantstyle:
+            ipadapter_weight_type = "style transfer"
         else:
-            prompt_request["3"]["inputs"]["cfg"] = diffusion_props.cfg_scale
-
-        prompt_request["3"]["inputs"]["steps"] = diffusion_props.n_steps
-        prompt_request["3"]["inputs"]["sampler_name"] = diffusion_props.sampler_name
-        prompt_request["3"]["inputs"]["scheduler"] = diffusion_props.scheduler
-
-        prompt_request["11"]["inputs"]["strength"] = diffusion_props.controlnet_scale
-
-        # Input-Output Name format
-
-        prompt_request["12"]["inputs"]["image"] = input_depth_name
-        prompt_request["9"]["inputs"]["filename_prefix"] = output_prefix
-
-        if diffusion_props.loras_available != "None":
-            prompt_request["3"]["inputs"]["model"] = ["2", 0]
-            prompt_request["2"]["inputs"]["lora_name"] = diffusion_props.loras_available
-            prompt_request["2"]["inputs"]["strength_model"] = diffusion_props.lora_scale
-            prompt_request["6"]["inputs"]["clip"] = ["2", 1]
-            prompt_request["7"]["inputs"]["clip"] = ["2", 1]
-
-        if diffusion_props.toggle_inpainting:
-            # Update the latent input to use the mask latent
-            prompt_request["16"]["inputs"]["image"] = input_inpainting_name
-            prompt_request["33"]["inputs"]["image"] = input_mask_name
-
-            prompt_request["3"]["inputs"]["latent_image"] = ["30", 0]
-            prompt_request["3"]["inputs"][
-                "denoise"
-            ] = diffusion_props.denoising_strength
-
-        if not is_flux:
-            # SDXL specific : currently IPAdapter, ClipSkip
-
-            prompt_request["36"]["inputs"][
-                "stop_at_clip_layer"
-            ] = diffusion_props.clip_skip
-
-            if diffusion_props.loras_available != "None":
-                prompt_request["22"]["inputs"]["model"] = ["2", 0]
-
-            if diffusion_props.toggle_ipadapter:
-                # Update node to use IPAdapter model
-                prompt_request["3"]["inputs"]["model"] = ["23", 0]
-                prompt_request["23"]["inputs"][
-                    "weight"
-                ] = diffusion_props.scale_ipadapter
-
-                if diffusion_props.toggle_instantstyle:
-                    prompt_request["23"]["inputs"]["weight_type"] = "style transfer"
-                else:
-                    prompt_request["23"]["inputs"]["weight_type"] = "standard"
-
-                prompt_request["35"]["inputs"][
-                    "image"
-                ] = diffusion_props.ip_adapter_image
-
-            # output_name = f"{output_prefix}_output_00001_.png"
-            # Add view register using this output_name
+            ipadapter_weight_type = "standard"
+
+        # Parameters bound to the workflow nodes, see `functions/workflow.py`
+        prompt_request = workflow.build(
+            {
+                "prompt": diffusion_props.prompt,
+                "model": diffusion_props.models_available,
+                "seed": seed,
+                "n_steps": diffusion_props.n_steps,
+                "cfg_scale": diffusion_props.cfg_scale,
+                "sampler_name": diffusion_props.sampler_name,
+                "scheduler": diffusion_props.scheduler,
+                "controlnet_scale": diffusion_props.controlnet_scale,
+                "clip_skip": diffusion_props.clip_skip,
+                "batch_size": len(items),
+                # Input-Output Name format
+                "depth_image": input_depth_name,
+                "output_prefix": output_prefix,
+                "use_lora": diffusion_props.loras_available != "None",
+                "lora": diffusion_props.loras_available,
+                "lora_scale": diffusion_props.lora_scale,
+                "toggle_inpainting": diffusion_props.toggle_inpainting,
+                "inpainting_image": input_inpainting_name,
+                "mask_image": input_mask_name,
+                "denoising_strength": diffusion_props.denoising_strength,
+                "toggle_ipadapter": diffusion_props.toggle_ipadapter,
+                "scale_ipadapter": diffusion_props.scale_ipadapter,
+                "ipadapter_weight_type": ipadapter_weight_type,
+                "ip_adapter_image": diffusion_props.ip_adapter_image,
+            }
+        )
 
         # TODO: Pop the render view for the Depth image
 
-        # Send Request to queue
+        # Send Request to queue from the worker thread, once the job scheduler
+        # gives it a slot on the backend and the uploads are done
         p = {"prompt": prompt_request}
-        data = json.dumps(p).encode("utf-8")
-        req = request.Request(f"{url}/prompt", data=data)
-        request.urlopen(req)
-
-        print("Request Sent!")
+        priority = PRIORITY_BATCH if self.priority == "batch" else PRIORITY_INTERACTIVE
+        key = latency_key(
+            url,
+            diffusion_props.models_available,
+            diffusion_props.n_steps,
+            diffusion_props.width,
+            diffusion_props.height,
+            len(items),
+        )
+        enqueue_job(
+            self.uuid,
+            url,
+            p,
+            backend_props.fetch_mode == "websocket",
+            worker.pop_uploads(self.uuid),
+            priority,
+            key,
+            backend_props.use_result_cache,
+        )
+
+        self.report({"INFO"}, "Request has been queued for submission")
 
         return {"FINISHED"}
 
@@ -297,13 +276,6 @@ class ProjectionOperator(bpy.types.Operator):
 
     uuid: bpy.props.StringProperty(name="UUID")
 
-    def get_history_item(self, context: bpy.types.Context) -> Optional[dict]:
-        history_props = context.scene.history_properties
-        for item in history_props.history_collection:
-            if item.uuid == self.uuid:
-                return item
-        return None
-
     def get_camera_object(
         self, context: bpy.types.Context, id: int
     ) -> Optional[bpy.types.Object]:
@@ -321,7 +293,7 @@ class ProjectionOperator(bpy.types.Operator):
         scene = context.scene
         diffusion_props = scene.diffusion_properties
 
-        history_item = self.get_history_item(context)
+        history_item = find_history_item(self.uuid)
         if history_item is None:
             self.report({"ERROR"}, "History item not found")
             return {"CANCELLED"}
@@ -503,9 +475,15 @@ class SetupCameraOperator(bpy.types.Operator):
         camera_object = bpy.data.objects.new(f"Camera {ID}", camera_data)
         diffusion_history_collection.objects.link(camera_object)
 
+        # Inpainting samples from the encoded render, a single latent image
+        batch_count = diffusion_props.batch_count
+        if diffusion_props.toggle_inpainting and batch_count > 1:
+            self.report({"WARNING"}, "Batches are not available with inpainting")
+            batch_count = 1
+
         generation_uuid = str(uuid.uuid4())
-        # Assign diffusion parameters to history item
-        bpy.ops.diffusion.update_history(uuid=generation_uuid)
+        # Assign diffusion parameters to history item (and its batch variants)
+        bpy.ops.diffusion.update_history(uuid=generation_uuid, batch_count=batch_count)
 
         scene.camera = camera_object
         assert camera_object is not None
@@ -531,14 +509,12 @@ class SetupCameraOperator(bpy.types.Operator):
             bpy.ops.diffusion.render_mask(uuid=generation_uuid)
 
         if diffusion_props.toggle_ipadapter:
-            bpy.ops.diffusion.render_ipadapter_image()
+            bpy.ops.diffusion.render_ipadapter_image(uuid=generation_uuid)
 
         # CALL REQUEST OPERATOR
+        # The result watchdog is launched once the request has been submitted
         bpy.ops.diffusion.send_request(uuid=generation_uuid)
 
-        # Launch a watchdog to get the result
-        bpy.ops.diffusion.fetch_history(uuid=generation_uuid)
-
         return {"FINISHED"}
 
 
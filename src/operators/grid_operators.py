@@ -0,0 +1,335 @@
+import math
+import uuid
+from typing import List, Optional, Set
+
+import bpy
+import numpy as np
+from mathutils import Vector
+from PIL import Image
+
+from ..functions.grid import blend_factors, make_grid, view_weights
+from ..functions.utils import queue_image_upload, set_image_pixels
+from .history_collection_operators import (
+    find_history_item,
+    find_history_item_by_id,
+    grid_items,
+    index_regrouped_item,
+)
+from .image_render_operators import (
+    debug_save_path,
+    generation_url,
+    render_depth_map,
+)
+
+# pyright: reportAttributeAccessIssue=false
+
+# Side of the generated grid, the resolution of the workflow latent image
+GRID_SIZE = 1024
+
+# Margin around the bounding sphere of the meshes in the camera frames
+FRAMING_MARGIN = 1.1
+
+
+def camera_history_collection(scene: bpy.types.Scene) -> bpy.types.Collection:
+    """The "Diffusion Camera History" collection, created if needed"""
+    collection_name = scene.backend_properties.history_collection_name
+    for collection in scene.collection.children:
+        if collection.name == collection_name:
+            return collection
+    collection = bpy.data.collections.new(collection_name)
+    scene.collection.children.link(collection)
+    return collection
+
+
+def bounding_sphere(objects: List[bpy.types.Object]):
+    """(center, radius) in world space of the bounding boxes of the objects"""
+    corners = [
+        obj.matrix_world @ Vector(corner) for obj in objects for corner in obj.bound_box
+    ]
+    center = sum(corners, Vector()) / len(corners)
+    radius = max((corner - center).length for corner in corners)
+    return center, radius
+
+
+def orbit_locations(center, distance: float, count: int, elevation: float):
+    """`count` points evenly spaced on a circle around `center`, `elevation`
+    radians above the horizontal plane"""
+    locations = []
+    for index in range(count):
+        azimuth = 2 * math.pi * index / count
+        offset = Vector(
+            (
+                math.cos(elevation) * math.cos(azimuth),
+                math.cos(elevation) * math.sin(azimuth),
+                math.sin(elevation),
+            )
+        )
+        locations.append(center + offset * distance)
+    return locations
+
+
+def world_geometry(obj: bpy.types.Object):
+    """(vertices, 3) world positions and unit normals of the vertices of a mesh"""
+    data = obj.data
+    count = len(data.vertices)
+    positions = np.empty(count * 3, dtype=np.float64)
+    normals = np.empty(count * 3, dtype=np.float64)
+    data.vertices.foreach_get("co", positions)
+    data.vertices.foreach_get("normal", normals)
+
+    matrix = np.array(obj.matrix_world)
+    positions = positions.reshape(-1, 3) @ matrix[:3, :3].T + matrix[:3, 3]
+    # Normals transform with the inverse transpose (non uniform scale)
+    normals = normals.reshape(-1, 3) @ np.linalg.inv(matrix[:3, :3])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    normals = np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+    return positions, normals
+
+
+def set_blend_attribute(data: bpy.types.Mesh, name: str, factors: np.ndarray):
+    """Store per vertex factors as a grey color attribute, read by the shader"""
+    attribute = data.color_attributes.get(name)
+    if attribute is None:
+        attribute = data.color_attributes.new(
+            name=name, type="FLOAT_COLOR", domain="POINT"
+        )
+    colors = np.ones((len(factors), 4), dtype=np.float32)
+    colors[:, :3] = factors[:, None]
+    attribute.data.foreach_set("color", colors.ravel())
+
+
+class GridGenerationOperator(bpy.types.Operator):
+    """Texture the mesh from several cameras around it in a single diffusion pass.
+
+    The depth maps of every camera are tiled in one grid image, generated with a
+    single prompt, and the result is cut back into tiles each projected from its
+    own camera (one history item per view)
+    """
+
+    bl_idname = "diffusion.generate_grid"
+    bl_label = "Generate Grid"
+    bl_description = "Generate the texture of several views around the mesh in a single diffusion pass"
+
+    @classmethod
+    def poll(cls, context: Optional[bpy.types.Context]):
+        assert context is not None
+        # Inpainting works on a single view
+        return (
+            context.mode != "EDIT_MESH"
+            and not context.scene.diffusion_properties.toggle_inpainting
+        )
+
+    def execute(self, context: Optional[bpy.types.Context]) -> Set[str]:
+        assert context is not None
+
+        scene = context.scene
+        diffusion_props = scene.diffusion_properties
+        history_props = scene.history_properties
+
+        if not diffusion_props.mesh_objects:
+            self.report({"WARNING"}, "No objects selected in the Mesh Collection")
+            return {"CANCELLED"}
+
+        meshes = []
+        for mesh_item in diffusion_props.mesh_objects:
+            mesh = bpy.data.objects.get(mesh_item.name)
+            if mesh is None:
+                self.report(
+                    {"ERROR"},
+                    f"Object {mesh_item.name} does not exist in the scene anymore",
+                )
+                return {"CANCELLED"}
+            meshes.append(mesh)
+
+        # Only render the meshes of the mesh collection
+        for obj in scene.objects:
+            obj.hide_render = obj not in meshes
+
+        # Frame the bounding sphere of the meshes from every camera
+        camera_data = bpy.data.cameras.new(name="Camera")
+        half_angle = min(camera_data.angle_x, camera_data.angle_y) / 2
+        center, radius = bounding_sphere(meshes)
+        distance = radius * FRAMING_MARGIN / math.sin(half_angle)
+        clip_end = max(camera_data.clip_end, distance + 2 * radius)
+
+        count = diffusion_props.grid_views
+        locations = orbit_locations(
+            center, distance, count, math.radians(diffusion_props.grid_elevation)
+        )
+
+        collection = camera_history_collection(scene)
+        grid_uuid = ""
+        grid_id = 0
+        depth_maps = []
+
+        for index, location in enumerate(locations):
+            # One history item and camera per view, as a regular generation
+            history_props.history_counter += 1
+            ID = history_props.history_counter
+
+            if index > 0:
+                camera_data = bpy.data.cameras.new(name="Camera")
+            camera_data.clip_end = clip_end
+            camera_object = bpy.data.objects.new(f"Camera {ID}", camera_data)
+            collection.objects.link(camera_object)
+
+            camera_object.location = location
+            direction = center - location
+            camera_object.rotation_euler = direction.to_track_quat("-Z", "Y").to_euler()
+
+            view_uuid = str(uuid.uuid4())
+            bpy.ops.diffusion.update_history(uuid=view_uuid)
+
+            history_item = find_history_item(view_uuid)
+            assert history_item is not None
+            if index == 0:
+                # The first view holds the prompt of the whole grid
+                grid_uuid = view_uuid
+                grid_id = ID
+            history_item.grid_id = grid_id
+            history_item.grid_index = index
+            index_regrouped_item(history_props, view_uuid)
+
+            # Matrices are used by the projection and the render
+            context.view_layer.update()
+            scene.camera = camera_object
+
+            bpy.ops.diffusion.projection_from_view(uuid=view_uuid)
+
+            try:
+                depth_maps.append(render_depth_map(scene))
+            except RuntimeError as e:
+                self.report({"ERROR"}, f"View {index + 1}: {e}")
+                return {"CANCELLED"}
+
+        depth_grid = make_grid(depth_maps, GRID_SIZE)
+        set_image_pixels(f"depth_{grid_id}.png", depth_grid)
+
+        # Upload from the worker thread, the prompt submission waits for it
+        queue_image_upload(
+            scene=scene,
+            image=Image.fromarray(depth_grid),
+            image_name=f"{grid_uuid}_depth.png",
+            uuid=grid_uuid,
+            url=generation_url(scene, grid_uuid),
+            kind="depth",
+            save_path=debug_save_path(scene, f"depth_{grid_id}.png"),
+        )
+
+        if diffusion_props.toggle_ipadapter:
+            bpy.ops.diffusion.render_ipadapter_image(uuid=grid_uuid)
+
+        # The result is cut into tiles and applied once fetched
+        bpy.ops.diffusion.send_request(uuid=grid_uuid)
+
+        self.report({"INFO"}, f"Grid of {count} views has been queued")
+        return {"FINISHED"}
+
+
+class ApplyGridTextureOperator(bpy.types.Operator):
+    """Texture the mesh with every view of a multi-view grid in a single material.
+
+    Applying the views one by one would give each its own material, and only the
+    last one would show. Here each vertex averages the views by how much it
+    faces their camera (weights stored in the `blend {id}` color attributes), so
+    every side of the mesh gets the view looking at it. Occluded parts take the
+    view of the occluding surface, a single view can still be applied with
+    `diffusion.apply_texture`
+    """
+
+    bl_idname = "diffusion.apply_grid_texture"
+    bl_label = "Apply Grid Texture"
+    bl_description = "Create a material blending the textures of every view of a multi-view grid, weighted by how much the mesh faces each camera"
+
+    id: bpy.props.IntProperty(name="ID")
+
+    def execute(self, context: Optional[bpy.types.Context]) -> Set[str]:
+        assert context is not None
+
+        history_item = find_history_item_by_id(self.id)
+        if history_item is None:
+            self.report({"ERROR"}, "No mesh found with the given ID")
+            return {"CANCELLED"}
+
+        views = grid_items(history_item)
+        if not views:
+            self.report({"ERROR"}, f"Generation {self.id} is not a multi-view grid")
+            return {"CANCELLED"}
+
+        mesh = bpy.data.objects.get(history_item.mesh)
+        if mesh is None:
+            self.report({"ERROR"}, f"Object {history_item.mesh} does not exist")
+            return {"CANCELLED"}
+
+        collection = camera_history_collection(context.scene)
+        cameras = [collection.objects.get(f"Camera {view.id}") for view in views]
+        if any(camera is None for camera in cameras):
+            self.report({"ERROR"}, "A camera of the grid has been removed")
+            return {"CANCELLED"}
+
+        # Vertices edited since the projection are read from the edit mesh
+        mesh.update_from_editmode()
+        positions, normals = world_geometry(mesh)
+        camera_locations = np.array(
+            [camera.matrix_world.translation for camera in cameras]
+        )
+        factors = blend_factors(view_weights(positions, normals, camera_locations))
+
+        material = bpy.data.materials.new(name=f"Material {self.id}")
+        material.use_nodes = True
+        mesh.data.materials.append(material)
+
+        tree = material.node_tree
+        assert tree is not None
+        nodes = tree.nodes
+        links = tree.links
+
+        # Chain of mixes : each view over the views before it
+        result = None
+        for index, view in enumerate(views):
+            row = 100 - 300 * index
+
+            uv_node = nodes.new("ShaderNodeUVMap")
+            image_node = nodes.new("ShaderNodeTexImage")
+            uv_node.location = (-1200, row)
+            image_node.location = (-1000, row)
+
+            uv_node.uv_map = f"Texture {view.id}"
+            image_node.image = bpy.data.images[f"Generation_{view.id}.png"]
+            links.new(uv_node.outputs[0], image_node.inputs[0])
+
+            if result is None:
+                result = image_node.outputs[0]
+                continue
+
+            name = f"blend {view.id}"
+            set_blend_attribute(mesh.data, name, factors[index])
+
+            color_attribute = nodes.new("ShaderNodeVertexColor")
+            color_mix = nodes.new("ShaderNodeMix")
+            color_attribute.location = (-700, row)
+            color_mix.location = (-400, row)
+
+            color_mix.data_type = "RGBA"
+            color_attribute.layer_name = name
+
+            links.new(color_attribute.outputs[0], color_mix.inputs[0])
+            links.new(result, color_mix.inputs["A"])
+            links.new(image_node.outputs[0], color_mix.inputs["B"])
+            result = color_mix.outputs["Result"]
+
+        links.new(result, nodes["Principled BSDF"].inputs[0])
+
+        mesh.active_material = material
+
+        return {"FINISHED"}
+
+
+def grid_register():
+    bpy.utils.register_class(GridGenerationOperator)
+    bpy.utils.register_class(ApplyGridTextureOperator)
+
+
+def grid_unregister():
+    bpy.utils.unregister_class(GridGenerationOperator)
+    bpy.utils.unregister_class(ApplyGridTextureOperator)
@@ -1,81 +1,506 @@
 import functools
-from io import BytesIO
-from typing import Optional
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
 
 import bpy
-import requests
+from bpy.app.handlers import persistent
 from PIL import Image
 
+from ..functions import worker
+from ..functions.backend_client import get_client, history_outputs
+from ..functions.backend_pool import get_backend_pool, parse_urls
+from ..functions.grid import split_grid
+from ..functions.history_index import get_history_index
+from ..functions.jobs import APPLIED, FAILED, FETCHING, QUEUED, RUNNING, get_job_queue
+from ..functions.latency import get_latency_model, next_poll_time
+from ..functions.result_cache import get_result_cache
+from ..functions.websocket_client import get_listener
+
 # pyright: reportAttributeAccessIssue=false
 
+# Seconds between two checks of the websocket listener results
+NOTIFICATION_INTERVAL = 0.1
+
+# Seconds between two progress updates of a generation waiting for its next poll
+PROGRESS_INTERVAL = 1.0
+
+# Properties a batch variant copies from the first item of the batch
+VARIANT_SHARED_PROPERTIES = (
+    "prompt",
+    "seed",
+    "cfg_scale",
+    "n_steps",
+    "scheduler",
+    "negative_prompt",
+    "url",
+    "mesh",
+    "camera_id",
+)
+
+
+def find_history_item(uuid: str):
+    """Return the history item of a generation, None if it has been removed.
+    Asynchronous callbacks must look the item up again instead of keeping a
+    reference, as the collection can be reallocated in the meantime
+    """
+    assert bpy.context is not None
+    history_props = bpy.context.scene.history_properties
+    return get_history_index().find(
+        history_props.as_pointer(), history_props.history_collection, uuid
+    )
+
+
+def find_history_item_by_id(id: int):
+    """Return the history item of a history id, None if it has been removed"""
+    assert bpy.context is not None
+    history_props = bpy.context.scene.history_properties
+    return get_history_index().find_by_id(
+        history_props.as_pointer(), history_props.history_collection, id
+    )
+
+
+def find_group(attribute: str, key: int) -> Optional[list]:
+    """History items whose `camera_id` or `grid_id` is `key`, None if there is none"""
+    assert bpy.context is not None
+    history_props = bpy.context.scene.history_properties
+    return get_history_index().group(
+        history_props.as_pointer(), history_props.history_collection, attribute, key
+    )
+
+
+def index_added_item(history_props):
+    """Keep the history index in sync after `history_collection.add()`"""
+    collection = history_props.history_collection
+    get_history_index().added(
+        history_props.as_pointer(), collection, len(collection) - 1
+    )
+
+
+def index_regrouped_item(history_props, uuid: str):
+    """Keep the history index in sync after the `camera_id` or `grid_id` of the
+    item of `uuid` is set"""
+    get_history_index().regrouped(
+        history_props.as_pointer(), history_props.history_collection, uuid
+    )
+
+
+@persistent
+def invalidate_history_index(*args):
+    """The history collection is another one after a file load or an undo"""
+    get_history_index().invalidate()
+
+
+INDEX_HANDLERS = ("load_post", "undo_post", "redo_post")
+
+REMOVED_ERROR = "History item removed"
+
+
+def fail_removed_generation(uuid: str):
+    """The history item of a generation is gone : its result has nowhere to
+    go, fail the job so it stops holding a slot of its backend"""
+    if get_job_queue().fail_unfinished(uuid, REMOVED_ERROR):
+        print(f"Generation {uuid} was removed, its job is failed")
+
 
-def fetch_image(history_item):
+def submission_time(uuid: str) -> float:
+    """Time (`time.time`) the prompt of a generation entered the backend queue.
+    Generations unknown to the job queue count from their first fetch
+    """
+    job = get_job_queue().get(uuid)
+    if job is not None and job.submitted_at:
+        return job.submitted_at
+    return _fetch_started.setdefault(uuid, time.time())
 
-    base_url = history_item.url
-    uuid = history_item.uuid
-    file_name = f"{uuid}_output_00001_.png"
 
-    view_image_url = f"{base_url}/view?filename={file_name}&type=output"
+# First fetch of the generations unknown to the job queue
+_fetch_started: Dict[str, float] = {}
 
-    if history_item.fetching_attempts < 1:
-        print(view_image_url)
 
+def expected_duration(history_item) -> float:
+    """Expected seconds from the submission to the result of a generation"""
+    if history_item.expected_duration > 0:
+        return history_item.expected_duration
     assert bpy.context is not None
-    backend_props = bpy.context.scene.backend_properties
-    N_MAX = backend_props.timeout_retry
+    return bpy.context.scene.backend_properties.expected_completion
 
-    try:
+
+def generation_save_path(history_item) -> str:
+    file_path = bpy.data.scenes["Scene"].render.filepath
+    return f"{file_path}Generation_{history_item.id}.png"
+
+
+def select_backend_url(scene: bpy.types.Scene, model: str) -> str:
+    """Backend of a new generation : the backend url, or with the backend pool,
+    the least busy healthy server holding `model`"""
+
+    backend_props = scene.backend_properties
+    if not backend_props.use_backend_pool:
+        return backend_props.url
+
+    pool = get_backend_pool()
+    pool.set_urls(parse_urls(backend_props.url, backend_props.pool_urls))
+    url = pool.choose(model, get_job_queue().unsubmitted_counts())
+    if url is None:
+        print(
+            f"No healthy backend of the pool holds {model}, using {backend_props.url}"
+        )
+        return backend_props.url
+    return url
+
+
+def batch_items(history_item) -> list:
+    """History items of every image of the generation of `history_item`, in
+    batch order. The variants of a batch share the camera, UVs and depth map of
+    the first item, whose id they hold in `camera_id`
+    """
+    items = find_group("camera_id", history_item.id)
+    if not items:
+        # Items created before batches were introduced
+        return [history_item]
+    return sorted(items, key=lambda item: item.batch_index)
+
+
+def grid_items(history_item) -> list:
+    """History items of the views of the multi-view grid generated by
+    `history_item`, in tile order. Empty when it did not generate a grid
+    """
+    if history_item.grid_id != history_item.id:
+        return []
+
+    items = find_group("grid_id", history_item.id) or []
+    return sorted(items, key=lambda item: item.grid_index)
+
+
+def split_grid_output(history_item, views: list):
+    """Cut the generated grid into one texture per view"""
+    save_path = generation_save_path(history_item)
+    with Image.open(save_path) as grid:
+        tiles = split_grid(grid.convert("RGB"), len(views))
+    for item, tile in zip(views, tiles):
+        tile.save(generation_save_path(item))
+
+
+def output_file_name(uuid: str, batch_index: int) -> str:
+    """Name of a batch image saved by the SaveImage node"""
+    return f"{uuid}_output_{batch_index + 1:05d}_.png"
+
+
+def download_output(base_url: str, params: dict, save_path: str) -> int:
+    """Worker job : fetch an output image and write it to disk.
+    The PNG is written as received, it is only decoded by blender when loaded.
+    Returns the status code of the `/view` request
+    """
+
+    response = get_client().view(base_url, params)
+    if response.status_code == 200:
+        print(f"Saving image to {save_path}")
+        with open(save_path, "wb") as f:
+            f.write(response.content)
+
+    return response.status_code
+
+
+def download_outputs(
+    base_url: str, downloads: List[Tuple[dict, str]], result_key: str = ""
+) -> int:
+    """Worker job : fetch every image of a batch, as (params, save path) pairs.
+    Stops at the first missing image, returns its status code (200 when all
+    images were saved). With a `result_key`, the images are also stored in the
+    result cache
+    """
+
+    for params, save_path in downloads:
+        status_code = download_output(base_url, params, save_path)
+        if status_code != 200:
+            return status_code
+
+    if result_key:
+        get_result_cache().store(result_key, [path for _, path in downloads])
+    return 200
+
+
+def load_fetched_images(history_item):
+    """Load the saved images of a generation in blender and apply them as textures"""
+
+    print("Image fetched successfully")
+    job_queue = get_job_queue()
+    job_queue.set_state(history_item.uuid, FETCHING)
+
+    # Learn the completion time of these settings
+    job = job_queue.get(history_item.uuid)
+    if job is not None and job.latency_key and job.submitted_at:
+        get_latency_model().observe(job.latency_key, time.time() - job.submitted_at)
+
+    views = grid_items(history_item)
+    if views:
+        split_grid_output(history_item, views)
+        for item in views:
+            item.received = True
+            bpy.data.images.load(generation_save_path(item), check_existing=True)
+
+        # A single material blending the views, one material per view would
+        # only show the last one applied
+        print(f"Applying the Grid Texture {history_item.id}")
+        bpy.ops.diffusion.apply_grid_texture(id=history_item.id)
+    else:
+        # The first image is applied last, to be the active one
+        for item in reversed(batch_items(history_item)):
+            item.received = True
+            bpy.data.images.load(generation_save_path(item), check_existing=True)
+
+            print(f"Applying the Texture {item.id}")
+            bpy.ops.diffusion.apply_texture(id=item.id)
+
+    job_queue.set_state(history_item.uuid, APPLIED)
+
+
+def stored_result_key(uuid: str) -> str:
+    """Key the outputs of a generation are stored under, empty when the result
+    cache was disabled"""
+    job = get_job_queue().get(uuid)
+    return job.result_key if job is not None else ""
+
+
+def output_downloads(items: list, images: List[dict]) -> List[Tuple[dict, str]]:
+    """(params, save path) of the outputs listed by the backend, images are
+    listed in batch order"""
+    downloads = []
+    for item, output in zip(items, images):
         params = {
-            "filename": file_name,
+            "filename": output["filename"],
+            "subfolder": output.get("subfolder", ""),
+            "type": output.get("type", "output"),
+        }
+        downloads.append((params, generation_save_path(item)))
+    return downloads
+
+
+def fetch_image(uuid: str, poll_at: float = 0.0):
+    """Polling timer : look the prompt up in the backend history from the worker
+    thread, once `poll_at` seconds have passed since the submission. Until then
+    it only updates the progress of the generation (no network)
+    """
+
+    history_item = find_history_item(uuid)
+    if history_item is None:
+        fail_removed_generation(uuid)
+        return
+
+    elapsed = time.time() - submission_time(uuid)
+    history_item.fetching_attempts = int(elapsed)
+    if elapsed < poll_at:
+        return min(PROGRESS_INTERVAL, poll_at - elapsed)
+
+    if not history_item.prompt_id:
+        fetch_guessed_outputs(history_item)
+        return
+
+    worker.submit(
+        get_client().history,
+        history_item.url,
+        history_item.prompt_id,
+        callback=functools.partial(on_history_polled, uuid),
+    )
+
+
+def fetch_guessed_outputs(history_item):
+    """Poll the output files by name, for generations submitted without a
+    recorded prompt id"""
+
+    downloads = []
+    for item in batch_items(history_item):
+        params = {
+            "filename": output_file_name(history_item.uuid, item.batch_index),
             "subfolder": "blender-texture",
             "type": "output",
         }
-        url = f"{base_url}/view"
-        response = requests.get(url, params=params)
+        downloads.append((params, generation_save_path(item)))
 
-        # Check if the response is successful
-        if response.status_code == 200:
-            # Load the image from the response content
-            print("Image fetched successfully")
-            history_item.received = True
+    worker.submit(
+        download_outputs,
+        history_item.url,
+        downloads,
+        callback=functools.partial(on_image_polled, history_item.uuid),
+    )
 
-            backend_props.expected_completion = history_item.fetching_attempts
 
-            image = Image.open(BytesIO(response.content))
+def on_history_polled(uuid: str, future: Future):
+    """Main thread callback of a `/history` lookup : download the exact output
+    files once the prompt has finished, poll again otherwise"""
 
-            file_path = bpy.data.scenes["Scene"].render.filepath
-            save_path = f"{file_path}Generation_{history_item.id}.png"
+    history_item = find_history_item(uuid)
+    if history_item is None:
+        fail_removed_generation(uuid)
+        return
 
-            print(f"Saving image to {save_path}")
-            image.save(save_path)
-            bpy.data.images.load(save_path, check_existing=True)
+    error = future.exception()
+    if error is not None:
+        print(f"Failed to query the history of the backend. Error: {error}")
+    entry = None if error is not None else future.result()
+    if entry is None:
+        retry_fetch(history_item)
+        return
 
-            print(f"Applying the Texture {history_item.id}")
-            bpy.ops.diffusion.apply_texture(id=history_item.id)
+    try:
+        images = history_outputs(entry)
+    except RuntimeError as e:
+        print(f"Generation {history_item.id} failed on the backend: {e}")
+        get_job_queue().set_state(uuid, FAILED, str(e))
+        return
+
+    items = batch_items(history_item)
+    if len(images) < len(items):
+        message = f"Expected {len(items)} images, the backend saved {len(images)}"
+        print(message)
+        get_job_queue().set_state(uuid, FAILED, message)
+        return
+
+    worker.submit(
+        download_outputs,
+        history_item.url,
+        output_downloads(items, images),
+        stored_result_key(uuid),
+        callback=functools.partial(on_image_polled, uuid),
+    )
+
+
+def on_image_polled(uuid: str, future: Future):
+    """Main thread callback of a polling download : apply the images or poll again"""
+
+    history_item = find_history_item(uuid)
+    if history_item is None:
+        fail_removed_generation(uuid)
+        return
+
+    error = future.exception()
+    if error is None and future.result() == 200:
+        load_fetched_images(history_item)
+        return
+
+    if error is not None:
+        print(f"Failed to retrieve image. Error: {error}")
+    else:
+        print(
+            f"Failed to retrieve image. Status code: {future.result()}. Elapsed : {history_item.fetching_attempts} s"
+        )
+    retry_fetch(history_item)
 
-            return
 
-        else:
-            print(
-                f"Failed to retrieve image. Status code: {response.status_code}. Attempt : {history_item.fetching_attempts}"
-            )
-            history_item.fetching_attempts += 1
+def retry_fetch(history_item):
+    """Poll again, until the timeout of the backend settings"""
+
+    assert bpy.context is not None
+    timeout = bpy.context.scene.backend_properties.timeout_retry
+
+    if time.time() - submission_time(history_item.uuid) >= timeout:
+        print(f"Failed to retrieve image after {timeout} seconds")
+        get_job_queue().set_state(history_item.uuid, FAILED, "Timeout")
+        return
+
+    schedule_poll(history_item)
+
+
+def schedule_poll(history_item):
+    """Register the polling timer of the next `/history` lookup : quiet until
+    close to the expected completion, dense around it, backing off past it.
+    The last poll happens at the timeout
+    """
+
+    assert bpy.context is not None
+    timeout = bpy.context.scene.backend_properties.timeout_retry
+
+    elapsed = time.time() - submission_time(history_item.uuid)
+    poll_at = min(next_poll_time(elapsed, expected_duration(history_item)), timeout)
+    bpy.app.timers.register(
+        functools.partial(fetch_image, history_item.uuid, poll_at),
+        first_interval=max(0.0, min(PROGRESS_INTERVAL, poll_at - elapsed)),
+    )
+
+
+def fallback_to_polling(uuid: str):
+    print(f"Falling back to polling for generation {uuid}")
+    history_item = find_history_item(uuid)
+    if history_item is not None:
+        schedule_poll(history_item)
+
+
+def on_image_notified(uuid: str, future: Future):
+    """Main thread callback of the download following a completion event"""
+
+    history_item = find_history_item(uuid)
+    if history_item is None:
+        fail_removed_generation(uuid)
+        return
 
-            if history_item.fetching_attempts > N_MAX:
-                print(f"Failed to retrieve image after {N_MAX} attempts")
-                return
-            return 1.0
+    error = future.exception()
+    if error is None and future.result() == 200:
+        load_fetched_images(history_item)
+        return
 
-    except OSError as e:
+    if error is not None:
+        print(f"Failed to retrieve image. Error: {error}")
+    else:
+        print(f"Failed to retrieve image. Status code: {future.result()}")
+    fallback_to_polling(uuid)
 
-        print(f"Failed to retrieve image. Error: {e}")
-        history_item.fetching_attempts += 1
 
-        if history_item.fetching_attempts > N_MAX:
-            print(f"Failed to retrieve image after {N_MAX} attempts")
+def wait_for_notification(uuid: str, listener):
+    """Timer callback used in websocket mode.
+    Only checks the listener results (no network) until the `executed` event
+    of the prompt arrives, then downloads the exact output files once.
+    Falls back to polling if the event stream is lost.
+    """
+
+    history_item = find_history_item(uuid)
+    if history_item is None:
+        fail_removed_generation(uuid)
+        return
+
+    assert bpy.context is not None
+    backend_props = bpy.context.scene.backend_properties
+    prompt_id = history_item.prompt_id
+
+    error = listener.pop_error(prompt_id)
+    if error is not None:
+        print(f"Generation {history_item.id} failed on the backend: {error}")
+        get_job_queue().set_state(uuid, FAILED, error)
+        return
+
+    images = listener.pop_result(prompt_id)
+    if images is None:
+        elapsed = time.time() - submission_time(uuid)
+        # Keep the progress ring of the history panel moving
+        history_item.fetching_attempts = int(elapsed)
+
+        job = get_job_queue().get(uuid)
+        if job is not None and job.state == QUEUED and listener.has_started(prompt_id):
+            get_job_queue().set_state(uuid, RUNNING)
+
+        if not listener.connected or listener.client_id != history_item.client_id:
+            fallback_to_polling(uuid)
+            return
+
+        if elapsed > backend_props.timeout_retry:
+            print(f"No completion event after {backend_props.timeout_retry} seconds")
+            fallback_to_polling(uuid)
             return
 
-        return 1.0
+        return NOTIFICATION_INTERVAL
+
+    items = batch_items(history_item)
+    if len(images) < len(items):
+        print(f"Expected {len(items)} images, the backend sent {len(images)}")
+        fallback_to_polling(uuid)
+        return
+
+    worker.submit(
+        download_outputs,
+        history_item.url,
+        output_downloads(items, images),
+        stored_result_key(uuid),
+        callback=functools.partial(on_image_notified, uuid),
+    )
 
 
 class UpdateHistoryItem(bpy.types.Operator):
@@ -83,13 +508,13 @@ class UpdateHistoryItem(bpy.types.Operator):
     bl_label = "Update History Item"
 
     uuid: bpy.props.StringProperty(name="UUID")
+    batch_count: bpy.props.IntProperty(name="Batch Count", default=1, min=1)
 
     def execute(self, context):
         assert context is not None
         scene = context.scene
         history_props = scene.history_properties
         diffusion_props = scene.diffusion_properties
-        backend_props = scene.backend_properties
 
         # Update the history item at the given index
         history_item = history_props.history_collection.add()
@@ -103,9 +528,22 @@ class UpdateHistoryItem(bpy.types.Operator):
         history_item.width = diffusion_props.width
         history_item.width = diffusion_props.height
         history_item.uuid = self.uuid
-        history_item.url = backend_props.url
+        history_item.url = select_backend_url(scene, diffusion_props.models_available)
         history_item.fetching_attemps = 0
         history_item.mesh = diffusion_props.mesh_objects[0].name
+        history_item.camera_id = history_item.id
+        index_added_item(history_props)
+
+        # One item per variant of the batch, sharing the camera of the first one
+        for batch_index in range(1, self.batch_count):
+            history_props.history_counter += 1
+            variant = history_props.history_collection.add()
+            for name in VARIANT_SHARED_PROPERTIES:
+                setattr(variant, name, getattr(history_item, name))
+            variant.id = history_props.history_counter
+            variant.uuid = f"{self.uuid}_{batch_index}"
+            variant.batch_index = batch_index
+            index_added_item(history_props)
 
         # TODO:
         # - add inpainting parameters
@@ -121,29 +559,29 @@ class FetchHistoryItem(bpy.types.Operator):
     bl_label = "Fetch History Item"
     uuid: bpy.props.StringProperty(name="UUID")
 
-    def get_history_item(self, context: bpy.types.Context) -> Optional[dict]:
-        history_props = context.scene.history_properties
-        for item in history_props.history_collection:
-            if item.uuid == self.uuid:
-                return item
-        return None
-
     def execute(self, context: Optional[bpy.types.Context]) -> set[str]:
         assert context is not None
         assert bpy.context is not None
 
         scene = context.scene
-        history_props = scene.history_properties
 
-        history_item = self.get_history_item(context)
+        history_item = find_history_item(self.uuid)
         if history_item is None:
+            fail_removed_generation(self.uuid)
             self.report({"ERROR"}, "History item not found")
             return {"CANCELLED"}
 
-        # Add a register on a 1Hz frequency to fetch image result using the id / uuid
-        bpy.app.timers.register(
-            functools.partial(fetch_image, history_item), first_interval=1.0
-        )
+        backend_props = scene.backend_properties
+        if backend_props.fetch_mode == "websocket" and history_item.client_id:
+            listener = get_listener(history_item.url)
+            bpy.app.timers.register(
+                functools.partial(wait_for_notification, self.uuid, listener),
+                first_interval=NOTIFICATION_INTERVAL,
+            )
+            return {"FINISHED"}
+
+        # Poll the backend history around the expected completion
+        schedule_poll(history_item)
 
         return {"FINISHED"}
 
@@ -171,7 +609,11 @@ class RemoveHistoryItem(bpy.types.Operator):
         history_props = scene.history_properties
 
         # Remove the history item at the given index
+        if self.index < len(history_props.history_collection):
+            uuid = history_props.history_collection[self.index].uuid
+            fail_removed_generation(uuid)
         history_props.history_collection.remove(self.index)
+        get_history_index().removed(self.index)
 
         # Loop through the cameras in the diffusion history collection
         # remove the camera with the right id
@@ -195,20 +637,23 @@ class AssignHistoryItem(bpy.types.Operator):
         assert context is not None
 
         scene = context.scene
-        history_props = scene.history_properties
         diffusion_props = scene.diffusion_properties
 
-        # Loop through the history collection and find the item with the right id
-        for history_item in history_props.history_collection:
-            if history_item.id == self.id:
-                # Update all props
-                diffusion_props.prompt = history_item.prompt
-                diffusion_props.seed = history_item.seed
-                diffusion_props.cfg_scale = history_item.cfg_scale
-                diffusion_props.n_steps = history_item.n_steps
-                diffusion_props.scheduler = history_item.scheduler
-                diffusion_props.negative_prompt = history_item.negative_prompt
-                break
+        history_item = find_history_item_by_id(self.id)
+        if history_item is not None:
+            # Update all props
+            diffusion_props.prompt = history_item.prompt
+            diffusion_props.seed = history_item.seed
+            diffusion_props.cfg_scale = history_item.cfg_scale
+            diffusion_props.n_steps = history_item.n_steps
+            diffusion_props.scheduler = history_item.scheduler
+            diffusion_props.negative_prompt = history_item.negative_prompt
+
+            # Show the texture of this generation (e.g. a variant of a batch)
+            material = bpy.data.materials.get(f"Material {history_item.id}")
+            mesh = bpy.data.objects.get(history_item.mesh)
+            if material is not None and mesh is not None:
+                mesh.active_material = material
 
         return {"FINISHED"}
 
@@ -219,9 +664,18 @@ def history_collection_register():
     bpy.utils.register_class(AssignHistoryItem)
     bpy.utils.register_class(FetchHistoryItem)
 
+    for name in INDEX_HANDLERS:
+        getattr(bpy.app.handlers, name).append(invalidate_history_index)
+
 
 def history_collection_unregister():
     bpy.utils.unregister_class(UpdateHistoryItem)
     bpy.utils.unregister_class(RemoveHistoryItem)
     bpy.utils.unregister_class(AssignHistoryItem)
     bpy.utils.unregister_class(FetchHistoryItem)
+
+    for name in INDEX_HANDLERS:
+        handlers = getattr(bpy.app.handlers, name)
+        if invalidate_history_index in handlers:
+            handlers.remove(invalidate_history_index)
+    get_history_index().invalidate()
@@ -1,21 +1,192 @@
 import os
+import tempfile
 from typing import Optional, Set
 
 import bmesh
 import bpy
+import gpu
 import numpy as np
 from PIL import Image
 
 from ..functions.utils import (
-    linear_to_srgb_array,
-    normalize_array,
-    reverse_color,
-    send_image_function,
+    get_lut,
+    process_depth_map,
+    queue_image_upload,
+    read_image_pixels,
+    set_image_pixels,
 )
+from .history_collection_operators import find_history_item
 
 # pyright: reportAttributeAccessIssue=false
 
 
+def viewport_region(context: bpy.types.Context):
+    """WINDOW region of the 3D view of the context, None outside of a 3D view"""
+    area = context.area
+    space = context.space_data
+    if area is None or space is None or space.type != "VIEW_3D":
+        return None
+    return next((region for region in area.regions if region.type == "WINDOW"), None)
+
+
+def render_viewport(
+    operator: bpy.types.Operator, context: bpy.types.Context, name: str
+) -> Optional[Image.Image]:
+    """Render the 3D view from the scene camera at the render resolution, in memory.
+
+    Draws the viewport (with its current shading) into a GPU offscreen buffer and
+    reads it back. Outside of a 3D view, without a scene camera or when offscreen
+    drawing is not available, falls back to an OpenGL render written to a local
+    temporary file. Problems are reported through `operator`, None when nothing
+    could be rendered
+    """
+
+    scene = context.scene
+    render = scene.render
+    scale = render.resolution_percentage / 100
+    width = int(render.resolution_x * scale)
+    height = int(render.resolution_y * scale)
+
+    region = viewport_region(context)
+    if region is None:
+        operator.report({"WARNING"}, "Not in a 3D view, using an OpenGL render")
+        return render_opengl_to_temp_file(operator, context, name)
+
+    camera = scene.camera
+    if camera is None:
+        operator.report({"WARNING"}, "No scene camera, using an OpenGL render")
+        return render_opengl_to_temp_file(operator, context, name)
+
+    try:
+        offscreen = gpu.types.GPUOffScreen(width, height)
+    except Exception as e:
+        operator.report(
+            {"WARNING"},
+            f"Offscreen rendering not available ({e}), using an OpenGL render",
+        )
+        return render_opengl_to_temp_file(operator, context, name)
+
+    try:
+        view_matrix = camera.matrix_world.inverted()
+        projection_matrix = camera.calc_matrix_camera(
+            context.evaluated_depsgraph_get(),
+            x=width,
+            y=height,
+            scale_x=render.pixel_aspect_x,
+            scale_y=render.pixel_aspect_y,
+        )
+        offscreen.draw_view3d(
+            scene,
+            context.view_layer,
+            context.space_data,
+            region,
+            view_matrix,
+            projection_matrix,
+            do_color_management=True,
+        )
+        with offscreen.bind():
+            framebuffer = gpu.state.active_framebuffer_get()
+            buffer = framebuffer.read_color(0, 0, width, height, 4, 0, "UBYTE")
+    finally:
+        offscreen.free()
+
+    buffer.dimensions = width * height * 4
+    pixels = np.asarray(buffer, dtype=np.uint8).reshape((height, width, 4))
+
+    # Flip the rows and drop the alpha layer
+    return Image.fromarray(np.ascontiguousarray(pixels[::-1, :, :3]))
+
+
+def render_opengl_to_temp_file(
+    operator: bpy.types.Operator, context: bpy.types.Context, name: str
+) -> Optional[Image.Image]:
+    """Fallback of `render_viewport` going through a file in the local temp folder"""
+
+    previous_output_path = context.scene.render.filepath
+    save_path = os.path.join(tempfile.gettempdir(), f"tmp_render_opengl_{name}.png")
+
+    context.scene.render.filepath = save_path
+    try:
+        bpy.ops.render.opengl(write_still=True)
+    except RuntimeError as e:
+        operator.report({"ERROR"}, f"OpenGL render failed: {e}")
+        return None
+    finally:
+        context.scene.render.filepath = previous_output_path
+
+    image = Image.open(save_path).convert("RGB")
+    os.remove(save_path)
+
+    return image
+
+
+def generation_url(scene: bpy.types.Scene, uuid: str) -> str:
+    """Backend chosen for a generation : its inputs are uploaded where the
+    prompt will be submitted"""
+    history_item = find_history_item(uuid)
+    if history_item is None or not history_item.url:
+        return scene.backend_properties.url
+    return history_item.url
+
+
+def debug_save_path(scene: bpy.types.Scene, file_name: str) -> str:
+    """Path to also write an input on disk, empty unless enabled for debugging"""
+    if not scene.backend_properties.save_debug_renders:
+        return ""
+    return os.path.join(scene.render.filepath, file_name)
+
+
+def render_depth_map(scene: bpy.types.Scene) -> np.ndarray:
+    """Render the depth pass from the scene camera and process it into the 8 bit
+    depth map used for conditioning, see `process_depth_map`.
+    Raises a RuntimeError when there is no depth to use
+    """
+
+    scene.use_nodes = True
+    tree = scene.node_tree
+    assert tree is not None
+
+    scene.view_layers["ViewLayer"].use_pass_z = True
+
+    links = tree.links
+
+    # Render Nodes, created once and reused by the following renders
+    rl = tree.nodes.get("Diffusion Render Layers")
+    if rl is None:
+        rl = tree.nodes.new("CompositorNodeRLayers")
+        rl.name = "Diffusion Render Layers"
+        rl.location = 185, 285
+
+    # create output viewer node
+    v = tree.nodes.get("Diffusion Depth Viewer")
+    if v is None:
+        v = tree.nodes.new("CompositorNodeViewer")
+        v.name = "Diffusion Depth Viewer"
+        v.location = 750, 210
+        v.use_alpha = False
+
+    scene.render.resolution_x = 1024
+    scene.render.resolution_y = 1024
+
+    links.new(rl.outputs["Depth"], v.inputs[0])
+
+    # Compute Render
+    bpy.ops.render.render()
+
+    # get viewer pixels
+    viewer_image = bpy.data.images["Viewer Node"]
+
+    # Process the depthmap
+    if viewer_image.size[0] == 0 or viewer_image.size[1] == 0:
+        raise RuntimeError("The Viewer Node does not have any image data")
+
+    depth_map = process_depth_map(read_image_pixels(viewer_image))
+    if depth_map is None:
+        raise RuntimeError("No Depth detected, aborting the generation")
+
+    return depth_map
+
+
 class IPAdapterImageLoadOpeartor(bpy.types.Operator):
     """Send the selected image to the backend. Image must be loaded as a blender image before"""
 
@@ -25,6 +196,8 @@ class IPAdapterImageLoadOpeartor(bpy.types.Operator):
         "Render the IPAdapter image by sending the selected image to the backend"
     )
 
+    uuid: bpy.props.StringProperty(name="UUID")
+
     def execute(self, context: Optional[bpy.types.Context]) -> set[str]:
         assert context is not None
 
@@ -35,34 +208,46 @@ class IPAdapterImageLoadOpeartor(bpy.types.Operator):
         img_name = diffusion_props.ip_adapter_image
         img = bpy.data.images[img_name]
 
-        if img.size[0] > 0 and img.size[1] > 0:
+        # Unmodified image files are read by the upload thread (and skipped
+        # entirely when already on the backend) instead of reading the pixels
+        file_path = bpy.path.abspath(img.filepath) if img.source == "FILE" else ""
+        if (
+            file_path
+            and not img.is_dirty
+            and img.packed_file is None
+            and os.path.isfile(file_path)
+        ):
+            queue_image_upload(
+                scene=scene,
+                image=file_path,
+                image_name=img_name,
+                uuid=self.uuid,
+                url=generation_url(scene, self.uuid),
+            )
+            self.report({"INFO"}, "IP Adapter Image has been queued for upload")
+            return {"FINISHED"}
 
-            width, height = img.size
-            pixels = np.array(img.pixels[:])  # pyright: ignore
-            arr = pixels.reshape((height, width, 4))
+        if img.size[0] > 0 and img.size[1] > 0:
+            arr = read_image_pixels(img)
         else:
             self.report({"ERROR"}, "The selected image is invalid")
             return {"CANCELLED"}
 
-        arr = arr[::-1, :, :-1]
-        arr = (arr[:, :, :3] * 255).astype(np.uint8)
+        # Flip the rows and drop the alpha layer.
+        # Float images hold linear values, byte images are already display referred
+        lut = get_lut("srgb" if img.is_float else "linear")
+        arr = lut.apply(arr[::-1, :, :3])
         image = Image.fromarray(arr)
 
-        # Call the sending request function
-        response_code = send_image_function(
-            scene=scene, image=image, image_name=img_name
+        # Upload from the worker thread, the prompt submission waits for it
+        queue_image_upload(
+            scene=scene,
+            image=image,
+            image_name=img_name,
+            uuid=self.uuid,
+            url=generation_url(scene, self.uuid),
         )
-        if response_code == 200:
-            self.report(
-                {"INFO"},
-                f"IP Adapter Image has been sent to the server successfully",
-            )
-        else:
-            self.report(
-                {"ERROR"},
-                f"Failed to send the image to the server, response code: {response_code}",
-            )
-            return {"CANCELLED"}
+        self.report({"INFO"}, "IP Adapter Image has been queued for upload")
 
         return {"FINISHED"}
 
@@ -85,20 +270,13 @@ class DepthRenderOperator(bpy.types.Operator):
 
     uuid: bpy.props.StringProperty(name="UUID")
 
-    def get_history_item(self, context: bpy.types.Context) -> Optional[dict]:
-        history_props = context.scene.history_properties
-        for item in history_props.history_collection:
-            if item.uuid == self.uuid:
-                return item
-        return None
-
     def execute(self, context: Optional[bpy.types.Context]) -> set[str]:
         assert context is not None
         assert bpy.context is not None
 
         scene = context.scene
 
-        history_item = self.get_history_item(context)
+        history_item = find_history_item(self.uuid)
         if history_item is None:
             self.report({"ERROR"}, "History item not found")
             return {"CANCELLED"}
@@ -106,90 +284,32 @@ class DepthRenderOperator(bpy.types.Operator):
         ID = history_item.id
         uuid_value = history_item.uuid
 
-        scene.use_nodes = True
-        tree = scene.node_tree
-        assert tree is not None
-
-        bpy.context.scene.view_layers["ViewLayer"].use_pass_z = True
-
-        links = tree.links
-
-        # Render Nodes
-        rl = tree.nodes.new("CompositorNodeRLayers")
-        rl.location = 185, 285
-
-        # create output viewer node
-        v = tree.nodes.new("CompositorNodeViewer")
-        v.location = 750, 210
-        v.use_alpha = False
-
-        bpy.data.scenes["Scene"].render.resolution_x = 1024
-        bpy.data.scenes["Scene"].render.resolution_y = 1024
-
-        links.new(rl.outputs["Depth"], v.inputs[0])
-
-        # Compute Render
-        bpy.ops.render.render()
-
-        # get viewer pixels
-        viewer_image = bpy.data.images["Viewer Node"]
-
-        # Process the depthmap
-        if viewer_image.size[0] > 0 and viewer_image.size[1] > 0:
-
-            width, height = viewer_image.size
-            pixels = np.array(viewer_image.pixels[:])  # pyright: ignore
-            arr = pixels.reshape((height, width, 4))
-
-        else:
-            self.report({"ERROR"}, "The Viewer Node does not have any image data")
-            return {"CANCELLED"}
-
-        # Flip X axis and Drop the alpha layer for the depthmap
-        arr = arr[::-1, :, :-1]
-
-        positions = np.unique(arr)
-        if len(positions) <= 2:
-            self.report(
-                {"ERROR"},
-                "No Depth detected, aborting the generation",
-            )
+        try:
+            depth_map = render_depth_map(scene)
+        except RuntimeError as e:
+            self.report({"ERROR"}, str(e))
             return {"CANCELLED"}
 
-        threshold_distance = positions[-2] * 1.05
-
-        arr = np.minimum(arr, threshold_distance)
-        arr = normalize_array(arr)
-        image_array = linear_to_srgb_array(arr)
-        reverse = reverse_color(image_array)
-
-        # Convert to PIL format before sending request
-
-        image = Image.fromarray(reverse)
-        file_path = bpy.data.scenes["Scene"].render.filepath
-        save_path = os.path.join(file_path, f"depth_{ID}.png")
-        image.save(save_path)
-        bpy.data.images.load(save_path, check_existing=True)
+        # Blender preview straight from the array, no image file involved
+        set_image_pixels(f"depth_{ID}.png", depth_map)
 
         # TODO: Pop the render view for the loaded image
 
+        # Convert to PIL format before sending request
+        image = Image.fromarray(depth_map)
         input_depth_name = f"{uuid_value}_depth.png"
 
-        # Call the sending request function
-        response_code = send_image_function(
-            scene=scene, image=image, image_name=input_depth_name
+        # Upload from the worker thread, the prompt submission waits for it
+        queue_image_upload(
+            scene=scene,
+            image=image,
+            image_name=input_depth_name,
+            uuid=self.uuid,
+            url=generation_url(scene, self.uuid),
+            kind="depth",
+            save_path=debug_save_path(scene, f"depth_{ID}.png"),
         )
-        if response_code == 200:
-            self.report(
-                {"INFO"},
-                f"Depth map has been sent to the server successfully",
-            )
-        else:
-            self.report(
-                {"ERROR"},
-                f"Failed to send the image to the server, response code: {response_code}",
-            )
-            return {"CANCELLED"}
+        self.report({"INFO"}, "Depth map has been queued for upload")
 
         return {"FINISHED"}
 
@@ -207,20 +327,13 @@ class ImageRenderOperator(bpy.types.Operator):
 
     uuid: bpy.props.StringProperty(name="UUID")
 
-    def get_history_item(self, context: bpy.types.Context) -> Optional[dict]:
-        history_props = context.scene.history_properties
-        for item in history_props.history_collection:
-            if item.uuid == self.uuid:
-                return item
-        return None
-
     def execute(self, context: Optional[bpy.types.Context]) -> set[str]:
         assert context is not None
         assert bpy.context is not None
 
         scene = context.scene
 
-        history_item = self.get_history_item(context)
+        history_item = find_history_item(self.uuid)
         if history_item is None:
             self.report({"ERROR"}, "History item not found")
             return {"CANCELLED"}
@@ -228,39 +341,26 @@ class ImageRenderOperator(bpy.types.Operator):
         ID = history_item.id
 
         overlay_previous_status = bpy.context.space_data.overlay.show_overlays
-        previous_output_path = context.scene.render.filepath
         bpy.context.space_data.overlay.show_overlays = False
 
-        # change the output path to have the openGL output
-        save_path = os.path.join(
-            previous_output_path, f"tmp_render_opengl_inpainting_{ID}.png"
-        )
-        context.scene.render.filepath = save_path
-        bpy.ops.render.opengl(write_still=True)
+        image = render_viewport(self, context, f"inpainting_{ID}")
         bpy.context.space_data.overlay.show_overlays = overlay_previous_status
-
-        context.scene.render.filepath = previous_output_path
-
-        image = Image.open(save_path)
+        if image is None:
+            return {"CANCELLED"}
 
         # TODO: Pop the render view for the loaded image
         input_inpainting_name = f"{self.uuid}_inpainting.png"
 
-        # Call the sending request function
-        response_code = send_image_function(
-            scene=scene, image=image, image_name=input_inpainting_name
+        # Upload from the worker thread, the prompt submission waits for it
+        queue_image_upload(
+            scene=scene,
+            image=image,
+            image_name=input_inpainting_name,
+            uuid=self.uuid,
+            url=generation_url(scene, self.uuid),
+            save_path=debug_save_path(scene, f"tmp_render_opengl_inpainting_{ID}.png"),
         )
-        if response_code == 200:
-            self.report(
-                {"INFO"},
-                f"Inpainting image has been sent to the server successfully",
-            )
-        else:
-            self.report(
-                {"ERROR"},
-                f"Failed to send the image to the server, response code: {response_code}",
-            )
-            return {"CANCELLED"}
+        self.report({"INFO"}, "Inpainting image has been queued for upload")
 
         return {"FINISHED"}
 
@@ -274,21 +374,13 @@ class MaskRenderOperator(bpy.types.Operator):
 
     uuid: bpy.props.StringProperty(name="UUID")
 
-    def get_history_item(self, context: bpy.types.Context) -> Optional[dict]:
-        """Retrieve the history item associated with the given UUID."""
-        history_props = context.scene.history_properties
-        for item in history_props.history_collection:
-            if item.uuid == self.uuid:
-                return item
-        return None
-
     def execute(self, context: Optional[bpy.types.Context]) -> Set[str]:
         assert bpy.context is not None
         assert context is not None
 
         # Retrieve the scene and associated history item
         scene = context.scene
-        history_item = self.get_history_item(context)
+        history_item = find_history_item(self.uuid)
         if history_item is None:
             self.report({"ERROR"}, "History item not found")
             return {"CANCELLED"}
@@ -356,42 +448,28 @@ class MaskRenderOperator(bpy.types.Operator):
         bpy.context.scene.view_settings.view_transform = "Standard"
 
         overlay_previous_status = bpy.context.space_data.overlay.show_overlays
-        previous_output_path = context.scene.render.filepath
         bpy.context.space_data.overlay.show_overlays = False
 
-        # Change the output path to save the OpenGL output as a mask
-        save_path = os.path.join(
-            previous_output_path, f"tmp_render_opengl_mask_{ID}.png"
-        )
-        context.scene.render.filepath = save_path
-        bpy.ops.render.opengl(write_still=True)
+        # Render the mask in memory
+        image = render_viewport(self, context, f"mask_{ID}")
         bpy.context.space_data.overlay.show_overlays = overlay_previous_status
 
-        # Restore previous output path
-        context.scene.render.filepath = previous_output_path
-
-        # Load the rendered mask image
-        image = Image.open(save_path)
-
         # Step 5: Send the rendered mask to the server (pseudo-code for server communication)
         # TODO: Pop the render view for the loaded image
         input_mask_name = f"{self.uuid}_mask.png"
 
-        # Call the sending request function
-        response_code = send_image_function(
-            scene=scene, image=image, image_name=input_mask_name
-        )
-        if response_code == 200:
-            self.report(
-                {"INFO"},
-                f"Mask has been sent to the server successfully",
-            )
-        else:
-            self.report(
-                {"ERROR"},
-                f"Failed to send the image to the server, response code: {response_code}",
+        # Upload from the worker thread, the prompt submission waits for it
+        if image is not None:
+            queue_image_upload(
+                scene=scene,
+                image=image,
+                image_name=input_mask_name,
+                uuid=self.uuid,
+                url=generation_url(scene, self.uuid),
+                kind="mask",
+                save_path=debug_save_path(scene, f"tmp_render_opengl_mask_{ID}.png"),
             )
-            return {"CANCELLED"}
+            self.report({"INFO"}, "Mask has been queued for upload")
 
         # Step 6: Restore the original state
         bpy.context.space_data.shading.type = prev_shading
@@ -405,7 +483,7 @@ class MaskRenderOperator(bpy.types.Operator):
         )  # Remove the mask material slot
         bpy.ops.object.mode_set(mode="EDIT")
 
-        return {"FINISHED"}
+        return {"FINISHED"} if image is not None else {"CANCELLED"}
 
     pass
 
@@ -0,0 +1,331 @@
+import functools
+import os
+import time
+from concurrent.futures import Future
+from typing import List, NamedTuple
+
+import bpy
+from bpy.app.handlers import persistent
+
+from ..functions import worker
+from ..functions.backend_client import get_client
+from ..functions.jobs import (
+    FAILED,
+    FETCHING,
+    PENDING,
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    QUEUED,
+    RESUMABLE_STATES,
+    UPLOADING,
+    Job,
+    get_job_queue,
+)
+from ..functions.latency import get_latency_model
+from ..functions.result_cache import get_result_cache, result_key
+from ..functions.websocket_client import get_listener
+from .history_collection_operators import (
+    batch_items,
+    fail_removed_generation,
+    find_history_item,
+    generation_save_path,
+    load_fetched_images,
+)
+
+# pyright: reportAttributeAccessIssue=false
+
+# Seconds to wait for the event stream before submitting without notifications
+WEBSOCKET_CONNECT_WAIT = 2.0
+
+# Seconds between two passes of the job scheduler
+SCHEDULE_INTERVAL = 0.5
+
+JOB_QUEUE_FILE = "jobs.json"
+LATENCY_FILE = "completion_times.json"
+RESULT_CACHE_FOLDER = "results"
+
+# Environment variable replacing the blender user configuration folder, so that
+# blender processes running side by side do not share their job queue, latency
+# file and result cache
+CONFIG_DIR_VARIABLE = "TEXTURE_DIFFUSION_CONFIG_DIR"
+
+
+class Submission(NamedTuple):
+    prompt_id: str
+    client_id: str
+    # Key of the outputs in the result cache, empty when the cache is disabled
+    result_key: str
+    # The outputs were restored from the result cache, nothing was queued
+    cached: bool
+
+
+def submit_prompt(
+    url: str,
+    payload: dict,
+    use_websocket: bool,
+    uploads: List[Future],
+    front: bool,
+    use_result_cache: bool,
+    output_paths: List[str],
+) -> Submission:
+    """Worker job : wait for the input uploads, then queue the workflow.
+    With `front`, the prompt is put at the front of the backend queue.
+    With the result cache, the outputs of a generation with the same inputs
+    are copied to `output_paths` instead
+    """
+
+    uploaded_names, digests, errors = worker.wait_for_uploads(uploads)
+    if errors:
+        raise RuntimeError(f"Input images failed to upload: {', '.join(errors)}")
+
+    cache_key = ""
+    if use_result_cache:
+        cache_key = result_key(payload["prompt"], digests)
+        if get_result_cache().restore(cache_key, output_paths):
+            return Submission("", "", cache_key, True)
+
+    # Inputs may be held by the backend under their content addressed name
+    for node in payload["prompt"].values():
+        inputs = node["inputs"]
+        for name, value in inputs.items():
+            if name == "image" and isinstance(value, str) and value in uploaded_names:
+                inputs[name] = uploaded_names[value]
+
+    # Tie the prompt to our event stream so completion is notified right away
+    client_id = ""
+    if use_websocket:
+        listener = get_listener(url)
+        if listener.wait_connected(WEBSOCKET_CONNECT_WAIT):
+            client_id = listener.client_id
+            payload["client_id"] = client_id
+        else:
+            print("Websocket not available, falling back to polling")
+
+    if front:
+        payload["front"] = True
+
+    response = get_client().queue_prompt(url, payload)
+    if response.status_code != 200:
+        raise RuntimeError(
+            f"Failed to queue the request, response code: {response.status_code}"
+        )
+
+    return Submission(response.json().get("prompt_id", ""), client_id, cache_key, False)
+
+
+def on_prompt_submitted(uuid: str, future: Future):
+    """Main thread callback : store the prompt ids and start fetching the result"""
+
+    job_queue = get_job_queue()
+
+    if future.exception() is not None:
+        print(f"Request {uuid} was not sent. Error: {future.exception()}")
+        job_queue.set_state(uuid, FAILED, str(future.exception()))
+        return
+
+    submission = future.result()
+    if submission.cached:
+        job_queue.set_state(uuid, FETCHING, result_key=submission.result_key)
+    else:
+        job_queue.set_state(
+            uuid,
+            QUEUED,
+            prompt_id=submission.prompt_id,
+            submitted_at=time.time(),
+            result_key=submission.result_key,
+        )
+
+    history_item = find_history_item(uuid)
+    if history_item is None:
+        print(f"History item {uuid} was removed before submission")
+        fail_removed_generation(uuid)
+        return
+
+    if submission.cached:
+        print(f"Generation {history_item.id} applied from the result cache")
+        load_fetched_images(history_item)
+        return
+
+    history_item.prompt_id = submission.prompt_id
+    history_item.client_id = submission.client_id
+    print("Request Sent!")
+
+    # Launch a watchdog to get the result
+    bpy.ops.diffusion.fetch_history(uuid=uuid)
+
+
+def enqueue_job(
+    uuid: str,
+    url: str,
+    payload: dict,
+    use_websocket: bool,
+    uploads: List[Future],
+    priority: int = PRIORITY_INTERACTIVE,
+    latency_key: str = "",
+    use_result_cache: bool = False,
+):
+    """Add a generation to the job queue, it is submitted as soon as its backend
+    has a free slot"""
+
+    assert bpy.context is not None
+    backend_props = bpy.context.scene.backend_properties
+
+    job = Job(uuid, url, priority, latency_key=latency_key)
+    job.payload = payload
+    job.uploads = uploads
+    job.use_websocket = use_websocket
+    job.use_result_cache = use_result_cache
+
+    history_item = find_history_item(uuid)
+    if history_item is not None:
+        history_item.expected_duration = get_latency_model().estimate(
+            latency_key, backend_props.expected_completion
+        )
+        job.output_paths = [
+            generation_save_path(item) for item in batch_items(history_item)
+        ]
+
+    get_result_cache().max_bytes = backend_props.result_cache_size * 1024 * 1024
+    get_job_queue().add(job)
+
+    schedule_jobs()
+
+
+def dispatch_job(job: Job):
+    """Submit a job from the worker thread"""
+
+    job_queue = get_job_queue()
+
+    # Interactive jobs skip the batch jobs already waiting on the backend
+    front = job.priority == PRIORITY_INTERACTIVE and job_queue.has_active(
+        job.url, PRIORITY_BATCH
+    )
+
+    job_queue.set_state(job.uuid, UPLOADING)
+    worker.submit(
+        submit_prompt,
+        job.url,
+        job.payload,
+        job.use_websocket,
+        job.uploads,
+        front,
+        job.use_result_cache,
+        job.output_paths,
+        callback=functools.partial(on_prompt_submitted, job.uuid),
+    )
+
+
+def schedule_jobs() -> float:
+    """Main thread timer : dispatch pending jobs while their backend has free slots"""
+
+    assert bpy.context is not None
+    scene = bpy.context.scene
+    if scene is None:
+        return SCHEDULE_INTERVAL
+    max_jobs = scene.backend_properties.max_concurrent_jobs
+
+    job_queue = get_job_queue()
+    for url in job_queue.pending_urls():
+        while job_queue.active_count(url) < max_jobs:
+            job = job_queue.next_pending(url)
+            if job is None:
+                break
+            if job.payload is None:
+                job_queue.set_state(job.uuid, FAILED, "Request lost")
+                continue
+            dispatch_job(job)
+
+    return SCHEDULE_INTERVAL
+
+
+@persistent
+def resume_jobs(*args):
+    """Fetch again the results of the jobs submitted before a restart, for the
+    generations of the opened file that did not receive their texture"""
+
+    assert bpy.context is not None
+    if bpy.context.scene is None:
+        return
+
+    timeout = bpy.context.scene.backend_properties.timeout_retry
+    for job in get_job_queue().jobs(RESUMABLE_STATES):
+        history_item = find_history_item(job.uuid)
+        if history_item is None:
+            # Generation removed, or of another file sharing the job queue :
+            # the other file may still fetch it, until the timeout
+            if time.time() - job.submitted_at > timeout:
+                fail_removed_generation(job.uuid)
+            continue
+        if history_item.received:
+            continue
+        if job.uuid in _resumed:
+            continue
+
+        _resumed.add(job.uuid)
+        print(f"Resuming the fetch of generation {history_item.id}")
+        if not history_item.prompt_id:
+            history_item.prompt_id = job.prompt_id
+        # The result is likely ready : poll right away, the timeout counts from now
+        get_job_queue().set_state(
+            job.uuid,
+            job.state,
+            submitted_at=time.time() - history_item.expected_duration,
+        )
+        bpy.ops.diffusion.fetch_history(uuid=job.uuid)
+
+
+# Jobs whose fetch was resumed, a file opened twice does not fetch twice
+_resumed = set()
+
+
+def resume_on_startup():
+    """One shot timer : the scene is not available while the add-on registers"""
+    resume_jobs()
+    return None
+
+
+def config_path(file_name: str) -> str:
+    """File of the add-on in the blender user configuration folder, or in the
+    folder of `CONFIG_DIR_VARIABLE` when it is set"""
+    folder = os.environ.get(CONFIG_DIR_VARIABLE, "")
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    else:
+        folder = bpy.utils.user_resource(
+            "CONFIG", path="texture_diffusion", create=True
+        )
+    return os.path.join(folder, file_name)
+
+
+def jobs_register():
+    job_queue = get_job_queue()
+    job_queue.path = config_path(JOB_QUEUE_FILE)
+    job_queue.load()
+
+    latency_model = get_latency_model()
+    latency_model.path = config_path(LATENCY_FILE)
+    latency_model.load()
+
+    get_result_cache().folder = config_path(RESULT_CACHE_FOLDER)
+
+    if not bpy.app.timers.is_registered(schedule_jobs):
+        bpy.app.timers.register(schedule_jobs, persistent=True)
+    bpy.app.handlers.load_post.append(resume_jobs)
+    bpy.app.timers.register(resume_on_startup, first_interval=1.0)
+
+
+def jobs_unregister():
+    if bpy.app.timers.is_registered(schedule_jobs):
+        bpy.app.timers.unregister(schedule_jobs)
+    if bpy.app.timers.is_registered(resume_on_startup):
+        bpy.app.timers.unregister(resume_on_startup)
+    if resume_jobs in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(resume_jobs)
+
+    # Jobs still pending lose their request, they are failed when loaded again
+    job_queue = get_job_queue()
+    for job in job_queue.jobs((PENDING,)):
+        job_queue.set_state(job.uuid, FAILED, "Add-on disabled before submission")
+    job_queue.clear()
+    _resumed.clear()
+    get_latency_model().clear()
@@ -1,5 +1,7 @@
 import bpy
 
+from ..functions.backend_pool import get_backend_pool
+
 
 class BackendPanel(bpy.types.Panel):
     bl_label = "Backend Panel"
@@ -16,7 +18,29 @@ class BackendPanel(bpy.types.Panel):
         layout.label(text="Backend Settings")
         layout.prop(backend_properties, "backend_availables")
         layout.prop(backend_properties, "url")
-
+        layout.prop(backend_properties, "use_backend_pool")
+        if backend_properties.use_backend_pool:
+            layout.prop(backend_properties, "pool_urls")
+            box = layout.box()
+            for status in get_backend_pool().statuses():
+                if status.healthy:
+                    text = f"{status.url} : {status.queue_depth} in queue"
+                    icon = "CHECKMARK"
+                else:
+                    text = f"{status.url} : unavailable"
+                    icon = "ERROR"
+                box.label(text=text, icon=icon)
+        layout.prop(backend_properties, "fetch_mode")
+        layout.prop(backend_properties, "use_upload_cache")
+        layout.prop(backend_properties, "verify_upload_cache")
+        layout.prop(backend_properties, "use_result_cache")
+        if backend_properties.use_result_cache:
+            layout.prop(backend_properties, "result_cache_size")
+        layout.prop(backend_properties, "png_compress_level")
+        layout.prop(backend_properties, "allow_webp")
+        layout.prop(backend_properties, "save_debug_renders")
+
+        layout.prop(backend_properties, "max_concurrent_jobs")
         layout.prop(backend_properties, "timeout_retry")
 
 
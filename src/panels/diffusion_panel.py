@@ -19,7 +19,9 @@ class DiffusionPanel(bpy.types.Panel):
         scene = context.scene
         diffusion_properties = scene.diffusion_properties
 
-        layout.prop(diffusion_properties, "models_available")
+        row = layout.row(align=True)
+        row.prop(diffusion_properties, "models_available")
+        row.operator("diffusion.refresh_models", text="", icon="FILE_REFRESH")
         layout.prop(diffusion_properties, "prompt")
         layout.prop(diffusion_properties, "n_steps")
 
@@ -28,6 +30,7 @@ class DiffusionPanel(bpy.types.Panel):
         row = layout.row()
         row.prop(diffusion_properties, "seed")
         row.prop(diffusion_properties, "random_seed")
+        layout.prop(diffusion_properties, "batch_count")
 
         # Add a visual separator and different background for the mesh collection
         layout.separator()
@@ -93,7 +96,9 @@ class LoRAPanel(bpy.types.Panel):
         layout = self.layout
         diffusion_properties = context.scene.diffusion_properties
 
-        layout.prop(diffusion_properties, "loras_available")
+        row = layout.row(align=True)
+        row.prop(diffusion_properties, "loras_available")
+        row.operator("diffusion.refresh_models", text="", icon="FILE_REFRESH")
         layout.prop(diffusion_properties, "lora_scale")
 
 
@@ -145,6 +150,27 @@ class InpaintingPanel(bpy.types.Panel):
         layout.prop(diffusion_properties, "denoising_strength")
 
 
+class GridPanel(bpy.types.Panel):
+    bl_label = "Multi-View Grid"
+    bl_idname = "OBJECT_PT_Grid"
+    bl_space_type = "VIEW_3D"
+    bl_region_type = "UI"
+    bl_category = "Diffusion"
+    bl_parent_id = "OBJECT_PT_DiffusionPanel"
+    bl_options = {"DEFAULT_CLOSED"}
+
+    def draw(self, context: Optional[bpy.types.Context]):
+        assert context is not None
+        layout = self.layout
+        diffusion_properties = context.scene.diffusion_properties
+
+        layout.prop(diffusion_properties, "grid_views")
+        layout.prop(diffusion_properties, "grid_elevation")
+        layout.operator(
+            "diffusion.generate_grid", text="GENERATE GRID", icon="MESH_GRID"
+        )
+
+
 # Register classes
 def register():
     bpy.utils.register_class(DiffusionPanel)
@@ -152,6 +178,7 @@ def register():
     bpy.utils.register_class(LoRAPanel)
     bpy.utils.register_class(IPAdapterPanel)
     bpy.utils.register_class(InpaintingPanel)
+    bpy.utils.register_class(GridPanel)
 
 
 def unregister():
@@ -160,3 +187,4 @@ def unregister():
     bpy.utils.unregister_class(LoRAPanel)
     bpy.utils.unregister_class(IPAdapterPanel)
     bpy.utils.unregister_class(InpaintingPanel)
+    bpy.utils.unregister_class(GridPanel)
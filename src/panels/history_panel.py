@@ -2,6 +2,15 @@ from typing import Optional
 
 import bpy
 
+from ..functions.jobs import (
+    FETCHING,
+    PENDING,
+    QUEUED,
+    RUNNING,
+    UPLOADING,
+    get_job_queue,
+)
+
 # pyright: reportAttributeAccessIssue=false
 
 
@@ -21,6 +30,16 @@ class HistoryPanel(bpy.types.Panel):
         backend_props = scene.backend_properties
 
         layout.label(text="History")
+
+        # Generations not finished yet, by state
+        counts = get_job_queue().counts()
+        waiting = [
+            f"{counts[state]} {state}"
+            for state in (PENDING, UPLOADING, QUEUED, RUNNING, FETCHING)
+            if counts.get(state)
+        ]
+        if waiting:
+            layout.label(text=f"Jobs: {', '.join(waiting)}", icon="SORTTIME")
         box = layout.box()
 
         box.label(text="Generation History", icon="PACKAGE")
@@ -44,7 +63,10 @@ class HistoryPanel(bpy.types.Panel):
 
             row.label(text=f"{history_item.id}")
             row.label(text=f"{history_item.prompt}")
-            row.label(text=f"{history_item.seed}")
+            if history_item.batch_index:
+                row.label(text=f"{history_item.seed} #{history_item.batch_index + 1}")
+            else:
+                row.label(text=f"{history_item.seed}")
 
             if history_item.received:
                 progress_value = 1.0
@@ -52,8 +74,12 @@ class HistoryPanel(bpy.types.Panel):
                 timeout_progress_value = (
                     history_item.fetching_attempts / backend_props.timeout_retry
                 )
+                # Estimated from the past generations with the same settings
+                expected_duration = (
+                    history_item.expected_duration or backend_props.expected_completion
+                )
                 expected_progress_value = (
-                    history_item.fetching_attempts / backend_props.expected_completion
+                    history_item.fetching_attempts / expected_duration
                 )
 
                 if expected_progress_value >= 1.0:
@@ -1,5 +1,13 @@
 import bpy
 
+from ..functions.backend_pool import get_backend_pool, parse_urls
+
+
+def update_backend_pool(self, context):
+    """Start checking the servers of the pool as soon as it is configured"""
+    if self.use_backend_pool:
+        get_backend_pool().set_urls(parse_urls(self.url, self.pool_urls))
+
 
 class BackendProperties(bpy.types.PropertyGroup):
 
@@ -16,11 +24,90 @@ class BackendProperties(bpy.types.PropertyGroup):
         name="URL",
         description="URL to access the backend",
         default="http://127.0.0.1:8188",
+        update=update_backend_pool,
+    )
+
+    use_backend_pool: bpy.props.BoolProperty(
+        name="Backend Pool",
+        description="Send each generation to the least busy of several comfyUI servers",
+        default=False,
+        update=update_backend_pool,
+    )
+    pool_urls: bpy.props.StringProperty(
+        name="Pool URLs",
+        description="Other comfyUI servers of the pool, comma separated (the URL above is part of the pool)",
+        default="",
+        update=update_backend_pool,
+    )
+
+    fetch_mode: bpy.props.EnumProperty(
+        name="Fetch Mode",
+        description="How the add-on learns that a generation is finished",
+        items=[
+            (
+                "websocket",
+                "WebSocket",
+                "Listen to the backend event stream and fetch the result as soon as it is ready",
+            ),
+            ("polling", "Polling", "Request the result from the backend every second"),
+        ],
+        default="websocket",
+    )
+
+    use_upload_cache: bpy.props.BoolProperty(
+        name="Upload Cache",
+        description="Skip encoding and uploading images the backend already holds",
+        default=True,
+    )
+    verify_upload_cache: bpy.props.BoolProperty(
+        name="Verify Cached Uploads",
+        description="Check that a cached image still exists on the backend before reusing it",
+        default=True,
+    )
+
+    use_result_cache: bpy.props.BoolProperty(
+        name="Result Cache",
+        description="Apply the stored result of a previous generation with exactly the same inputs instead of generating it again",
+        default=True,
+    )
+    result_cache_size: bpy.props.IntProperty(
+        name="Result Cache Size (MB)",
+        description="Disk space of the stored results, the least recently used are removed first",
+        default=512,
+        min=16,
+        max=65536,
+    )
+
+    png_compress_level: bpy.props.IntProperty(
+        name="PNG Compression",
+        description="zlib level of the images sent to the backend : higher is smaller but slower to encode",
+        default=6,
+        min=0,
+        max=9,
+    )
+    allow_webp: bpy.props.BoolProperty(
+        name="Lossless WebP",
+        description="Send depth and color images as lossless WebP (the backend must be able to read WebP)",
+        default=False,
+    )
+
+    save_debug_renders: bpy.props.BoolProperty(
+        name="Save Renders to Disk",
+        description="Also write the depth, inpainting and mask images sent to the backend in the render output folder (debugging)",
+        default=False,
+    )
+
+    max_concurrent_jobs: bpy.props.IntProperty(
+        name="Concurrent Jobs",
+        description="Maximum number of generations submitted to the backend at the same time, the others wait in the job queue",
+        default=2,
+        min=1,
+        max=16,
     )
 
     timeout_retry: bpy.props.IntProperty(
         name="Timeout Retry",
-        description="Maximum number of retries (1 per second) to fetch the image before a timeout",
+        description="Seconds to wait for the image before a timeout",
         default=60,
         min=1,
         max=1000,
@@ -28,7 +115,7 @@ class BackendProperties(bpy.types.PropertyGroup):
 
     expected_completion: bpy.props.IntProperty(
         name="Expected Completion",
-        description="Expected time in seconds to complete the image generation",
+        description="Expected time in seconds to complete a generation whose settings were never timed",
         default=60,
         min=1,
         max=1000,
@@ -1,7 +1,6 @@
-from typing import List
-
 import bpy
-import requests
+
+from ..functions.catalog import catalog_enum_items
 
 
 class MeshItem(bpy.types.PropertyGroup):
@@ -10,46 +9,15 @@ class MeshItem(bpy.types.PropertyGroup):
 
 class DiffusionProperties(bpy.types.PropertyGroup):
 
-    # Update the model
+    # Items of the model and lora enums, served from the catalog cache :
+    # called on every redraw, they must never wait on the backend
     def update_models(self, context):
-
         base_url = context.scene.backend_properties.url
-        route = "/models/checkpoints"
-        response = requests.get(f"{base_url}{route}")
-
-        if response.status_code == 200:
-            models: List[str] = response.json()
-            models_list = [
-                (
-                    model,
-                    model.replace(".safetensors", ""),
-                    "",
-                )
-                for model in models
-            ]
-        else:
-            models_list = []
-        return models_list
+        return catalog_enum_items(base_url, "models")
 
     def update_loras(self, context):
-
         base_url = context.scene.backend_properties.url
-        route = "/models/loras"
-        response = requests.get(f"{base_url}{route}")
-
-        output = [("None", "None", "")]
-        if response.status_code == 200:
-            loras: List[str] = response.json()
-            loras_list = [
-                (
-                    lora,
-                    lora.replace(".safetensors", ""),
-                    "",
-                )
-                for lora in loras
-            ]
-            output += loras_list
-        return output
+        return catalog_enum_items(base_url, "loras", (("None", "None", ""),))
 
     mesh_objects: bpy.props.CollectionProperty(type=MeshItem)
 
@@ -102,6 +70,13 @@ class DiffusionProperties(bpy.types.PropertyGroup):
         min=0,
         max=1000000,
     )
+    batch_count: bpy.props.IntProperty(
+        name="Batch Count",
+        description="Number of variations generated together in a single prompt, one history item each",
+        default=1,
+        min=1,
+        max=16,
+    )
     random_seed: bpy.props.BoolProperty(
         name="Use a random seed",
         description="Toggle random seed for generationg",
@@ -221,6 +196,22 @@ class DiffusionProperties(bpy.types.PropertyGroup):
         name="Width", description="Height of the generated image", default=1024
     )
 
+    # Multi-view grid generation
+    grid_views: bpy.props.IntProperty(
+        name="Views",
+        description="Number of cameras around the mesh, their depth maps are generated together as a single grid image",
+        default=4,
+        min=2,
+        max=9,
+    )
+    grid_elevation: bpy.props.FloatProperty(
+        name="Elevation",
+        description="Height of the grid cameras above the center of the mesh, in degrees",
+        default=20.0,
+        min=-89.0,
+        max=89.0,
+    )
+
     def update_mesh_collection(self, context):
         """Update the mesh_objects collection to match the current scene"""
         self.mesh_objects.clear()
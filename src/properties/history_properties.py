@@ -14,6 +14,16 @@ class HistoryItem(bpy.types.PropertyGroup):
     fetching_attempts: bpy.props.IntProperty(name="Seed")
     mesh: bpy.props.StringProperty(name="Mesh")
     received: bpy.props.BoolProperty(name="Received", default=False)
+    prompt_id: bpy.props.StringProperty(name="Prompt ID")
+    client_id: bpy.props.StringProperty(name="Client ID")
+    # Id of the first item of the batch : its camera, UVs and depth map are shared
+    camera_id: bpy.props.IntProperty(name="Camera ID")
+    batch_index: bpy.props.IntProperty(name="Batch Index", default=0)
+    # Id of the first view of a multi-view grid (0 outside of grids)
+    grid_id: bpy.props.IntProperty(name="Grid ID", default=0)
+    grid_index: bpy.props.IntProperty(name="Grid Index", default=0)
+    # Seconds from the submission to the result, as estimated when queued
+    expected_duration: bpy.props.FloatProperty(name="Expected Duration", default=0.0)
 
 
 class HistoryProperties(bpy.types.PropertyGroup):
@@ -0,0 +1,51 @@
+import importlib.util
+import os
+import sys
+import types
+
+# The modules under test do not need blender : `src` is importable as is, and
+# the blender modules are stubbed when missing (fake-bpy-module only ships type
+# stubs). pytest still imports the add-on, as the repository root is a package,
+# so the stubs can be called, used as decorators and subclassed.
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+BLENDER_MODULES = (
+    "bpy",
+    "bpy.app",
+    "bpy.app.handlers",
+    "bpy.props",
+    "bpy.types",
+    "bpy_extras",
+    "bpy_extras.view3d_utils",
+    "bmesh",
+    "mathutils",
+    "gpu",
+    "gpu.shader",
+    "gpu.types",
+    "gpu_extras",
+    "gpu_extras.batch",
+    "gpu_extras.presets",
+)
+
+
+class Stub(types.ModuleType):
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return Stub(name)
+
+    def __call__(self, *args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return Stub("call")
+
+    def __mro_entries__(self, bases):
+        return (object,)
+
+
+if importlib.util.find_spec("bpy") is None:
+    for module in BLENDER_MODULES:
+        sys.modules[module] = Stub(module)
@@ -0,0 +1,163 @@
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+SCRIPTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+sys.path.insert(0, SCRIPTS)
+
+from batch_coordinator import CONFIG_DIR_VARIABLE, Worker  # noqa: E402
+from mock_comfyui import DEFAULT_CHECKPOINTS  # noqa: E402
+
+BLENDER = shutil.which("blender")
+
+
+def coordinator_args(tmp_path, **kwargs) -> SimpleNamespace:
+    return SimpleNamespace(
+        blender=BLENDER or "blender",
+        blend=str(tmp_path / "scene.blend"),
+        output_dir=str(tmp_path / "batch"),
+        timeout=60.0,
+        **kwargs,
+    )
+
+
+def option(command: list, name: str) -> str:
+    return command[command.index(name) + 1]
+
+
+def test_workers_write_to_their_own_folders(tmp_path):
+    args = coordinator_args(tmp_path)
+    workers = [Worker(index, "", args) for index in range(2)]
+
+    render_dirs = [option(worker.command(), "--render-dir") for worker in workers]
+    config_dirs = [worker.environment()[CONFIG_DIR_VARIABLE] for worker in workers]
+    outputs = [option(worker.command(), "--output") for worker in workers]
+    logs = [option(worker.command(), "--log") for worker in workers]
+
+    for paths in (render_dirs, config_dirs, outputs, logs):
+        assert len(set(paths)) == len(workers)
+    # No folder of a worker is inside the folder of another
+    folders = [os.path.abspath(path) for path in render_dirs + config_dirs]
+    for folder in folders:
+        assert not any(
+            other != folder and folder.startswith(other + os.sep) for other in folders
+        )
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def mock_backend():
+    port = free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(SCRIPTS, "mock_comfyui.py"),
+            "--port",
+            str(port),
+            "--latency",
+            "0.2",
+            "--slots",
+            "2",
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            assert time.monotonic() < deadline, "The mock backend did not start"
+            time.sleep(0.1)
+    yield f"http://127.0.0.1:{port}"
+    server.terminate()
+    server.wait()
+
+
+@pytest.mark.skipif(BLENDER is None, reason="blender is not installed")
+def test_two_workers_do_not_share_outputs(tmp_path, mock_backend):
+    args = coordinator_args(tmp_path)
+    # Both workers open the same file, with the same history counter
+    subprocess.run(
+        [
+            BLENDER,
+            "-b",
+            "--factory-startup",
+            "--python-expr",
+            f"import bpy; bpy.ops.wm.save_as_mainfile(filepath={args.blend!r})",
+        ],
+        check=True,
+        capture_output=True,
+    )
+
+    assets = [
+        {
+            "name": f"cube {index}",
+            "mesh": "Cube",
+            "camera": {"location": [4, -4 + index, 3], "look_at": [0, 0, 0]},
+            "prompt": "a wooden crate",
+        }
+        for index in range(4)
+    ]
+    manifest = tmp_path / "assets.json"
+    manifest.write_text(
+        json.dumps(
+            {
+                "defaults": {"models_available": DEFAULT_CHECKPOINTS[0]},
+                "assets": assets,
+            }
+        )
+    )
+
+    subprocess.run(
+        [
+            sys.executable,
+            os.path.join(SCRIPTS, "batch_coordinator.py"),
+            "--blender",
+            BLENDER,
+            "--blend",
+            args.blend,
+            "--manifest",
+            str(manifest),
+            "--workers",
+            "2",
+            "--backends",
+            mock_backend,
+            "--output-dir",
+            args.output_dir,
+            "--timeout",
+            "60",
+        ],
+        check=True,
+        timeout=600,
+    )
+
+    written = {}
+    for index in range(2):
+        worker = Worker(index, mock_backend, args)
+        textures = [
+            os.path.join(worker.render_dir, name)
+            for name in os.listdir(worker.render_dir)
+            if name.startswith("Generation_")
+        ]
+        for path in textures:
+            assert path not in written, f"{path} written by two workers"
+            written[path] = index
+        assert os.path.exists(os.path.join(worker.config_dir, "jobs.json"))
+
+    # One texture per asset : none was overwritten by the other worker
+    assert len(written) == len(assets)
+    assert set(written.values()) == {0, 1}
@@ -0,0 +1,43 @@
+import numpy as np
+from PIL import Image
+
+from functions.grid import blend_factors, make_grid, split_grid, view_weights
+
+
+def test_split_grid_returns_the_tiles():
+    tiles = [np.full((8, 8), 50 * (index + 1), dtype=np.uint8) for index in range(3)]
+    grid = Image.fromarray(make_grid(tiles, 16))
+    split = split_grid(grid, 3)
+    assert [np.asarray(tile).mean() for tile in split] == [50, 100, 150]
+
+
+def test_view_weights_follow_the_facing_ratio():
+    positions = np.zeros((3, 3))
+    normals = np.array([[1.0, 0, 0], [-1.0, 0, 0], [0, 0, 1.0]])
+    cameras = np.array([[5.0, 0, 0], [0, 0, 5.0]])
+
+    weights = view_weights(positions, normals, cameras, sharpness=1)
+    # Facing the camera, facing away, seen edge on
+    assert np.allclose(weights, [[1, 0, 0], [0, 0, 1]])
+
+
+def test_chained_mixes_give_the_weighted_average():
+    rng = np.random.default_rng(0)
+    weights = rng.random((4, 100))
+    weights[:2, :10] = 0
+    colors = rng.random((4, 100))
+
+    factors = blend_factors(weights)
+    # As the mix nodes of the grid material : each view over the ones before it
+    result = colors[0]
+    for index in range(1, len(colors)):
+        result = (1 - factors[index]) * result + factors[index] * colors[index]
+
+    average = (weights * colors).sum(axis=0) / weights.sum(axis=0)
+    assert np.allclose(result, average)
+    assert np.all((factors >= 0) & (factors <= 1))
+
+
+def test_unseen_vertices_keep_the_first_view():
+    factors = blend_factors(np.zeros((3, 5)))
+    assert np.all(factors == 0)
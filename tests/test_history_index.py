@@ -0,0 +1,76 @@
+from types import SimpleNamespace
+
+from functions.history_index import HistoryIndex
+
+OWNER = 1
+
+
+def item(id: int, camera_id: int = 0, grid_id: int = 0):
+    return SimpleNamespace(
+        uuid=f"uuid-{id}", id=id, camera_id=camera_id, grid_id=grid_id
+    )
+
+
+def add(index: HistoryIndex, collection: list, new_item):
+    collection.append(new_item)
+    index.added(OWNER, collection, len(collection) - 1)
+
+
+def ids(items):
+    return None if items is None else [item.id for item in items]
+
+
+def test_groups_follow_added_and_removed_items():
+    index = HistoryIndex()
+    collection = [item(1, camera_id=1)]
+    index.rebuild(OWNER, collection)
+
+    add(index, collection, item(2, camera_id=1))
+    add(index, collection, item(3, camera_id=3, grid_id=3))
+    add(index, collection, item(4, camera_id=4, grid_id=3))
+    assert ids(index.group(OWNER, collection, "camera_id", 1)) == [1, 2]
+    assert ids(index.group(OWNER, collection, "grid_id", 3)) == [3, 4]
+
+    del collection[0]
+    index.removed(0)
+    assert ids(index.group(OWNER, collection, "camera_id", 1)) == [2]
+    assert ids(index.group(OWNER, collection, "grid_id", 3)) == [3, 4]
+    assert index.find(OWNER, collection, "uuid-4") is collection[2]
+
+
+def test_missing_group_is_not_rebuilt():
+    index = HistoryIndex()
+    collection = [item(1, camera_id=1)]
+    index.rebuild(OWNER, collection)
+
+    # Changed outside of the hooks : a miss does not scan the collection
+    collection.append(item(2, camera_id=2))
+    assert index.group(OWNER, collection, "camera_id", 2) is None
+
+
+def test_regrouped_item():
+    index = HistoryIndex()
+    collection = []
+    index.rebuild(OWNER, collection)
+    add(index, collection, item(1, camera_id=1))
+    add(index, collection, item(2, camera_id=2))
+
+    for view in collection:
+        view.grid_id = 1
+        index.regrouped(OWNER, collection, view.uuid)
+    assert ids(index.group(OWNER, collection, "grid_id", 1)) == [1, 2]
+    assert index.group(OWNER, collection, "grid_id", 0) is None
+
+
+def test_stale_group_is_rebuilt():
+    index = HistoryIndex()
+    collection = [item(1, camera_id=1), item(2, camera_id=1)]
+    index.rebuild(OWNER, collection)
+
+    collection[1].camera_id = 2
+    assert ids(index.group(OWNER, collection, "camera_id", 1)) == [1]
+    assert ids(index.group(OWNER, collection, "camera_id", 2)) == [2]
+
+    # Another collection (file loaded) is indexed on its first lookup
+    other = [item(5, grid_id=5)]
+    assert ids(index.group(2, other, "grid_id", 5)) == [5]
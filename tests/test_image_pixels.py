@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from functions import utils
+
+
+class Pixels:
+    def __init__(self, values: np.ndarray):
+        self.values = values
+
+    def foreach_get(self, buffer: np.ndarray):
+        buffer[:] = self.values
+
+    def foreach_set(self, values: np.ndarray):
+        self.values = np.array(values)
+
+
+class FakeImage:
+    """The parts of `bpy.types.Image` the pixel functions use"""
+
+    def __init__(self, width: int, height: int, values=None):
+        self.size = (width, height)
+        self.channels = 4
+        if values is None:
+            values = np.zeros(width * height * 4, dtype=np.float32)
+        self.pixels = Pixels(values)
+
+    def scale(self, width: int, height: int):
+        self.size = (width, height)
+
+
+def fake_bpy(images: dict):
+    def new(name, width, height):
+        images[name] = FakeImage(width, height)
+        return images[name]
+
+    return SimpleNamespace(
+        data=SimpleNamespace(images=SimpleNamespace(get=images.get, new=new))
+    )
+
+
+def test_set_does_not_overwrite_a_read(monkeypatch):
+    monkeypatch.setattr(utils, "bpy", fake_bpy({}))
+    rng = np.random.default_rng(0)
+    source = FakeImage(8, 4, rng.random(8 * 4 * 4, dtype=np.float32))
+
+    read = utils.read_image_pixels(source)
+    expected = read.copy()
+    # Another image of the same size while the read is still in use
+    image = utils.set_image_pixels("other", np.full((4, 8), 255, dtype=np.uint8))
+
+    assert np.array_equal(read, expected)
+    assert np.all(image.pixels.values == 1)
+
+
+def test_set_image_pixels_flips_rows(monkeypatch):
+    monkeypatch.setattr(utils, "bpy", fake_bpy({}))
+    array = np.array([[0, 0], [255, 255]], dtype=np.uint8)
+
+    image = utils.set_image_pixels("mask", array)
+    pixels = image.pixels.values.reshape((2, 2, 4))
+    # Rows are bottom to top in blender
+    assert np.all(pixels[0, :, :3] == 1)
+    assert np.all(pixels[1, :, :3] == 0)
+    assert np.all(pixels[..., 3] == 1)
+
+
+def test_pixel_buffers_evict_one_size_at_a_time():
+    utils._pixel_buffers.clear()
+    buffers = [utils.get_pixel_buffer(size) for size in range(1, 5)]
+    assert utils.get_pixel_buffer(1) is buffers[0]
+
+    utils.get_pixel_buffer(5)
+    # The least recently used size is the only one forgotten
+    assert sorted(utils._pixel_buffers) == [1, 3, 4, 5]
+    assert utils.get_pixel_buffer(4) is buffers[3]
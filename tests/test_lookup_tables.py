@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+from functions.utils import (
+    LookupTable,
+    get_lut,
+    linear_to_srgb_array,
+    normalize_array,
+    process_depth_map,
+    reverse_color,
+)
+
+# Lookup tables may differ from the exact formulas by one 8 bit level
+MAX_ERROR = 1
+
+
+def values():
+    """[0, 1] densely, with the steep start of the sRGB curve and random values"""
+    rng = np.random.default_rng(0)
+    return np.concatenate(
+        [
+            np.linspace(0, 1, 1_000_001),
+            np.linspace(0, 0.01, 100_001),
+            rng.random(100_000),
+        ]
+    ).astype(np.float32)
+
+
+def error(result: np.ndarray, reference: np.ndarray) -> int:
+    return int(np.abs(result.astype(np.int16) - reference.astype(np.int16)).max())
+
+
+def depth_pass(depth: np.ndarray) -> np.ndarray:
+    """Depth pass as read from blender, rows bottom to top, depth in every channel"""
+    pixels = np.empty(depth.shape + (4,), dtype=np.float32)
+    pixels[..., :3] = depth[::-1, :, None]
+    pixels[..., 3] = 1
+    return pixels
+
+
+def sphere_depth(size: int) -> np.ndarray:
+    y, x = np.mgrid[0:size, 0:size] / size
+    sphere = 1 - ((x - 0.5) ** 2 + (y - 0.5) ** 2) * 4
+    return np.where(sphere > 0, 10 - 2 * np.sqrt(np.clip(sphere, 0, 1)), 1e10)
+
+
+def test_srgb_table():
+    samples = values()
+    result = get_lut("srgb").apply(samples)
+    assert result.dtype == np.uint8
+    assert error(result, linear_to_srgb_array(samples)) <= MAX_ERROR
+
+
+def test_srgb_inverted_table():
+    samples = values()
+    reference = reverse_color(linear_to_srgb_array(samples))
+    assert error(get_lut("srgb_inverted").apply(samples), reference) <= MAX_ERROR
+
+
+def test_table_clips_and_keeps_shape():
+    table = LookupTable(lambda samples: samples * 255, size=256)
+    result = table.apply(np.array([[-1.0, 0.0], [0.5, 2.0]]))
+    assert result.shape == (2, 2)
+    assert result.tolist() == [[0, 0], [128, 255]]
+
+
+@pytest.mark.parametrize("size", [64, 257])
+def test_depth_map_matches_exact_formula(size):
+    depth = sphere_depth(size)
+    depth_map = process_depth_map(depth_pass(depth))
+
+    background = depth.max()
+    farthest = depth[depth < background].max()
+    clamped = np.minimum(depth, farthest * 1.05)
+    reference = reverse_color(linear_to_srgb_array(normalize_array(clamped)))
+
+    assert depth_map.shape == (size, size)
+    assert depth_map.dtype == np.uint8
+    assert error(depth_map, reference) <= MAX_ERROR
+    # Near is bright, the background is black
+    assert depth_map[size // 2, size // 2] == 255
+    assert depth_map[0, 0] == 0
+
+
+def test_depth_map_of_background_only():
+    # Nothing in front of the far plane
+    assert process_depth_map(depth_pass(np.full((16, 16), 5.0))) is None
+
+
+def test_depth_map_of_flat_mesh():
+    # A single depth in front of the background : nothing to normalize
+    depth = np.full((16, 16), 1e10)
+    depth[4:12, 4:12] = 5.0
+    assert process_depth_map(depth_pass(depth)) is None
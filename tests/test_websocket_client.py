@@ -0,0 +1,219 @@
+import base64
+import hashlib
+import json
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from functions.websocket_client import (
+    OPCODE_CLOSE,
+    OPCODE_CONTINUATION,
+    OPCODE_PING,
+    OPCODE_PONG,
+    OPCODE_TEXT,
+    WS_GUID,
+    ComfyEventListener,
+    WebSocketConnection,
+    WebSocketError,
+)
+
+
+def accept_key(key: str) -> str:
+    return base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+
+
+def send_frame(conn: socket.socket, opcode: int, payload: bytes, fin: bool = True):
+    """Unmasked server frame"""
+    header = bytes([(0x80 if fin else 0) | opcode])
+    if len(payload) < 126:
+        header += bytes([len(payload)])
+    else:
+        header += bytes([126]) + struct.pack("!H", len(payload))
+    conn.sendall(header + payload)
+
+
+def recv_exact(conn: socket.socket, n: int) -> bytes:
+    data = b""
+    while len(data) < n:
+        chunk = conn.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("closed")
+        data += chunk
+    return data
+
+
+def recv_frame(conn: socket.socket):
+    """Masked client frame, as (opcode, payload)"""
+    b1, b2 = recv_exact(conn, 2)
+    assert b2 & 0x80, "client frames must be masked"
+    length = b2 & 0x7F
+    if length == 126:
+        (length,) = struct.unpack("!H", recv_exact(conn, 2))
+    mask = recv_exact(conn, 4)
+    payload = bytes(b ^ mask[i % 4] for i, b in enumerate(recv_exact(conn, length)))
+    return b1 & 0x0F, payload
+
+
+class StubServer:
+    """Local websocket server running `script(conn)` after each handshake"""
+
+    def __init__(self, script, accept=accept_key):
+        self.script = script
+        self.accept = accept
+        self.requests = []
+        self.errors = []
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen()
+        self.port = self.sock.getsockname()[1]
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            with conn:
+                try:
+                    request = b""
+                    while b"\r\n\r\n" not in request:
+                        request += conn.recv(4096)
+                    self.requests.append(request.decode())
+                    key = ""
+                    for line in request.decode().split("\r\n"):
+                        name, _, value = line.partition(":")
+                        if name.lower() == "sec-websocket-key":
+                            key = value.strip()
+                    conn.sendall(
+                        (
+                            "HTTP/1.1 101 Switching Protocols\r\n"
+                            "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                            f"Sec-WebSocket-Accept: {self.accept(key)}\r\n\r\n"
+                        ).encode()
+                    )
+                    self.script(conn)
+                except Exception as e:
+                    self.errors.append(e)
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.fixture
+def server():
+    servers = []
+
+    def start(script=lambda conn: None, **kwargs):
+        servers.append(StubServer(script, **kwargs))
+        return servers[-1]
+
+    yield start
+    for stub in servers:
+        stub.close()
+
+
+def test_handshake(server):
+    stub = server(lambda conn: recv_frame(conn))
+    connection = WebSocketConnection(f"ws://127.0.0.1:{stub.port}/ws?clientId=abc")
+    connection.close()
+    stub.thread.join(0.5)
+
+    request = stub.requests[0]
+    assert request.startswith("GET /ws?clientId=abc HTTP/1.1\r\n")
+    assert "Upgrade: websocket" in request
+    assert "Sec-WebSocket-Version: 13" in request
+
+
+def test_handshake_rejects_wrong_accept_key(server):
+    stub = server(accept=lambda key: accept_key("not the key"))
+    with pytest.raises(WebSocketError, match="Sec-WebSocket-Accept"):
+        WebSocketConnection(f"ws://127.0.0.1:{stub.port}/ws")
+
+
+def test_fragmented_message_with_ping(server):
+    pongs = []
+
+    def script(conn):
+        send_frame(conn, OPCODE_TEXT, b'{"type": ', fin=False)
+        # Control frames may come between the fragments of a message
+        send_frame(conn, OPCODE_PING, b"beat")
+        pongs.append(recv_frame(conn))
+        send_frame(conn, OPCODE_CONTINUATION, b'"status", ', fin=False)
+        send_frame(conn, OPCODE_CONTINUATION, b'"data": {}}')
+        recv_frame(conn)
+
+    stub = server(script)
+    connection = WebSocketConnection(f"ws://127.0.0.1:{stub.port}/ws")
+    opcode, payload = connection.recv()
+    connection.close()
+    stub.thread.join(0.5)
+
+    assert opcode == OPCODE_TEXT
+    assert json.loads(payload) == {"type": "status", "data": {}}
+    assert pongs == [(OPCODE_PONG, b"beat")]
+    assert not stub.errors
+
+
+def test_server_close(server):
+    replies = []
+
+    def script(conn):
+        send_frame(conn, OPCODE_CLOSE, struct.pack("!H", 1001))
+        replies.append(recv_frame(conn))
+
+    stub = server(script)
+    connection = WebSocketConnection(f"ws://127.0.0.1:{stub.port}/ws")
+    with pytest.raises(WebSocketError, match="closed"):
+        connection.recv()
+    connection.close()
+    stub.thread.join(0.5)
+
+    # The close frame is echoed with its status code
+    assert replies == [(OPCODE_CLOSE, struct.pack("!H", 1001))]
+
+
+def test_listener_routes_events(server):
+    images = [{"filename": "out_00001_.png", "subfolder": "", "type": "output"}]
+    events = [
+        {"type": "status", "data": {"status": {}}},
+        {"type": "execution_start", "data": {"prompt_id": "a"}},
+        {"type": "execution_start", "data": {"prompt_id": "b"}},
+        {"type": "executed", "data": {"prompt_id": "a", "output": {"images": images}}},
+        {
+            "type": "execution_error",
+            "data": {"prompt_id": "b", "exception_message": "Out of memory"},
+        },
+    ]
+    done = threading.Event()
+
+    def script(conn):
+        for event in events:
+            send_frame(conn, OPCODE_TEXT, json.dumps(event).encode())
+        done.set()
+        # Until the listener stops
+        while recv_frame(conn)[0] != OPCODE_CLOSE:
+            pass
+
+    stub = server(script)
+    listener = ComfyEventListener(f"http://127.0.0.1:{stub.port}")
+    listener.start()
+    try:
+        assert listener.wait_connected(2)
+        assert done.wait(2)
+        deadline = time.monotonic() + 2
+        while listener.pop_error("b") is None:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+        assert listener.has_started("a")
+        assert listener.pop_result("a") == images
+        assert not listener.has_started("a")
+        assert listener.pop_result("b") is None
+        assert f"clientId={listener.client_id}" in stub.requests[0]
+    finally:
+        listener.stop()